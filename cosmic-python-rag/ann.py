@@ -0,0 +1,384 @@
+import time
+import numpy as np
+from scipy import sparse
+from cosmic-python-rag_rag.config import ANN_BACKEND, ANN_EVAL_QUERIES, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH, HNSW_M, IVF_KMEANS_ITERATIONS, IVF_NLIST, IVF_NPROBE, IVF_TRAINING_SAMPLE, PROCESSED_DIR, TOP_N_SECTIONS
+from cosmic-python-rag_rag.vector_index import VectorIndex, atomic_write, top_k
+
+IVF_FILENAME = 'ann_ivf.npz'
+FAISS_FILENAME = 'ann_faiss.index'
+HNSWLIB_FILENAME = 'ann_hnswlib.bin'
+
+
+def prepare_query(query_embedding):
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    return query / norm if norm else query
+
+
+class ExactSearch:
+    """
+    Brute-force search over every chunk, used as the reference for the approximate backends.
+    """
+    name = 'exact'
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.search_budget = None
+
+    @classmethod
+    def build(cls, matrix):
+        return cls(matrix)
+
+    def save(self, directory):
+        pass
+
+    @classmethod
+    def load(cls, directory, matrix):
+        return cls(matrix)
+
+    def search(self, query_embedding, k):
+        """
+        Find the k chunks most similar to the query.
+
+        Parameters:
+        query_embedding (list): The embedding of the query.
+        k (int): The number of chunks to return.
+
+        Returns:
+        tuple: Row indices into the chunk matrix and their similarity scores.
+        """
+        scores = np.asarray(self.matrix @ prepare_query(query_embedding))
+        rows = top_k(scores, k)
+        return rows, scores[rows]
+
+
+def assign_clusters(matrix, centroids, chunk_size=8192):
+    """
+    Get the index of the most similar centroid for every row, in chunks to bound memory use.
+    """
+    return np.concatenate([
+        np.argmax(np.asarray(matrix[start:start + chunk_size], dtype=np.float32) @ centroids.T, axis=1)
+        for start in range(0, len(matrix), chunk_size)
+    ])
+
+
+def spherical_kmeans(matrix, num_clusters, iterations, seed=0):
+    """
+    Cluster unit vectors by cosine similarity.
+
+    Parameters:
+    matrix (np.ndarray): Normalized vectors, one per row.
+    num_clusters (int): The number of clusters.
+    iterations (int): The number of assignment/update rounds.
+    seed (int): The random seed for the initial centroids.
+
+    Returns:
+    np.ndarray: Normalized centroids, one per row.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = matrix[rng.choice(len(matrix), num_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_clusters(matrix, centroids)
+        # Sum the members of every cluster with one sparse product
+        membership = sparse.csr_matrix(
+            (np.ones(len(matrix), dtype=np.float32), (assignments, np.arange(len(matrix)))),
+            shape=(num_clusters, len(matrix)),
+        )
+        sums = np.asarray(membership @ matrix)
+        empty = np.asarray(membership.sum(axis=1)).ravel() == 0
+        sums[empty] = matrix[rng.choice(len(matrix), int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted file index in pure NumPy.
+
+    Chunks are clustered around nlist centroids; a query is scored only against the
+    chunks of its search_budget (nprobe) closest clusters. Raising nprobe trades latency
+    for recall, up to exact search when it equals nlist.
+    """
+    name = 'ivf'
+
+    def __init__(self, matrix, centroids, order, offsets, nprobe=IVF_NPROBE):
+        """
+        Parameters:
+        matrix (np.ndarray): The normalized chunk matrix of the vector index.
+        centroids (np.ndarray): Normalized cluster centroids.
+        order (np.ndarray): Chunk rows sorted by cluster.
+        offsets (np.ndarray): Start of every cluster in order, plus the end of the last one.
+        nprobe (int): The number of clusters searched per query.
+        """
+        self.matrix = matrix
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.search_budget = nprobe
+
+    @classmethod
+    def build(cls, matrix, nlist=IVF_NLIST, iterations=IVF_KMEANS_ITERATIONS, training_sample=IVF_TRAINING_SAMPLE):
+        """
+        Build the index by clustering the chunk embeddings.
+
+        Parameters:
+        matrix (np.ndarray): The normalized chunk matrix of the vector index.
+        nlist (int): The number of clusters, or None for 4 * sqrt(number of chunks).
+        iterations (int): The number of k-means iterations.
+        training_sample (int): The maximum number of chunks used to fit the centroids.
+
+        Returns:
+        IVFIndex: The built index.
+        """
+        num_rows = len(matrix)
+        if not num_rows:
+            return cls(matrix, np.zeros((0, matrix.shape[1]), dtype=np.float32), np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64))
+        nlist = min(nlist or int(4 * np.sqrt(num_rows)), num_rows)
+
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(num_rows, min(training_sample, num_rows), replace=False))
+        centroids = spherical_kmeans(np.asarray(matrix[sample], dtype=np.float32), min(nlist, len(sample)), iterations)
+
+        assignments = assign_clusters(matrix, centroids)
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=len(centroids)))])
+        return cls(matrix, centroids, order, offsets)
+
+    def save(self, directory):
+        with atomic_write(directory / IVF_FILENAME) as f:
+            np.savez(f, centroids=self.centroids, order=self.order, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, directory, matrix):
+        with np.load(directory / IVF_FILENAME) as ivf:
+            if len(ivf['order']) != len(matrix):
+                raise ValueError(f"{IVF_FILENAME} does not match the chunk matrix")
+            return cls(matrix, ivf['centroids'], ivf['order'], ivf['offsets'])
+
+    def search(self, query_embedding, k):
+        """
+        Find approximately the k chunks most similar to the query.
+
+        Parameters:
+        query_embedding (list): The embedding of the query.
+        k (int): The number of chunks to return.
+
+        Returns:
+        tuple: Row indices into the chunk matrix and their similarity scores.
+        """
+        query = prepare_query(query_embedding)
+        clusters = top_k(self.centroids @ query, self.search_budget)
+        if not len(clusters):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        # Sorted rows read the memory-mapped matrix front to back
+        rows = np.sort(np.concatenate([self.order[self.offsets[cluster]:self.offsets[cluster + 1]] for cluster in clusters]))
+        scores = np.asarray(self.matrix[rows] @ query)
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+
+class FaissIndex:
+    """
+    Adapter for a faiss IVF index (requires the optional faiss package).
+    """
+    name = 'faiss'
+
+    def __init__(self, index, nprobe=IVF_NPROBE):
+        self.index = index
+        self.search_budget = nprobe
+
+    @classmethod
+    def build(cls, matrix, nlist=IVF_NLIST):
+        import faiss
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        nlist = min(nlist or int(4 * np.sqrt(len(matrix))), len(matrix))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(matrix.shape[1]), matrix.shape[1], nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(matrix)
+        index.add(matrix)
+        return cls(index)
+
+    def save(self, directory):
+        import faiss
+        faiss.write_index(self.index, str(directory / FAISS_FILENAME))
+
+    @classmethod
+    def load(cls, directory, matrix):
+        import faiss
+        index = faiss.read_index(str(directory / FAISS_FILENAME))
+        if index.ntotal != len(matrix) or index.d != matrix.shape[1]:
+            raise ValueError(f"{FAISS_FILENAME} does not match the chunk matrix")
+        return cls(index)
+
+    def search(self, query_embedding, k):
+        self.index.nprobe = self.search_budget
+        scores, rows = self.index.search(prepare_query(query_embedding)[None, :], k)
+        found = rows[0] >= 0
+        return rows[0][found].astype(np.int64), scores[0][found]
+
+
+class HnswlibIndex:
+    """
+    Adapter for an hnswlib HNSW graph (requires the optional hnswlib package).
+    """
+    name = 'hnswlib'
+
+    def __init__(self, index, ef=HNSW_EF_SEARCH):
+        self.index = index
+        self.search_budget = ef
+
+    @classmethod
+    def build(cls, matrix, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION):
+        import hnswlib
+        index = hnswlib.Index(space='ip', dim=matrix.shape[1])
+        index.init_index(max_elements=max(len(matrix), 1), ef_construction=ef_construction, M=m)
+        if len(matrix):
+            index.add_items(np.asarray(matrix, dtype=np.float32), np.arange(len(matrix)))
+        return cls(index)
+
+    def save(self, directory):
+        self.index.save_index(str(directory / HNSWLIB_FILENAME))
+
+    @classmethod
+    def load(cls, directory, matrix):
+        import hnswlib
+        index = hnswlib.Index(space='ip', dim=matrix.shape[1])
+        # Loaded with its saved capacity, since a stale index may hold more chunks than the matrix
+        index.load_index(str(directory / HNSWLIB_FILENAME))
+        if index.get_current_count() != len(matrix):
+            raise ValueError(f"{HNSWLIB_FILENAME} does not match the chunk matrix")
+        return cls(index)
+
+    def search(self, query_embedding, k):
+        k = min(k, self.index.get_current_count())
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        self.index.set_ef(max(self.search_budget, k))
+        rows, distances = self.index.knn_query(prepare_query(query_embedding), k=k)
+        # hnswlib reports inner product distance as 1 - similarity
+        return rows[0].astype(np.int64), 1 - distances[0]
+
+
+ANN_BACKENDS = {backend.name: backend for backend in (ExactSearch, IVFIndex, FaissIndex, HnswlibIndex)}
+
+
+def get_backend(backend):
+    try:
+        return ANN_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown ANN backend: {backend}. Choose one of {', '.join(ANN_BACKENDS)}")
+
+
+def build_ann_index(matrix, backend=ANN_BACKEND):
+    """
+    Build an ANN index over the chunk matrix.
+
+    Parameters:
+    matrix (np.ndarray): The normalized chunk matrix of the vector index.
+    backend (str): 'exact', 'ivf', 'faiss' or 'hnswlib'.
+
+    Returns:
+    The built index.
+    """
+    return get_backend(backend).build(matrix)
+
+
+def load_ann_index(directory, matrix, backend=ANN_BACKEND):
+    """
+    Load the ANN index saved next to the chunk matrix, building it if it is missing or stale.
+
+    Parameters:
+    directory (Path): The directory containing the store.
+    matrix (np.ndarray): The normalized chunk matrix of the vector index.
+    backend (str): 'exact', 'ivf', 'faiss' or 'hnswlib'.
+
+    Returns:
+    The loaded index.
+    """
+    backend_class = get_backend(backend)
+    try:
+        return backend_class.load(directory, matrix)
+    except (FileNotFoundError, RuntimeError, ValueError):
+        # faiss and hnswlib raise RuntimeError for missing files; ValueError marks a stale index
+        return backend_class.build(matrix)
+
+
+def make_eval_queries(matrix, num_queries, noise=0.5, seed=0):
+    """
+    Make query embeddings near random chunks, so no embedding API calls are needed.
+    """
+    rng = np.random.default_rng(seed)
+    queries = np.asarray(matrix[rng.choice(len(matrix), num_queries)], dtype=np.float32)
+    queries += rng.standard_normal(queries.shape).astype(np.float32) * noise / np.sqrt(matrix.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def evaluate_recall(ann_index, matrix, queries, k=TOP_N_SECTIONS):
+    """
+    Compare an ANN index against exact search.
+
+    Parameters:
+    ann_index: The ANN index to evaluate.
+    matrix (np.ndarray): The normalized chunk matrix the index was built from.
+    queries (np.ndarray): Query embeddings, one per row.
+    k (int): The number of chunks retrieved per query.
+
+    Returns:
+    dict: Mean recall@k and p50/p95 search latency in milliseconds for the ANN index and exact search.
+    """
+    exact = ExactSearch(matrix)
+    recalls = []
+    ann_latencies = []
+    exact_latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        exact_rows, _ = exact.search(query, k)
+        exact_latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        ann_rows, _ = ann_index.search(query, k)
+        ann_latencies.append(time.perf_counter() - start)
+
+        recalls.append(len(np.intersect1d(exact_rows, ann_rows)) / max(len(exact_rows), 1))
+
+    ann_p50, ann_p95 = np.percentile(np.array(ann_latencies) * 1000, [50, 95])
+    exact_p50, exact_p95 = np.percentile(np.array(exact_latencies) * 1000, [50, 95])
+    return {
+        'search_budget': ann_index.search_budget,
+        f'recall_at_{k}': float(np.mean(recalls)),
+        'ann_p50_ms': float(ann_p50),
+        'ann_p95_ms': float(ann_p95),
+        'exact_p50_ms': float(exact_p50),
+        'exact_p95_ms': float(exact_p95),
+    }
+
+
+def run_ann_evaluation(directory=PROCESSED_DIR, backend=ANN_BACKEND, budgets=None, num_queries=ANN_EVAL_QUERIES, k=TOP_N_SECTIONS):
+    """
+    Print the recall and latency of an ANN backend against exact search on the stored chunks.
+
+    Parameters:
+    directory (Path): The directory containing the store.
+    backend (str): 'ivf', 'faiss' or 'hnswlib'.
+    budgets (list): Search budgets to sweep (nprobe for IVF, ef for HNSW); the configured one if None.
+    num_queries (int): The number of evaluation queries.
+    k (int): The number of chunks retrieved per query.
+
+    Returns:
+    list: One result dict per search budget.
+    """
+    matrix = VectorIndex.load(directory).chunk_matrix
+    ann_index = load_ann_index(directory, matrix, backend)
+    queries = make_eval_queries(matrix, num_queries)
+    results = []
+    for budget in budgets or [ann_index.search_budget]:
+        ann_index.search_budget = budget
+        result = evaluate_recall(ann_index, matrix, queries, k)
+        results.append(result)
+        print(
+            f"{backend} budget {budget}: recall@{k} {result[f'recall_at_{k}']:.3f}, "
+            f"p50 {result['ann_p50_ms']:.2f} ms (exact {result['exact_p50_ms']:.2f} ms), "
+            f"p95 {result['ann_p95_ms']:.2f} ms (exact {result['exact_p95_ms']:.2f} ms)"
+        )
+    return results
@@ -0,0 +1,233 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from cosmic-python-rag_rag.config import ANSWER_CACHE_ENABLED, ANSWER_CACHE_MAX_ITEMS, ANSWER_CACHE_PATH, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL, OPENAI_MODEL_GPT, RAG_PROMPT
+from cosmic-python-rag_rag.data.cache import make_key
+from cosmic-python-rag_rag.generation import ERROR_ANSWER
+from cosmic-python-rag_rag.instrumentation import count
+from cosmic-python-rag_rag.retreival import section_id
+
+
+def sources_key(top_sections):
+    """
+    Build the key of the sections an answer was generated from.
+
+    Sections are identified by chapter number and title, so the key survives re-indexing
+    as long as the sections do. The order of the sections is ignored.
+
+    Parameters:
+    top_sections (list): The retrieved sections.
+
+    Returns:
+    str: The key of the sections, the generation model and the prompt.
+    """
+    section_ids = sorted(section_id(section) for section in top_sections)
+    return make_key('answer', OPENAI_MODEL_GPT, RAG_PROMPT + '\0' + '\0'.join(section_ids))
+
+
+def normalize_query(query):
+    """
+    Normalize the text of a query for exact matching, ignoring case and whitespace.
+    """
+    return ' '.join(query.lower().split()) if query else None
+
+
+class AnswerCache:
+    """
+    Cache of generated answers, looked up by query embedding or query text.
+
+    An answer is reused for a new query when both were answered from the same sections and
+    the cosine similarity of their embeddings is at least the threshold, or their normalized
+    texts are equal (queries answered by BM25 alone are not embedded). Entries expire after
+    ttl seconds and the least recently used ones are evicted beyond max_items. With a path,
+    the entries are also kept in SQLite and loaded back on start. Safe to share between threads.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, max_items=ANSWER_CACHE_MAX_ITEMS, path=None):
+        """
+        Parameters:
+        threshold (float): The minimum cosine similarity of the query embeddings for a hit.
+        ttl (float): The number of seconds an answer is reused for.
+        max_items (int): The maximum number of cached answers.
+        path (Path): The SQLite database file, or None to keep the answers in memory only.
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_items = max_items
+        # entry id -> (sources key, normalized query embedding or None, answer, creation time, normalized query text or None)
+        self.entries = OrderedDict()
+        self.by_sources = {}
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.connection = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(str(path), check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "id INTEGER PRIMARY KEY, sources_key TEXT NOT NULL, embedding BLOB NOT NULL, "
+                "answer TEXT NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            columns = {row[1] for row in self.connection.execute("PRAGMA table_info(answers)")}
+            if 'query' not in columns:
+                # Answer caches written before answers were also looked up by query text
+                self.connection.execute("ALTER TABLE answers ADD COLUMN query TEXT")
+            self.connection.execute("DELETE FROM answers WHERE created < ?", (time.time() - ttl,))
+            self.connection.commit()
+            self._load()
+
+    def _load(self):
+        records = self.connection.execute(
+            "SELECT id, sources_key, embedding, answer, created, query FROM answers ORDER BY last_access DESC LIMIT ?",
+            (self.max_items,)
+        ).fetchall()
+        for entry_id, key, embedding, answer, created, query in reversed(records):
+            # Answers to queries that were not embedded are stored with an empty embedding
+            self._add(entry_id, key, np.frombuffer(embedding, dtype=np.float32) if embedding else None, answer, created, query)
+        self.next_id = max((record[0] for record in records), default=-1) + 1
+        self.connection.execute(
+            "DELETE FROM answers WHERE id NOT IN (SELECT id FROM answers ORDER BY last_access DESC LIMIT ?)",
+            (self.max_items,)
+        )
+        self.connection.commit()
+
+    def _add(self, entry_id, key, embedding, answer, created, query=None):
+        self.entries[entry_id] = (key, embedding, answer, created, query)
+        self.by_sources.setdefault(key, set()).add(entry_id)
+
+    def _remove(self, entry_id):
+        key = self.entries.pop(entry_id)[0]
+        entry_ids = self.by_sources[key]
+        entry_ids.discard(entry_id)
+        if not entry_ids:
+            del self.by_sources[key]
+        if self.connection is not None:
+            self.connection.execute("DELETE FROM answers WHERE id = ?", (entry_id,))
+
+    def get(self, query_embedding, top_sections, query=None):
+        """
+        Get a cached answer for the query.
+
+        Parameters:
+        query_embedding (list): The embedding of the query, or None if it was not embedded.
+        top_sections (list): The sections retrieved for the query.
+        query (str): The text of the query, matched exactly after normalization.
+
+        Returns:
+        str: The cached answer, or None if there is no answer for a similar query and the same sections.
+        """
+        key = sources_key(top_sections)
+        query_text = normalize_query(query)
+        now = time.time()
+        with self.lock:
+            entry_ids = [
+                entry_id for entry_id in self.by_sources.get(key, ())
+                if now - self.entries[entry_id][3] <= self.ttl
+            ]
+            best_id = next((entry_id for entry_id in entry_ids if query_text is not None and self.entries[entry_id][4] == query_text), None)
+            embedded_ids = [entry_id for entry_id in entry_ids if self.entries[entry_id][1] is not None]
+            if best_id is None and query_embedding is not None and embedded_ids:
+                embedding = np.asarray(query_embedding, dtype=np.float32)
+                embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+                similarities = np.stack([self.entries[entry_id][1] for entry_id in embedded_ids]) @ embedding
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    best_id = embedded_ids[best]
+            if best_id is None:
+                self.misses += 1
+                count('cache_lookups', cache='answer', result='miss')
+                return None
+            self.hits += 1
+            count('cache_lookups', cache='answer', result='hit')
+            self.entries.move_to_end(best_id)
+            if self.connection is not None:
+                self.connection.execute("UPDATE answers SET last_access = ? WHERE id = ?", (now, best_id))
+                self.connection.commit()
+            return self.entries[best_id][2]
+
+    def put(self, query_embedding, top_sections, answer, query=None):
+        """
+        Store the answer to a query, evicting expired and least recently used answers.
+
+        Error answers are not stored.
+
+        Parameters:
+        query_embedding (list): The embedding of the query, or None if it was not embedded.
+        top_sections (list): The sections the answer was generated from.
+        answer (str): The generated answer.
+        query (str): The text of the query.
+        """
+        if not answer or answer.endswith(ERROR_ANSWER) or (query_embedding is None and not query):
+            return
+        key = sources_key(top_sections)
+        embedding = None
+        if query_embedding is not None:
+            embedding = np.asarray(query_embedding, dtype=np.float32)
+            embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        query_text = normalize_query(query)
+        now = time.time()
+        with self.lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self._add(entry_id, key, embedding, answer, now, query_text)
+            if self.connection is not None:
+                self.connection.execute(
+                    "INSERT INTO answers (id, sources_key, embedding, answer, created, last_access, query) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (entry_id, key, embedding.tobytes() if embedding is not None else b'', answer, now, now, query_text)
+                )
+            expired = [other_id for other_id, entry in self.entries.items() if now - entry[3] > self.ttl]
+            for expired_id in expired:
+                self._remove(expired_id)
+            while len(self.entries) > self.max_items:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+            if self.connection is not None:
+                self.connection.commit()
+
+    def stats(self):
+        """
+        Get the hit and miss counts of the cache.
+
+        Returns:
+        dict: The hits, misses, hit rate, evictions and number of cached answers.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+            }
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """
+    Get the shared answer cache, stored at ANSWER_CACHE_PATH if it is set, creating it on first use.
+
+    Returns:
+    AnswerCache: The shared answer cache, or None if answer caching is disabled.
+    """
+    global _answer_cache
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache(path=ANSWER_CACHE_PATH)
+        return _answer_cache
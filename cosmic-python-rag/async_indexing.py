@@ -0,0 +1,287 @@
+import asyncio
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+import openai
+from tqdm import tqdm
+from cosmic-python-rag_rag.config import (
+    EMBEDDING_BATCH_MAX_ITEMS, EMBEDDING_BATCH_MAX_TOKENS, INDEXING_CONCURRENCY, OPENAI_MODEL_EMB, OPENAI_MODEL_GPT, PARSING_WORKERS, PROCESSED_DIR, RAW_DIR, RETRY_BASE_DELAY, RETRY_MAX_ATTEMPTS,
+    RETRY_MAX_DELAY, SUMMARY_PROMPT, TEMPERATURE
+)
+from cosmic-python-rag_rag.clients import close_async_client, get_async_client
+from cosmic-python-rag_rag.data.chunking import chunk_section
+from cosmic-python-rag_rag.data.data_cleaning import list_chapter_files, parse_chapter_file
+from cosmic-python-rag_rag.data.fingerprints import chapter_fingerprint, hash_file, save_fingerprints
+from cosmic-python-rag_rag.data.embeddings import get_cached_embeddings, make_batches, store_embeddings
+from cosmic-python-rag_rag.data.generate_summaries import get_cached_summary, store_summary
+from cosmic-python-rag_rag.data.keywords_extraction import extract_keywords
+from cosmic-python-rag_rag.data.store import save_processed_data
+from cosmic-python-rag_rag.indexing import get_chapter_text
+from cosmic-python-rag_rag.instrumentation import count_usage, span
+
+
+def is_retryable(error):
+    """
+    Check whether an OpenAI error is worth retrying (rate limits, server errors and connection problems).
+
+    Parameters:
+    error (Exception): The raised exception.
+
+    Returns:
+    bool: True if the request should be retried.
+    """
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, openai.APIConnectionError)
+
+
+async def with_retries(make_request, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    """
+    Run an API request, retrying with exponential backoff and full jitter on retryable errors.
+
+    Parameters:
+    make_request (callable): A function returning a new awaitable for each attempt.
+    max_attempts (int): The maximum number of attempts.
+    base_delay (float): The backoff delay in seconds before the first retry.
+    max_delay (float): The upper bound of the backoff delay in seconds.
+
+    Returns:
+    The result of the request.
+    """
+    for attempt in range(max_attempts):
+        try:
+            return await make_request()
+        except Exception as e:
+            if attempt == max_attempts - 1 or not is_retryable(e):
+                raise
+            await asyncio.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+
+def extract_keywords_timed(processed_data):
+    with span('indexing.keywords'):
+        return extract_keywords(processed_data)
+
+
+class AsyncIndexer:
+    """
+    Index chapters concurrently with the async OpenAI client.
+
+    Summary and embedding requests for all chapters run in parallel, bounded by a semaphore,
+    so indexing time is set by the API rate limits rather than by summed round-trip latency.
+    """
+
+    def __init__(self, client, concurrency=INDEXING_CONCURRENCY):
+        """
+        Parameters:
+        client (openai.AsyncOpenAI): The async OpenAI client.
+        concurrency (int): The maximum number of requests in flight.
+        """
+        self.client = client
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.progress = {}
+
+    def _start_stage(self, name, total):
+        self.progress[name] = tqdm(total=total, desc=name, position=len(self.progress))
+
+    def _close_stages(self):
+        for pbar in self.progress.values():
+            pbar.close()
+
+    async def _request(self, make_request):
+        async with self.semaphore:
+            return await with_retries(make_request)
+
+    async def generate_summary(self, chapter_text):
+        """
+        Generate a chapter summary.
+
+        Parameters:
+        chapter_text (str): The text content of the chapter to be summarized.
+
+        Returns:
+        str: The generated summary of the chapter.
+        """
+        cached = get_cached_summary(chapter_text)
+        if cached is not None:
+            self.progress['Summaries'].update(1)
+            return cached
+
+        with span('indexing.summary'):
+            response = await self._request(lambda: self.client.chat.completions.create(
+                model=OPENAI_MODEL_GPT,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": chapter_text}
+                ],
+                max_tokens=150,
+                temperature=TEMPERATURE,
+            ))
+        count_usage(response.usage, OPENAI_MODEL_GPT)
+        summary = response.choices[0].message.content.strip()
+        store_summary(chapter_text, summary)
+        self.progress['Summaries'].update(1)
+        return summary
+
+    async def embed(self, texts):
+        """
+        Generate embeddings for many texts, sending the batches concurrently.
+
+        Parameters:
+        texts (list): The input texts.
+
+        Returns:
+        list: The embedding vectors, in the same order as texts.
+        """
+        embeddings = get_cached_embeddings(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        self.progress['Embeddings'].update(len(texts) - len(missing))
+
+        async def embed_batch(batch):
+            batch = [missing[i] for i in batch]
+            with span('indexing.embedding_batch', texts=len(batch)):
+                response = await self._request(lambda: self.client.embeddings.create(
+                    input=[texts[i] for i in batch],
+                    model=OPENAI_MODEL_EMB
+                ))
+            count_usage(response.usage, OPENAI_MODEL_EMB)
+            for item in response.data:
+                embeddings[batch[item.index]] = item.embedding
+            store_embeddings([texts[i] for i in batch], [embeddings[i] for i in batch])
+            self.progress['Embeddings'].update(len(batch))
+
+        await asyncio.gather(*[
+            embed_batch(batch)
+            for batch in make_batches([texts[i] for i in missing], EMBEDDING_BATCH_MAX_ITEMS, EMBEDDING_BATCH_MAX_TOKENS)
+        ])
+        return embeddings
+
+    async def index_chapter(self, chapter_num, chapter_content, section_chunks):
+        """
+        Summarize a chapter and embed the chunks of its sections.
+
+        Parameters:
+        chapter_num (str): The chapter number.
+        chapter_content (dict): The parsed chapter containing 'title' and 'sections'.
+        section_chunks (list): The chunk texts of each section (see data.chunking).
+
+        Returns:
+        dict: The processed chapter data.
+        """
+        sections = chapter_content['sections']
+        summary, chunk_embeddings = await asyncio.gather(
+            self.generate_summary(get_chapter_text(chapter_content)),
+            self.embed([chunk for chunks in section_chunks for chunk in chunks]),
+        )
+        start = 0
+        for section, chunks in zip(sections, section_chunks):
+            section['chunk_embeddings'] = chunk_embeddings[start:start + len(chunks)]
+            start += len(chunks)
+
+        return {
+            'chapter_title': chapter_content['title'],
+            'chapter_summary': summary,
+            'chapter_keywords': [],
+            'sections': sections
+        }
+
+    async def parse(self, chapter_files, workers=PARSING_WORKERS):
+        """
+        Parse chapter files in a process pool, one chapter per worker.
+
+        Parameters:
+        chapter_files (dict): Chapter numbers mapped to the paths of their HTML files.
+        workers (int): The number of worker processes, or None for the number of CPUs.
+
+        Returns:
+        dict: Chapter numbers mapped to the parsed chapters, in the order of chapter_files.
+        """
+        loop = asyncio.get_running_loop()
+        workers = max(1, min(workers or os.cpu_count() or 1, len(chapter_files)))
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            async def parse_chapter(html_path):
+                chapter_content = await loop.run_in_executor(executor, parse_chapter_file, html_path)
+                self.progress['Parsing'].update(1)
+                return chapter_content
+
+            parsed = await asyncio.gather(*[parse_chapter(html_path) for html_path in chapter_files.values()])
+        return dict(zip(chapter_files.keys(), parsed))
+
+    async def run(self, chapter_files):
+        """
+        Process all chapters concurrently.
+
+        Parameters:
+        chapter_files (dict): Chapter numbers mapped to the paths of their HTML files.
+
+        Returns:
+        dict: The processed data, in chapter order.
+        """
+        try:
+            self._start_stage('Parsing', len(chapter_files))
+            with span('indexing.parsing', chapters=len(chapter_files)):
+                parsed = await self.parse(chapter_files)
+
+            self._start_stage('Summaries', len(parsed))
+            self._start_stage('Keywords', len(parsed))
+            section_chunks = {
+                chapter_num: [chunk_section(section) for section in content['sections']]
+                for chapter_num, content in parsed.items()
+            }
+            self._start_stage('Embeddings', sum(len(chunks) for sections in section_chunks.values() for chunks in sections) + len(parsed))
+            # Keywords are extracted once over the whole corpus in a worker thread, while the API requests run
+            with span('indexing.chapters', chapters=len(parsed)):
+                chapter_keywords, *chapter_records = await asyncio.gather(
+                    asyncio.to_thread(extract_keywords_timed, parsed),
+                    *[
+                        self.index_chapter(chapter_num, chapter_content, section_chunks[chapter_num])
+                        for chapter_num, chapter_content in parsed.items()
+                    ],
+                )
+            self.progress['Keywords'].update(len(parsed))
+            processed_data = dict(zip(parsed.keys(), chapter_records))
+            for chapter_num, chapter_data in processed_data.items():
+                chapter_data['chapter_keywords'] = chapter_keywords[chapter_num]
+
+            with span('indexing.summary_embeddings'):
+                summary_embeddings = await self.embed([chapter_data['chapter_summary'] for chapter_data in chapter_records])
+            for chapter_data, embedding in zip(chapter_records, summary_embeddings):
+                chapter_data['chapter_summary_embedding'] = embedding
+        finally:
+            self._close_stages()
+
+        return processed_data
+
+
+async def process_and_index_chapters_async(concurrency=INDEXING_CONCURRENCY, raw_dir=RAW_DIR, processed_dir=PROCESSED_DIR):
+    """
+    Async variant of indexing.process_and_index_chapters.
+
+    Parameters:
+    concurrency (int): The maximum number of OpenAI requests in flight.
+    raw_dir (Path): The directory containing the chapter HTML files of the book.
+    processed_dir (Path): The directory to write the store of the book to.
+    """
+    print("Starting async indexing...")
+    chapter_files = list_chapter_files(raw_dir)
+    print(f"Found {len(chapter_files)} chapters")
+
+    # Retries are handled by with_retries, so the shared client's own retry loop is disabled
+    client = get_async_client().with_options(max_retries=0)
+    try:
+        processed_data = await AsyncIndexer(client, concurrency).run(chapter_files)
+    finally:
+        await close_async_client()
+
+    with span('indexing.save'):
+        save_processed_data(processed_data, processed_dir)
+        save_fingerprints({
+            chapter_num: chapter_fingerprint(hash_file(chapter_files[chapter_num]), chapter_data['sections'])
+            for chapter_num, chapter_data in processed_data.items()
+        }, processed_dir)
+    print("Saved processed data to the embedding store")
+    print("Indexing completed.")
+
+
+if __name__ == "__main__":
+    asyncio.run(process_and_index_chapters_async())
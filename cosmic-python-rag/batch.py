@@ -0,0 +1,203 @@
+import asyncio
+import json
+import numpy as np
+from tqdm import tqdm
+from cosmic-python-rag_rag.answer_cache import get_answer_cache
+from cosmic-python-rag_rag.async_indexing import with_retries
+from cosmic-python-rag_rag.clients import close_async_client, get_async_client
+from cosmic-python-rag_rag.config import BATCH_CONCURRENCY, GENERATION_MAX_TOKENS, OPENAI_MODEL_GPT, TEMPERATURE
+from cosmic-python-rag_rag.data.embeddings import get_embeddings_batch
+from cosmic-python-rag_rag.generation import build_messages
+from cosmic-python-rag_rag.instrumentation import count_usage, span
+from cosmic-python-rag_rag.registry import load_registry
+from cosmic-python-rag_rag.retreival import section_id
+
+
+def read_questions(path):
+    """
+    Read the questions of a batch.
+
+    Each line of the JSONL file is {"query": "..."} with an optional "id"; the line number is used when there is no id.
+
+    Parameters:
+    path (Path): The questions file.
+
+    Returns:
+    list: (id, query) tuples.
+    """
+    questions = []
+    with open(path, 'r') as questions_file:
+        for line_number, line in enumerate(questions_file, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            query = str(entry.get('query', '')).strip()
+            if not query:
+                raise ValueError(f"{path} line {line_number} has no 'query'")
+            questions.append((str(entry.get('id', line_number)), query))
+    return questions
+
+
+def read_answered_ids(path):
+    """
+    Read the ids already answered in an output file, so an interrupted batch can be resumed.
+
+    Lines cut off by an interruption and failed answers are not counted, so they are answered again.
+
+    Parameters:
+    path (Path): The output file.
+
+    Returns:
+    set: The answered ids.
+    """
+    answered = set()
+    if not path.exists():
+        return answered
+    with open(path, 'r') as output_file:
+        for line in output_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not record.get('error'):
+                answered.add(record['id'])
+    return answered
+
+
+def source_record(section):
+    return {
+        'id': section_id(section),
+        'chapter_title': section['chapter_title'],
+        'similarity_score': section['similarity_score'],
+        'score_type': section.get('score_type'),
+    }
+
+
+async def generate_batch_answer(client, query, top_sections):
+    """
+    Generate an answer with retries on rate limits and server errors.
+
+    Parameters:
+    client (openai.AsyncOpenAI): The async OpenAI client.
+    query (str): The input query.
+    top_sections (list): The sections retrieved for the query.
+
+    Returns:
+    tuple: The answer and the context report of build_context.
+    """
+    report = {}
+    messages = build_messages(query, top_sections, report)
+    with span('generation', model=OPENAI_MODEL_GPT):
+        response = await with_retries(lambda: client.chat.completions.create(
+            model=OPENAI_MODEL_GPT,
+            messages=messages,
+            max_tokens=GENERATION_MAX_TOKENS,
+            temperature=TEMPERATURE,
+        ))
+    count_usage(response.usage, OPENAI_MODEL_GPT)
+    return response.choices[0].message.content.strip(), report
+
+
+async def answer_questions(questions, retrievals, query_embeddings, output_file, concurrency):
+    """
+    Generate the answers with at most concurrency requests in flight, writing each one as it completes.
+
+    Parameters:
+    questions (list): (id, query) tuples.
+    retrievals (list): The top sections and matched keywords of each question.
+    query_embeddings (np.ndarray): The query embeddings, used for the answer cache.
+    output_file (file): The JSONL output, opened for appending.
+    concurrency (int): The maximum number of generation requests in flight.
+
+    Returns:
+    int: The number of questions that failed.
+    """
+    answer_cache = get_answer_cache()
+    semaphore = asyncio.Semaphore(concurrency)
+    # Retries are handled by with_retries, so the shared client's own retry loop is disabled
+    client = get_async_client().with_options(max_retries=0)
+
+    async def answer(question, retrieval, query_embedding):
+        (question_id, query), (top_sections, matched_keywords) = question, retrieval
+        record = {
+            'id': question_id,
+            'query': query,
+            'sections': [source_record(section) for section in top_sections],
+            'matched_keywords': matched_keywords,
+        }
+        cached_answer = answer_cache.get(query_embedding, top_sections, query) if answer_cache is not None else None
+        if cached_answer is not None:
+            record.update(answer=cached_answer, cached=True)
+            return record
+        async with semaphore:
+            try:
+                answer_text, report = await generate_batch_answer(client, query, top_sections)
+            except Exception as e:
+                record.update(answer=None, error=str(e))
+                return record
+        if answer_cache is not None:
+            answer_cache.put(query_embedding, top_sections, answer_text, query)
+        record.update(answer=answer_text, cached=False, prompt_tokens=report['prompt_tokens'])
+        return record
+
+    failed = 0
+    tasks = [answer(*arguments) for arguments in zip(questions, retrievals, query_embeddings)]
+    try:
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Answering questions"):
+            record = await task
+            failed += 'error' in record
+            # One line per answer, flushed as it completes, is the checkpoint for resuming
+            output_file.write(json.dumps(record) + '\n')
+            output_file.flush()
+    finally:
+        await close_async_client()
+    return failed
+
+
+def run_batch(input_path, output_path, concurrency=BATCH_CONCURRENCY, corpora=None):
+    """
+    Answer the questions of a JSONL file and write the answers to a JSONL file.
+
+    Questions already answered in the output file are skipped, so an interrupted run is resumed
+    by running it again. The remaining questions are embedded with batched requests, retrieved
+    together with query matrix x corpus matrix products, and answered concurrently. Answers are
+    written in completion order; every line has the id of its question.
+
+    Parameters:
+    input_path (Path): The questions file (see read_questions).
+    output_path (Path): The answers file, appended to.
+    concurrency (int): The maximum number of generation requests in flight.
+    corpora (list): The names of the books to answer from, all indexed books by default.
+
+    Returns:
+    int: The number of questions answered in this run.
+    """
+    questions = read_questions(input_path)
+    answered = read_answered_ids(output_path)
+    pending = [(question_id, query) for question_id, query in questions if question_id not in answered]
+    print(f"{len(questions)} questions, {len(questions) - len(pending)} already answered")
+    if not pending:
+        return 0
+
+    registry = load_registry(corpora)
+    queries = [query for _, query in pending]
+    with tqdm(total=1, desc=f"Embedding {len(queries)} questions", leave=False) as pbar, span('query_embedding', queries=len(queries)):
+        query_embeddings = np.asarray(get_embeddings_batch(queries), dtype=np.float32)
+        pbar.update(1)
+    retrievals = list(tqdm(registry.get_rag_responses(queries, query_embeddings), total=len(queries), desc="Retrieving sections"))
+    registry.close()
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    cut_off = False
+    if output_path.exists() and output_path.stat().st_size:
+        with open(output_path, 'rb') as output_file:
+            output_file.seek(-1, 2)
+            cut_off = output_file.read(1) != b'\n'
+    with open(output_path, 'a') as output_file:
+        if cut_off:
+            # Start on a new line after a line cut off by an interruption
+            output_file.write('\n')
+        failed = asyncio.run(answer_questions(pending, retrievals, query_embeddings, output_file, concurrency))
+
+    print(f"Answered {len(pending) - failed} questions, {failed} failed (run again to retry them)")
+    return len(pending) - failed
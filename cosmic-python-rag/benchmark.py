@@ -0,0 +1,243 @@
+import hashlib
+import json
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+from cosmic-python-rag_rag.config import BENCHMARK_OUTPUT, BENCHMARK_QUERIES, BENCHMARK_SCALES
+from cosmic-python-rag_rag.corpus import load_corpus
+from cosmic-python-rag_rag.data.store import save_processed_data
+from cosmic-python-rag_rag.retreival import get_final_retrieval, get_initial_retrieval
+
+VOCABULARY_SIZE = 5000
+WORDS_PER_SECTION = 200
+KEYWORDS_PER_CHAPTER = 15
+
+
+def fake_embedding(text, dim):
+    """
+    Deterministic stand-in for the embedding API: a unit vector seeded by a hash of the text.
+
+    Parameters:
+    text (str): The input text.
+    dim (int): The embedding dimension.
+
+    Returns:
+    np.ndarray: The float32 embedding.
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    embedding = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return embedding / np.linalg.norm(embedding)
+
+
+def make_vocabulary(size=VOCABULARY_SIZE):
+    return [f"term{i}" for i in range(size)]
+
+
+def generate_synthetic_corpus(num_chapters, sections_per_chapter, dim, seed=0):
+    """
+    Generate processed data with the same shape as the indexing output.
+
+    Parameters:
+    num_chapters (int): The number of chapters.
+    sections_per_chapter (int): The number of sections in each chapter.
+    dim (int): The embedding dimension.
+    seed (int): The random seed, so the same arguments always give the same corpus.
+
+    Returns:
+    dict: The synthetic processed data, including embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = make_vocabulary()
+    processed_data = {}
+    for chapter in range(num_chapters):
+        chapter_num = str(chapter + 1).zfill(2)
+        sections = []
+        for section in range(sections_per_chapter):
+            words = rng.choice(vocabulary, size=WORDS_PER_SECTION)
+            section_title = f"Section {chapter_num}.{section}"
+            text_content = f"{section_title}\n\n{' '.join(words)}"
+            embedding = rng.standard_normal(dim).astype(np.float32)
+            sections.append({
+                'title': section_title,
+                'text_content': text_content,
+                'code_blocks': [{'title': f"{words[0]}.py", 'code': f"{words[0]}.py\nclass {words[1].title()}: pass"}],
+                'images': [],
+                'references': [],
+                'section_title': section_title,
+                'embedding': embedding / np.linalg.norm(embedding),
+            })
+        summary_embedding = rng.standard_normal(dim).astype(np.float32)
+        processed_data[chapter_num] = {
+            'chapter_title': f"Chapter {chapter_num}",
+            'chapter_summary': f"Synthetic summary of chapter {chapter_num}.",
+            'chapter_summary_embedding': summary_embedding / np.linalg.norm(summary_embedding),
+            'chapter_keywords': list(rng.choice(vocabulary, size=KEYWORDS_PER_CHAPTER, replace=False)),
+            'sections': sections,
+        }
+    return processed_data
+
+
+def generate_queries(num_queries, seed=1):
+    """
+    Generate short synthetic queries drawn from the corpus vocabulary.
+
+    Parameters:
+    num_queries (int): The number of queries.
+    seed (int): The random seed.
+
+    Returns:
+    list: The queries.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = make_vocabulary()
+    return [' '.join(rng.choice(vocabulary, size=int(rng.integers(3, 12)))) for _ in range(num_queries)]
+
+
+def current_rss_mb():
+    """
+    Get the resident set size of this process in MB (peak RSS where /proc is not available).
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if platform.system() == 'Darwin' else peak / 2 ** 10
+
+
+def summarize_latencies(latencies):
+    """
+    Summarize latency samples.
+
+    Parameters:
+    latencies (list): Latencies in seconds.
+
+    Returns:
+    dict: p50/p95/p99/mean latency in milliseconds and throughput in calls per second.
+    """
+    samples = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'mean_ms': float(samples.mean()),
+        'throughput_qps': float(len(samples) / (samples.sum() / 1000)) if samples.sum() else None,
+    }
+
+
+def benchmark_scale(num_chapters, sections_per_chapter, dim, queries):
+    """
+    Benchmark index loading and retrieval for one corpus size.
+
+    Parameters:
+    num_chapters (int): The number of chapters.
+    sections_per_chapter (int): The number of sections in each chapter.
+    dim (int): The embedding dimension.
+    queries (list): The queries to run.
+
+    Returns:
+    dict: Load time, RSS and latency statistics for each retrieval stage.
+    """
+    processed_data = generate_synthetic_corpus(num_chapters, sections_per_chapter, dim)
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        save_processed_data(processed_data, directory)
+        del processed_data
+
+        rss_before = current_rss_mb()
+        start = time.perf_counter()
+        corpus = load_corpus(directory)
+        load_time = time.perf_counter() - start
+        rss_after_load = current_rss_mb()
+
+        query_embeddings = [fake_embedding(query, dim) for query in queries]
+        initial_latencies = []
+        final_latencies = []
+        total_latencies = []
+        for query, query_embedding in zip(queries, query_embeddings):
+            start = time.perf_counter()
+            retrieved_chapters, _, _, chapter_scores = get_initial_retrieval(query, corpus, query_embedding)
+            initial_done = time.perf_counter()
+            get_final_retrieval(query_embedding, retrieved_chapters, corpus, chapter_scores, query)
+            final_done = time.perf_counter()
+            initial_latencies.append(initial_done - start)
+            final_latencies.append(final_done - initial_done)
+            total_latencies.append(final_done - start)
+
+        return {
+            'chapters': num_chapters,
+            'sections_per_chapter': sections_per_chapter,
+            'dim': dim,
+            'queries': len(queries),
+            'load_time_ms': load_time * 1000,
+            'rss_after_load_mb': rss_after_load,
+            'rss_load_delta_mb': rss_after_load - rss_before,
+            'rss_after_queries_mb': current_rss_mb(),
+            'initial_retrieval': summarize_latencies(initial_latencies),
+            'final_retrieval': summarize_latencies(final_latencies),
+            'rag_response': summarize_latencies(total_latencies),
+        }
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(scales=BENCHMARK_SCALES, num_queries=BENCHMARK_QUERIES, output=BENCHMARK_OUTPUT):
+    """
+    Run the retrieval benchmark on synthetic corpora and write the results as JSON.
+
+    Query embeddings come from a deterministic fake embedder, so no API calls are made.
+    The results file records the git commit, so runs can be compared across commits.
+
+    Parameters:
+    scales (list): (chapters, sections per chapter, embedding dimension) tuples.
+    num_queries (int): The number of queries per scale.
+    output (Path): The JSON file to write the results to.
+
+    Returns:
+    dict: The benchmark results.
+    """
+    queries = generate_queries(num_queries)
+    results = {
+        'commit': get_git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'scales': [],
+    }
+    for num_chapters, sections_per_chapter, dim in scales:
+        result = benchmark_scale(num_chapters, sections_per_chapter, dim, queries)
+        results['scales'].append(result)
+        print(
+            f"{num_chapters} chapters x {sections_per_chapter} sections x {dim} dim: "
+            f"load {result['load_time_ms']:.1f} ms, RSS {result['rss_after_load_mb']:.0f} MB, "
+            f"p50 {result['rag_response']['p50_ms']:.2f} ms, p95 {result['rag_response']['p95_ms']:.2f} ms, "
+            f"p99 {result['rag_response']['p99_ms']:.2f} ms, {result['rag_response']['throughput_qps']:.0f} q/s"
+        )
+
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=4)
+    print(f"Saved benchmark results to {output}")
+    return results
+
+
+def parse_scale(value):
+    """
+    Parse a scale written as CHAPTERSxSECTIONSxDIM, e.g. 150x20x1536.
+    """
+    num_chapters, sections_per_chapter, dim = (int(part) for part in value.lower().split('x'))
+    return num_chapters, sections_per_chapter, dim
+
+
+if __name__ == "__main__":
+    run_benchmark()
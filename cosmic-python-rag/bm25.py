@@ -0,0 +1,153 @@
+import json
+import re
+import numpy as np
+from scipy import sparse
+from cosmic-python-rag_rag.config import BM25_B, BM25_K1
+from cosmic-python-rag_rag.vector_index import atomic_write
+
+BM25_WEIGHTS_FILENAME = 'bm25_weights.npz'
+BM25_VOCABULARY_FILENAME = 'bm25_vocabulary.json'
+
+# Word characters only, so identifiers such as add_batch stay a single token
+TOKEN_PATTERN = r"(?u)\b\w+\b"
+_token_re = re.compile(TOKEN_PATTERN)
+
+
+def tokenize(text):
+    return _token_re.findall(text.lower())
+
+
+def section_document(section):
+    """
+    Get the text of a section that is indexed for lexical search: its text and code blocks.
+
+    Parameters:
+    section (dict): A section of the processed data.
+
+    Returns:
+    str: The text to index.
+    """
+    code = '\n'.join(block['code'] for block in section['code_blocks'])
+    return f"{section['text_content']}\n{code}"
+
+
+class BM25Index:
+    """
+    BM25 index over section text and code, stored as a sparse sections x terms weight matrix.
+
+    The BM25 term weight of every (section, term) pair is precomputed at build time, so
+    scoring a query is a sum of the matrix columns of its terms.
+    """
+
+    def __init__(self, vocabulary, weights):
+        """
+        Parameters:
+        vocabulary (dict): Terms mapped to their column in weights.
+        weights (scipy.sparse.csc_matrix): BM25 weights, one row per section of the vector index.
+        """
+        self.vocabulary = vocabulary
+        self.weights = weights.tocsc()
+
+    @classmethod
+    def from_processed_data(cls, processed_data, k1=BM25_K1, b=BM25_B):
+        """
+        Build the index from the sections of the processed data.
+
+        Rows follow the same (chapter, section) order as the vector index.
+
+        Parameters:
+        processed_data (dict): The processed data containing chapter information.
+        k1 (float): The BM25 term frequency saturation parameter.
+        b (float): The BM25 document length normalization parameter.
+
+        Returns:
+        BM25Index: The built index.
+        """
+        documents = [
+            section_document(section)
+            for chapter_data in processed_data.values()
+            for section in chapter_data['sections']
+        ]
+        if not documents:
+            return cls({}, sparse.csc_matrix((0, 0), dtype=np.float32))
+
+        # scikit-learn is only needed to build the index, so loading it for queries does not import it
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        vectorizer = CountVectorizer(token_pattern=TOKEN_PATTERN, lowercase=True, dtype=np.float32)
+        try:
+            counts = vectorizer.fit_transform(documents).tocsr()
+        except ValueError:
+            # Every document is empty
+            return cls({}, sparse.csc_matrix((len(documents), 0), dtype=np.float32))
+
+        num_documents = counts.shape[0]
+        document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+        idf = np.log1p((num_documents - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+
+        lengths = np.asarray(counts.sum(axis=1)).ravel()
+        average_length = lengths.mean() or 1.0
+        row_norms = k1 * (1 - b + b * lengths / average_length)
+
+        # Scale every stored term frequency in place: idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len / avg_len))
+        tf = counts.data
+        rows = np.repeat(np.arange(num_documents), np.diff(counts.indptr))
+        counts.data = (idf[counts.indices] * tf * (k1 + 1) / (tf + row_norms[rows])).astype(np.float32)
+
+        vocabulary = {term: int(column) for term, column in vectorizer.vocabulary_.items()}
+        return cls(vocabulary, counts)
+
+    def save(self, directory):
+        """
+        Save the weight matrix as a .npz file and the vocabulary as JSON.
+
+        Parameters:
+        directory (Path): The directory to write the index files to.
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        with atomic_write(directory / BM25_WEIGHTS_FILENAME) as f:
+            sparse.save_npz(f, self.weights)
+        with atomic_write(directory / BM25_VOCABULARY_FILENAME, 'w') as vocabulary_file:
+            json.dump(self.vocabulary, vocabulary_file, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Load an index saved with save().
+
+        Parameters:
+        directory (Path): The directory containing the index files.
+
+        Returns:
+        BM25Index: The loaded index.
+        """
+        with open(directory / BM25_VOCABULARY_FILENAME, 'r') as vocabulary_file:
+            vocabulary = json.load(vocabulary_file)
+        return cls(vocabulary, sparse.load_npz(directory / BM25_WEIGHTS_FILENAME))
+
+    def query_terms(self, query):
+        """
+        Get the vocabulary columns of the distinct query tokens that occur in the corpus.
+
+        Parameters:
+        query (str): The input query.
+
+        Returns:
+        list: The column indices.
+        """
+        return sorted({self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary})
+
+    def score(self, query):
+        """
+        Calculate the BM25 score of every section for the query.
+
+        Parameters:
+        query (str): The input query.
+
+        Returns:
+        np.ndarray: Scores aligned with the section rows of the vector index.
+        """
+        columns = self.query_terms(query)
+        if not columns:
+            return np.zeros(self.weights.shape[0], dtype=np.float32)
+        return np.asarray(self.weights[:, columns].sum(axis=1), dtype=np.float32).ravel()
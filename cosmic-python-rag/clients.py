@@ -0,0 +1,122 @@
+import asyncio
+import importlib.util
+import os
+import threading
+import weakref
+from cosmic-python-rag_rag.config import (
+    OPENAI_BASE_URL, OPENAI_CONNECT_TIMEOUT, OPENAI_KEEPALIVE_EXPIRY, OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS, OPENAI_MAX_RETRIES, OPENAI_TIMEOUT
+)
+from cosmic-python-rag_rag.instrumentation import count
+
+# openai and httpx take a few hundred milliseconds to import, so they are imported when the first
+# client is created; queries answered from the caches or by BM25 alone never import them
+
+_client = None
+_async_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _get_api_key():
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+    return api_key
+
+
+def count_response(response):
+    """
+    Count an OpenAI API response by endpoint and status code, including every retried attempt.
+    """
+    path = response.request.url.path
+    endpoint = 'chat' if path.endswith('/chat/completions') else path.rsplit('/', 1)[-1]
+    count('openai_requests', endpoint=endpoint, status=str(response.status_code))
+
+
+async def count_response_async(response):
+    count_response(response)
+
+
+def _http_client_options(response_hook):
+    """
+    Get the connection pool, timeout and protocol settings shared by the sync and async clients.
+
+    HTTP/2 is enabled when the optional h2 package is installed.
+
+    Parameters:
+    response_hook (callable): The hook called with every response, a coroutine function for the async client.
+
+    Returns:
+    dict: Keyword arguments for httpx.Client and httpx.AsyncClient.
+    """
+    import httpx
+
+    return {
+        'event_hooks': {'response': [response_hook]},
+        'http2': importlib.util.find_spec('h2') is not None,
+        'timeout': httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        'limits': httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+    }
+
+
+def get_client():
+    """
+    Get the shared OpenAI client, creating it on first use.
+
+    The client keeps a pool of keep-alive connections, so requests after the first one
+    skip the TCP and TLS handshakes.
+
+    Returns:
+    openai.OpenAI: The shared client.
+    """
+    global _client
+    import openai
+
+    with _lock:
+        if _client is None:
+            _client = openai.OpenAI(
+                api_key=_get_api_key(),
+                base_url=OPENAI_BASE_URL,
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=openai.DefaultHttpxClient(**_http_client_options(count_response)),
+            )
+        return _client
+
+
+def get_async_client():
+    """
+    Get the shared async OpenAI client for the running event loop, creating it on first use.
+
+    Async connections belong to the event loop that opened them, so there is one client per loop.
+
+    Returns:
+    openai.AsyncOpenAI: The shared client.
+    """
+    import openai
+
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = openai.AsyncOpenAI(
+                api_key=_get_api_key(),
+                base_url=OPENAI_BASE_URL,
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=openai.DefaultAsyncHttpxClient(**_http_client_options(count_response_async)),
+            )
+            _async_clients[loop] = client
+        return client
+
+
+async def close_async_client():
+    """
+    Close the shared async client of the running event loop, if there is one.
+    """
+    with _lock:
+        client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
@@ -1,21 +1,117 @@
+import os
 from pathlib import Path
 import sys
 import time
+from dotenv import load_dotenv
+
+# Read the .env file once, before the settings below that come from the environment
+load_dotenv()
 
 # Data Config
 DATA_DIR = Path("data")
 RAW_DIR = DATA_DIR / "raw"
 PROCESSED_DIR = DATA_DIR / "processed"
+CORPUS_FILENAME = "corpus.json"
+SECTIONS_FILENAME = "sections.sqlite"
+LEGACY_PROCESSED_DATA_FILENAME = "processed_data.json"
+FINGERPRINTS_FILENAME = "fingerprints.json"
+# Written last by indexing with the signature of every store file, so a store loaded while it is updated is detected
+MANIFEST_FILENAME = "manifest.json"
+# Loading is retried while the store is being updated, waiting STORE_LOAD_RETRY_DELAY seconds between attempts
+STORE_LOAD_ATTEMPTS = 10
+STORE_LOAD_RETRY_DELAY = 0.5
+
+# Corpus Registry Config (one index shard per book, in CORPORA_DIR/<name>/raw and CORPORA_DIR/<name>/processed)
+CORPORA_DIR = DATA_DIR / "corpora"
+# Name of the book indexed in RAW_DIR and PROCESSED_DIR; chapter ids are namespaced as '<name>/<chapter_num>'
+DEFAULT_CORPUS = "cosmic-python"
+# Threads searching shards in parallel, None for one per shard up to the CPU count
+SHARD_SEARCH_WORKERS = None
+# Maximum number of shards kept loaded, the least recently searched is unloaded beyond it; None for no limit
+MAX_LOADED_SHARDS = None
+
+# Cache Config (embeddings and summaries, keyed by a hash of the model and input text)
+CACHE_ENABLED = True
+CACHE_PATH = DATA_DIR / "cache.sqlite"
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+CACHE_MEMORY_ITEMS = 4096
+# Number of cache reads whose access times are kept in memory before they are written to disk in one transaction
+CACHE_TOUCH_BATCH = 256
+# Number of section bodies kept in memory by the section store
+SECTION_CACHE_ITEMS = 256
+
+# Chunking Config (sections are embedded as overlapping text chunks plus one chunk per code block)
+CHUNK_TOKENS = 300
+CHUNK_OVERLAP_TOKENS = 50
 
 # RAG Config
 TOP_N_SECTIONS = 5
 TOP_N_CHAPTERS = 3
 SCORE_BOOST_FOR_MATCH = 0.1
+# Number of c-TF-IDF keywords extracted per chapter
+TOP_N_KEYWORDS = 10
+# Match chapter keywords on Porter stems, so e.g. 'repositories' matches 'repository'
+KEYWORD_STEMMING = True
+# 'dense' (embeddings only) or 'hybrid' (embeddings fused with BM25 over section text and code)
+RETRIEVAL_MODE = "hybrid"
+# 'rrf' (reciprocal-rank fusion) or 'weighted' (weighted sum of min-max normalized scores)
+FUSION_METHOD = "rrf"
+RRF_K = 60
+HYBRID_DENSE_WEIGHT = 0.6
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Number of best BM25 sections (from any chapter) added to the fusion candidates
+BM25_CANDIDATES = 20
+# Identifier queries are answered from BM25 alone when the best section scores this many times the runner-up
+LEXICAL_SHORTCUT_MARGIN = 1.5
+# 'two_stage' (sections of the top chapters only) or 'direct' (ANN search over all sections)
+SECTION_SEARCH = "two_stage"
+# ANN backend for direct section search: 'exact', 'ivf' (pure NumPy), 'faiss' or 'hnswlib' (optional packages)
+ANN_BACKEND = "ivf"
+# Number of chunks returned by the ANN search, aggregated to sections before chapter scores are added
+ANN_CANDIDATES = 50
+# IVF: clusters (None for 4 * sqrt(chunks)) and clusters searched per query; more probes, more recall
+IVF_NLIST = None
+IVF_NPROBE = 8
+IVF_KMEANS_ITERATIONS = 10
+IVF_TRAINING_SAMPLE = 100_000
+# HNSW (hnswlib): graph degree and candidate list sizes; a larger ef_search gives more recall
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+ANN_EVAL_QUERIES = 200
+
+# Quantization Config (compact in-memory copy of the chunk embeddings for scoring; the float32 matrix
+# stays memory-mapped and is only read to rescore the best sections)
+# 'float32' (no compact copy), 'float16' or 'int8' (scalar quantization with a scale per vector)
+EMBEDDING_PRECISION = "float32"
+# Matryoshka truncation of the compact copy to its first dimensions, renormalized; None keeps all of them
+EMBEDDING_DIMENSIONS = None
+# Number of best sections per query rescored with the float32 embeddings
+RESCORE_CANDIDATES = 50
+# (precision, dimensions) settings compared by the quantization-eval mode
+QUANTIZATION_EVAL_SETTINGS = [("float16", None), ("int8", None), ("float32", 512), ("int8", 512), ("int8", 256)]
 
 # OpenAI Config
 OPENAI_MODEL_EMB = "text-embedding-3-small"
+# Per-request limits for batched embedding calls (the API allows up to 2048 inputs per request)
+EMBEDDING_BATCH_MAX_ITEMS = 256
+EMBEDDING_BATCH_MAX_TOKENS = 100_000
 OPENAI_MODEL_GPT = "gpt-3.5-turbo"
 TEMPERATURE = 0.7
+# Token budget of the answer prompt (instructions, sections and question); sections are trimmed to fit
+CONTEXT_MAX_TOKENS = 3000
+# Maximum number of tokens of a generated answer
+GENERATION_MAX_TOKENS = 500
+# Set OPENAI_BASE_URL to point the clients at a compatible or local fake endpoint
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+# Shared client settings: timeouts in seconds, keep-alive connection pool and retries on 429/5xx
+OPENAI_TIMEOUT = 60.0
+OPENAI_CONNECT_TIMEOUT = 5.0
+OPENAI_MAX_CONNECTIONS = 32
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 16
+OPENAI_KEEPALIVE_EXPIRY = 60.0
+OPENAI_MAX_RETRIES = 3
 SUMMARY_PROMPT = """
 You are a helpful assistant that summarizes text about Clean Architecture in Python.
 
@@ -34,6 +130,59 @@ Use the following sections to answer the question:
 Answer the question in plain text. Cite code snippets if relevant and needed.
 """
 
+# Answer Cache Config (answers reused for similar queries answered from the same sections)
+ANSWER_CACHE_ENABLED = True
+# Minimum cosine similarity of the query embeddings for a cached answer to be reused
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_TTL = 24 * 60 * 60
+ANSWER_CACHE_MAX_ITEMS = 1024
+# SQLite file that keeps the answers between runs, or None to keep them in memory only
+ANSWER_CACHE_PATH = DATA_DIR / "answers.sqlite"
+
+# Parsing Config (worker processes for HTML parsing, None for one per CPU)
+PARSING_WORKERS = None
+
+# Async Indexing Config
+INDEXING_CONCURRENCY = 8
+RETRY_MAX_ATTEMPTS = 6
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# Benchmark Config (scales are chapters x sections per chapter x embedding dimension)
+BENCHMARK_SCALES = [(15, 10, 1536), (150, 20, 1536), (1000, 20, 1536)]
+BENCHMARK_QUERIES = 200
+BENCHMARK_OUTPUT = Path("benchmark_results.json")
+
+# Import Time Config (cold import budgets of the entry points in milliseconds, checked by the import-time mode)
+IMPORT_TIME_BUDGETS_MS = {"main": 150, "retreival": 300, "corpus": 400}
+IMPORT_TIME_RUNS = 5
+
+# Batch Config (answering questions from a JSONL file)
+BATCH_OUTPUT = Path("answers.jsonl")
+# Maximum number of generation requests in flight
+BATCH_CONCURRENCY = 16
+# Number of queries scored against the corpus in one matrix product
+BATCH_SCORING_SIZE = 256
+
+# Evaluation Config (labelled queries, one JSON object per line; see evaluation.load_dataset)
+EVALUATION_DATASET = DATA_DIR / "evaluation.jsonl"
+EVALUATION_K = [1, 3, 5]
+EVALUATION_OUTPUT = Path("evaluation_results.json")
+# Worker processes for evaluating configurations in parallel, None for one per configuration up to the CPU count
+EVALUATION_WORKERS = None
+
+# Instrumentation Config (span timings of the pipeline stages and counters of API calls, tokens and cache hits)
+INSTRUMENTATION_ENABLED = False
+# 'log' (a log line per span), 'prometheus' (text format, written to INSTRUMENTATION_METRICS_PATH on exit) or 'otel' (OpenTelemetry API, optional package)
+INSTRUMENTATION_EXPORTER = "log"
+INSTRUMENTATION_METRICS_PATH = Path("metrics.prom")
+# Upper bounds of the span duration histogram buckets, in seconds
+INSTRUMENTATION_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+# Server Config
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8000
+
 # Chatbot Config
 GOODBYE_PHRASE = "Thank you for using the chatbot. Goodbye!"
 WELCOME_PHRASE = "Welcome to the Clean Architecture in Python chatbot! (Type 'exit' to quit the chatbot)"
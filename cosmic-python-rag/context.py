@@ -0,0 +1,189 @@
+import re
+from functools import lru_cache
+from cosmic-python-rag_rag.config import CONTEXT_MAX_TOKENS, OPENAI_MODEL_GPT, RAG_PROMPT
+from cosmic-python-rag_rag.data.embeddings import estimate_tokens
+from cosmic-python-rag_rag.keyword_index import ENGLISH_STOP_WORDS, normalize_tokens
+
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+')
+# Longer sentences (or text without punctuation) are split into runs of this many words
+MAX_SENTENCE_WORDS = 40
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model=OPENAI_MODEL_GPT):
+    """
+    Get the tiktoken encoding of a model.
+
+    tiktoken is imported on the first call rather than with this module, so importing the query
+    path does not load it.
+
+    Returns:
+    tiktoken.Encoding: The encoding, or None if tiktoken is not installed or its encoding files cannot be loaded.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('cl100k_base')
+    except Exception:
+        # The encoding files are downloaded on first use, which fails offline
+        return None
+
+
+def count_tokens(text):
+    """
+    Count the tokens of a text with the tokenizer of the generation model.
+
+    Falls back to estimate_tokens when the optional tiktoken package is not available.
+
+    Parameters:
+    text (str): The input text.
+
+    Returns:
+    int: The number of tokens.
+    """
+    encoding = get_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=1)
+def get_stop_stems():
+    return frozenset(normalize_tokens(' '.join(ENGLISH_STOP_WORDS)))
+
+
+def query_terms(query):
+    return set(normalize_tokens(query)) - get_stop_stems()
+
+
+def relevance(text, terms):
+    return len(terms.intersection(normalize_tokens(text))) if terms else 0
+
+
+def dedupe_key(text):
+    return ' '.join(normalize_tokens(text, use_stemming=False))
+
+
+def split_section(section):
+    """
+    Split the text of a section into its title and sentences, the units it is trimmed by.
+
+    Parameters:
+    section (dict): A retrieved section.
+
+    Returns:
+    tuple: The section title and the list of sentences.
+    """
+    title, _, body = section['text_content'].partition('\n\n')
+    sentences = []
+    for sentence in SENTENCE_PATTERN.split(body):
+        words = sentence.split()
+        sentences.extend(' '.join(words[start:start + MAX_SENTENCE_WORDS]) for start in range(0, len(words), MAX_SENTENCE_WORDS))
+    return title or section['section_title'], sentences
+
+
+def render_section(title, sentences, code_blocks):
+    text = f"Section: {title}\n{' '.join(sentences)}"
+    for code in code_blocks:
+        text += f"\n\n{code}"
+    return text
+
+
+def select_parts(parts, budget):
+    """
+    Select the most relevant parts that fit in a token budget, keeping their original order.
+
+    Parameters:
+    parts (list): (text, relevance, tokens) tuples.
+    budget (int): The number of tokens available.
+
+    Returns:
+    tuple: The selected texts and their number of tokens.
+    """
+    selected = []
+    used = 0
+    for position in sorted(range(len(parts)), key=lambda position: (-parts[position][1], position)):
+        tokens = parts[position][2]
+        if used + tokens <= budget:
+            selected.append(position)
+            used += tokens
+    return [parts[position][0] for position in sorted(selected)], used
+
+
+def build_context(query, top_sections, max_tokens=CONTEXT_MAX_TOKENS):
+    """
+    Build the sections context of the prompt within a token budget.
+
+    Sentences and code blocks that already appeared in a better ranked section are dropped.
+    If the remaining sections do not fit in the budget, it is shared out max-min fairly: sections
+    that need less than an equal share keep all their text and the tokens they leave are split
+    among the others. A section over its share keeps the sentences and code blocks that share
+    the most terms with the query, in their original order. Code blocks are kept whole or left out.
+
+    Parameters:
+    query (str): The input query.
+    top_sections (list): The retrieved sections, best first.
+    max_tokens (int): The token budget of the whole prompt: instructions, sections and query.
+
+    Returns:
+    tuple: The sections context and a report with 'prompt_tokens', 'context_tokens', 'sections',
+    'trimmed_sections' (shortened or left out) and 'duplicates'.
+    """
+    terms = query_terms(query)
+    seen = set()
+    duplicates = 0
+    sections = []
+    for section in top_sections:
+        title, sentences = split_section(section)
+        parts = []
+        for sentence in sentences:
+            key = dedupe_key(sentence)
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            parts.append((sentence, relevance(sentence, terms), count_tokens(sentence) + 1))
+        code_parts = []
+        for block in section.get('code_snippets', []):
+            key = dedupe_key(block['code'])
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            code_parts.append((block['code'], relevance(block['code'], terms), count_tokens(block['code']) + 2))
+        if parts or code_parts:
+            sections.append((title, count_tokens(f"Section: {title}\n") + 2, parts, code_parts))
+
+    needs = [header + sum(part[2] for part in parts + code_parts) for _, header, parts, code_parts in sections]
+    remaining = max_tokens - count_tokens(RAG_PROMPT.format(sections='')) - count_tokens(query)
+    shares = [0] * len(sections)
+    for count, position in enumerate(sorted(range(len(sections)), key=needs.__getitem__)):
+        shares[position] = min(needs[position], max(remaining, 0) // (len(sections) - count))
+        remaining -= shares[position]
+
+    rendered = []
+    trimmed = 0
+    for (title, header, parts, code_parts), need, share in zip(sections, needs, shares):
+        if share >= need:
+            rendered.append(render_section(title, [part[0] for part in parts], [part[0] for part in code_parts]))
+            continue
+        trimmed += 1
+        sentences, used = select_parts(parts, share - header)
+        code_blocks, _ = select_parts(code_parts, share - header - used)
+        if sentences or code_blocks:
+            rendered.append(render_section(title, sentences, code_blocks))
+
+    context = "\n\n".join(rendered)
+    report = {
+        'prompt_tokens': count_tokens(RAG_PROMPT.format(sections=context)) + count_tokens(query),
+        'context_tokens': count_tokens(context),
+        'sections': len(rendered),
+        'trimmed_sections': trimmed,
+        'duplicates': duplicates,
+    }
+    return context, report
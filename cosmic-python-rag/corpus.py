@@ -0,0 +1,93 @@
+import time
+from dataclasses import dataclass
+from typing import Any
+from cosmic-python-rag_rag.ann import build_ann_index, load_ann_index
+from cosmic-python-rag_rag.bm25 import BM25Index
+from cosmic-python-rag_rag.config import PROCESSED_DIR, SECTION_SEARCH, STORE_LOAD_ATTEMPTS, STORE_LOAD_RETRY_DELAY
+from cosmic-python-rag_rag.data.data_cleaning import get_chapters
+from cosmic-python-rag_rag.data.section_store import InMemorySectionStore
+from cosmic-python-rag_rag.data.store import get_chapter_metadata, load_bm25_index, load_section_store, load_vector_index, read_manifest, store_unchanged
+from cosmic-python-rag_rag.keyword_index import KeywordIndex
+from cosmic-python-rag_rag.quantization import build_compact_matrix, load_compact_matrix
+from cosmic-python-rag_rag.vector_index import VectorIndex
+
+
+@dataclass
+class Corpus:
+    """
+    Everything retrieval needs for one indexed book, loaded once and shared between queries.
+
+    Only the chapter metadata, embeddings and section ids are held in memory; section bodies
+    are read from the section store for the sections a query returns.
+    """
+    chapters: dict
+    sections: Any
+    index: VectorIndex
+    keyword_index: KeywordIndex
+    bm25_index: BM25Index
+    # ANN index over all sections, only used when SECTION_SEARCH is 'direct'
+    ann_index: Any = None
+
+
+def load_corpus(directory=PROCESSED_DIR, attempts=STORE_LOAD_ATTEMPTS):
+    """
+    Load the chapter metadata and the retrieval indexes, and open the section store.
+
+    A store updated by indexing while it is loaded could mix files of the old and new version,
+    so the load is checked against the store manifest and retried until it reads one version.
+
+    Parameters:
+    directory (Path): The directory containing the store.
+    attempts (int): The number of loads tried while the store is being updated.
+
+    Returns:
+    Corpus: The loaded corpus.
+
+    Raises:
+    RuntimeError: If the store kept changing during every attempt.
+    """
+    for attempt in range(attempts):
+        manifest = read_manifest(directory)
+        corpus = _load_corpus(directory)
+        if store_unchanged(directory, manifest):
+            return corpus
+        corpus.sections.close()
+        if attempt + 1 < attempts:
+            time.sleep(STORE_LOAD_RETRY_DELAY)
+    raise RuntimeError(f"The store in {directory} changed while it was loaded, it is being updated")
+
+
+def _load_corpus(directory):
+    chapters = get_chapters(directory)
+    index = load_vector_index(directory)
+    index.attach_compact(load_compact_matrix(directory, index.chunk_matrix))
+    return Corpus(
+        chapters=chapters,
+        sections=load_section_store(directory),
+        index=index,
+        keyword_index=KeywordIndex.from_processed_data(chapters),
+        bm25_index=load_bm25_index(len(index.section_ids), directory),
+        ann_index=load_ann_index(directory, index.chunk_matrix) if SECTION_SEARCH == 'direct' else None,
+    )
+
+
+def build_corpus(processed_data):
+    """
+    Build a corpus from processed data that still contains its embeddings.
+
+    Parameters:
+    processed_data (dict): The processed data containing chapter information and embeddings.
+
+    Returns:
+    Corpus: The corpus.
+    """
+    index = VectorIndex.from_processed_data(processed_data)
+    index.attach_compact(build_compact_matrix(index.chunk_matrix))
+    return Corpus(
+        chapters=get_chapter_metadata(processed_data),
+        sections=InMemorySectionStore(processed_data),
+        index=index,
+        keyword_index=KeywordIndex.from_processed_data(processed_data),
+        bm25_index=BM25Index.from_processed_data(processed_data),
+        ann_index=build_ann_index(index.chunk_matrix) if SECTION_SEARCH == 'direct' else None,
+    )
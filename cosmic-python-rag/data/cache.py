@@ -0,0 +1,205 @@
+import atexit
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from cosmic-python-rag_rag.config import CACHE_ENABLED, CACHE_MAX_BYTES, CACHE_MEMORY_ITEMS, CACHE_PATH, CACHE_TOUCH_BATCH
+
+# Keys per SELECT ... IN query, below the SQLite limit of bound parameters
+SELECT_BATCH = 500
+
+
+def make_key(namespace, model, text):
+    """
+    Build a content-addressed cache key.
+
+    Parameters:
+    namespace (str): The kind of cached value, e.g. 'embedding' or 'summary'.
+    model (str): The model that produced the value.
+    text (str): The input text.
+
+    Returns:
+    str: The SHA-256 hex digest of the namespace, model and text.
+    """
+    return hashlib.sha256(f"{namespace}\0{model}\0{text}".encode('utf-8')).hexdigest()
+
+
+class PersistentCache:
+    """
+    SQLite-backed key-value cache with an in-memory LRU front.
+
+    The on-disk store is bounded by size: when it grows past max_bytes, the least recently
+    used entries are evicted. Reads, including in-memory hits, are recorded in memory and their
+    access times are written in bulk, so a lookup does not commit. Safe to share between threads.
+    """
+
+    def __init__(self, path, max_bytes=CACHE_MAX_BYTES, memory_items=CACHE_MEMORY_ITEMS, touch_batch=CACHE_TOUCH_BATCH):
+        """
+        Parameters:
+        path (Path): The SQLite database file.
+        max_bytes (int): The maximum total size of the values stored on disk.
+        memory_items (int): The maximum number of values kept in the in-memory LRU.
+        touch_batch (int): The number of pending access times that triggers writing them to disk.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.touch_batch = touch_batch
+        self.memory = OrderedDict()
+        # key -> last access time not written to disk yet
+        self.touched = {}
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        # With a write-ahead log, a commit appends to the log instead of syncing the database file
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)")
+        self.connection.commit()
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def _write_touches(self):
+        if self.touched:
+            self.connection.executemany("UPDATE cache SET last_access = ? WHERE key = ?", [(now, key) for key, now in self.touched.items()])
+            self.touched.clear()
+
+    def get(self, key):
+        """
+        Get a value from the cache.
+
+        Parameters:
+        key (str): The cache key.
+
+        Returns:
+        bytes: The cached value, or None if it is not cached.
+        """
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        """
+        Get many values from the cache, reading the ones not in memory with one query per SELECT_BATCH keys.
+
+        Parameters:
+        keys (list): The cache keys.
+
+        Returns:
+        list: The cached value of each key, or None where it is not cached.
+        """
+        now = time.time()
+        with self.lock:
+            values = {}
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    values[key] = self.memory[key]
+            missing = list(dict.fromkeys(key for key in keys if key not in values))
+            for start in range(0, len(missing), SELECT_BATCH):
+                batch = missing[start:start + SELECT_BATCH]
+                rows = self.connection.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, value in rows:
+                    values[key] = value
+                    self._remember(key, value)
+            self.touched.update((key, now) for key in values)
+            if len(self.touched) >= self.touch_batch:
+                self._write_touches()
+                self.connection.commit()
+            return [values.get(key) for key in keys]
+
+    def set(self, key, value):
+        """
+        Store a value in the cache, evicting the least recently used entries if the store is full.
+
+        Parameters:
+        key (str): The cache key.
+        value (bytes): The value to store.
+        """
+        self.set_many([(key, value)])
+
+    def set_many(self, items):
+        """
+        Store many values in the cache in one transaction, evicting the least recently used entries if the store is full.
+
+        Parameters:
+        items (list): (key, value) pairs.
+        """
+        items = dict(items)
+        if not items:
+            return
+        now = time.time()
+        with self.lock:
+            keys = list(items)
+            for start in range(0, len(keys), SELECT_BATCH):
+                batch = keys[start:start + SELECT_BATCH]
+                rows = self.connection.execute(
+                    f"SELECT size FROM cache WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                self.total_bytes -= sum(size for size, in rows)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                [(key, value, len(value), now) for key, value in items.items()]
+            )
+            self.total_bytes += sum(len(value) for value in items.values())
+            for key in items:
+                self.touched.pop(key, None)
+            # Eviction orders by access time, so the pending reads are written first
+            self._write_touches()
+            self._evict()
+            self.connection.commit()
+            for key, value in items.items():
+                self._remember(key, value)
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self.connection.execute(
+                "SELECT key, size FROM cache ORDER BY last_access LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self.connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self.memory.pop(key, None)
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self._write_touches()
+                self.connection.commit()
+                self.connection.close()
+                self.connection = None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Get the shared cache stored at CACHE_PATH, opening it on first use.
+
+    Returns:
+    PersistentCache: The shared cache, or None if caching is disabled.
+    """
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = PersistentCache(CACHE_PATH)
+            # Write the pending access times on exit
+            atexit.register(_cache.close)
+        return _cache
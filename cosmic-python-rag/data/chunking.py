@@ -0,0 +1,63 @@
+from cosmic-python-rag_rag.config import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS
+from cosmic-python-rag_rag.context import count_tokens, split_section
+
+
+def chunk_sentences(sentences, chunk_tokens, overlap_tokens):
+    """
+    Group sentences into windows of about chunk_tokens tokens, each starting with the last
+    overlap_tokens tokens of the previous window.
+
+    Parameters:
+    sentences (list): The sentences of a section.
+    chunk_tokens (int): The maximum number of tokens of a window.
+    overlap_tokens (int): The maximum number of tokens repeated from the previous window.
+
+    Returns:
+    list: The windows, as lists of sentences.
+    """
+    tokens = [count_tokens(sentence) + 1 for sentence in sentences]
+    windows = []
+    start = 0
+    while start < len(sentences):
+        end = start + 1
+        used = tokens[start]
+        while end < len(sentences) and used + tokens[end] <= chunk_tokens:
+            used += tokens[end]
+            end += 1
+        windows.append(sentences[start:end])
+        if end == len(sentences):
+            break
+        # Step back over the overlap, always moving forward by at least one sentence
+        next_start = end
+        overlap = 0
+        while next_start - 1 > start and overlap + tokens[next_start - 1] <= overlap_tokens:
+            next_start -= 1
+            overlap += tokens[next_start]
+        start = next_start
+    return windows
+
+
+def chunk_section(section, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Split a section into the chunks that are embedded for retrieval.
+
+    A section whose text fits in chunk_tokens is a single text chunk, the full text_content.
+    Longer text is split by sentence into overlapping chunks prefixed with the section title.
+    Every code block is a chunk of its own and is never split. The chunks are derived from the
+    section alone, so they can be rebuilt for a stored section.
+
+    Parameters:
+    section (dict): A section of the processed data.
+    chunk_tokens (int): The maximum number of tokens of a text chunk.
+    overlap_tokens (int): The number of tokens of text repeated between consecutive chunks.
+
+    Returns:
+    list: The chunk texts, text chunks first; never empty.
+    """
+    if count_tokens(section['text_content']) <= chunk_tokens:
+        chunks = [section['text_content']]
+    else:
+        title, sentences = split_section(section)
+        chunks = [f"{title}\n\n{' '.join(window)}" for window in chunk_sentences(sentences, chunk_tokens, overlap_tokens)] or [section['text_content']]
+    chunks.extend(f"{section['section_title']}\n\n{block['code']}" for block in section['code_blocks'])
+    return chunks
@@ -1,8 +1,26 @@
+import importlib.util
 import json
 import os
 import re
-from ..config import PROCESSED_DIR, RAW_DIR
-from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor
+from ..config import CORPUS_FILENAME, PARSING_WORKERS, PROCESSED_DIR, RAW_DIR, SECTIONS_FILENAME
+from .section_store import SectionStore
+
+# lxml is checked for without importing it; BeautifulSoup is imported where HTML is parsed,
+# since loading the corpus for queries only needs the JSON helpers of this module
+HTML_PARSER = 'lxml' if importlib.util.find_spec('lxml') is not None else 'html.parser'
+
+def clean_text(text):
+    """
+    Remove non-ASCII characters and repeated whitespaces from the text.
+
+    Parameters:
+    text (str): The input text.
+
+    Returns:
+    str: The cleaned text.
+    """
+    return clean_whitespace(remove_non_ascii(text))
 
 def clean_whitespace(text):
     """
@@ -28,6 +46,69 @@ def remove_non_ascii(text):
     """
     return re.sub(r'[^\x00-\x7F]+', '', text)
 
+def list_chapter_files(raw_dir=RAW_DIR):
+    """
+    List all chapter files in HTML format in the RAW_DIR directory.
+
+    Parameters:
+    raw_dir (Path): The directory containing the chapter HTML files of a book.
+
+    Returns:
+    dict: A dictionary where keys are chapter numbers (as strings) and values are paths of the chapter HTML files.
+    """
+    chapter_files = {}
+
+    for filename in sorted(os.listdir(raw_dir)):
+        if filename.startswith('chapter_') and filename.endswith('.html'):
+            chapter_number = filename.split('_')[1].split('.')[0].zfill(2)
+            chapter_files[chapter_number] = raw_dir / filename
+
+    return chapter_files
+
+def read_chapter_html_file(html_path):
+    """
+    Read a chapter file in HTML format.
+
+    Parameters:
+    html_path (Path): The path of the chapter HTML file.
+
+    Returns:
+    BeautifulSoup: The BeautifulSoup object of the chapter HTML content.
+    """
+    from bs4 import BeautifulSoup
+
+    with open(html_path, 'r') as html_file:
+        return BeautifulSoup(html_file, HTML_PARSER)
+
+def parse_chapter_file(html_path):
+    """
+    Read and parse a chapter file. Runs in the worker processes of parse_chapter_files.
+
+    Parameters:
+    html_path (Path): The path of the chapter HTML file.
+
+    Returns:
+    dict: A dictionary containing 'title' and 'sections' extracted from the chapter.
+    """
+    return parse_html_content_with_sections(read_chapter_html_file(html_path))
+
+def parse_chapter_files(chapter_files, workers=PARSING_WORKERS):
+    """
+    Parse chapter files in parallel, one chapter per worker process.
+
+    Parameters:
+    chapter_files (dict): Chapter numbers mapped to the paths of their HTML files.
+    workers (int): The number of worker processes, or None for the number of CPUs.
+
+    Returns:
+    dict: Chapter numbers mapped to the parsed chapters, in the order of chapter_files.
+    """
+    workers = min(workers or os.cpu_count() or 1, len(chapter_files))
+    if workers <= 1:
+        return {chapter_number: parse_chapter_file(html_path) for chapter_number, html_path in chapter_files.items()}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(chapter_files.keys(), executor.map(parse_chapter_file, chapter_files.values())))
+
 def read_all_chapter_html_files():
     """
     Read all chapter files in HTML format from the RAW_DIR directory.
@@ -35,15 +116,10 @@ def read_all_chapter_html_files():
     Returns:
     dict: A dictionary where keys are chapter numbers (as strings) and values are BeautifulSoup objects of the chapter HTML content.
     """
-    chapters = {}
-    
-    for filename in sorted(os.listdir(RAW_DIR)):
-        if filename.startswith('chapter_') and filename.endswith('.html'):
-            chapter_number = filename.split('_')[1].split('.')[0].zfill(2)
-            with open(RAW_DIR / filename, 'r') as html_file:
-                chapters[chapter_number] = BeautifulSoup(html_file, 'html.parser')
-    
-    return chapters
+    return {
+        chapter_number: read_chapter_html_file(html_path)
+        for chapter_number, html_path in list_chapter_files().items()
+    }
 
 def remove_styling(html_content):
     """
@@ -55,7 +131,9 @@ def remove_styling(html_content):
     Returns:
     str: The HTML content with styling text removed.
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html_content, HTML_PARSER)
     
     # Remove <style> tags and style attributes
     for tag in soup.find_all(['style', True]):
@@ -77,84 +155,84 @@ def extract_title(soup):
     str: The title of the HTML content, or 'Untitled Chapter' if no title is found.
     """
     title_tag = soup.find('title')
-    return clean_whitespace(remove_non_ascii(title_tag.get_text(strip=True))) if title_tag else 'Untitled Chapter'
+    return clean_text(title_tag.get_text(strip=True)) if title_tag else 'Untitled Chapter'
 
-def extract_text_content(soup):
-    """
-    Extract the text content from the HTML content.
-
-    Parameters:
-    soup (BeautifulSoup): The BeautifulSoup object of the HTML content.
+def is_title_div(tag):
+    return tag.name == 'div' and 'title' in tag.get('class', ())
 
-    Returns:
-    str: The text content of the HTML content, with paragraphs joined by spaces.
+def extract_section(section):
     """
-    paragraphs = [p.get_text() for p in soup.find_all('p')]
-    text_content = ' '.join(paragraphs).replace('\n', ' ').strip()
-    # Remove repeated whitespaces
-    return clean_whitespace(remove_non_ascii(text_content))
+    Extract the content of a section in a single pass over its tags.
 
-def extract_code_blocks(soup):
-    """
-    Extract code blocks and their titles from the HTML content.
+    Paragraphs are joined into the text content. Code blocks and images take the title div
+    before and after them respectively, looking outside the section for the first code block
+    and the last images. References are the links to other chapters.
 
     Parameters:
-    soup (BeautifulSoup): The BeautifulSoup object of the HTML content.
+    section (Tag): The section element.
 
     Returns:
-    list: A list of dictionaries containing 'title' and 'code' for each code block.
+    dict: A dictionary containing 'title', 'text_content', 'code_blocks', 'images', 'references', and 'section_title'.
     """
+    heading = None
+    paragraphs = []
     code_blocks = []
-    for pre in soup.find_all('pre', class_='highlight'):
-        code = pre.find('code')
-        if code:
-            title = pre.find_previous('div', class_='title')
-            title_text = clean_whitespace(remove_non_ascii(title.get_text(strip=True))) if title else 'Untitled Code Block'
-            code_blocks.append({
-                'title': title_text,
-                'code': f"{title_text}\n{code.get_text()}"
-            })
-    return code_blocks
-
-
-def extract_images(soup):
-    """
-    Extract images from the HTML content.
-
-    Parameters:
-    soup (BeautifulSoup): The BeautifulSoup object of the HTML content.
-
-    Returns:
-    list: A list of dictionaries containing image 'src' and 'description'.
-    """
     images = []
-    for img in soup.find_all('img'):
-        img_info = {
-            'src': img.get('src'),
-            'description': clean_whitespace(remove_non_ascii(img.find_next('div', class_='title').get_text(strip=True))) if img.find_next('div', class_='title') else ''
-        }
-        images.append(img_info)
-    return images
+    references = []
+    last_title = None
+    untitled_images = []
 
-def extract_references(soup):
-    """
-    Extract references from the HTML content.
+    for tag in section.find_all(['h3', 'p', 'pre', 'img', 'a', 'div']):
+        if tag.name == 'div':
+            if is_title_div(tag):
+                last_title = clean_text(tag.get_text(strip=True))
+                # A title describes the images before it
+                for image, _ in untitled_images:
+                    image['description'] = last_title
+                untitled_images = []
+        elif tag.name == 'p':
+            paragraphs.append(tag.get_text())
+        elif tag.name == 'pre':
+            code = tag.find('code') if 'highlight' in tag.get('class', ()) else None
+            if code:
+                title_text = last_title
+                if title_text is None:
+                    # The title of the first code block may precede the section
+                    title = tag.find_previous('div', class_='title')
+                    title_text = clean_text(title.get_text(strip=True)) if title else 'Untitled Code Block'
+                code_blocks.append({
+                    'title': title_text,
+                    'code': f"{title_text}\n{code.get_text()}"
+                })
+        elif tag.name == 'img':
+            image = {'src': tag.get('src'), 'description': ''}
+            images.append(image)
+            untitled_images.append((image, tag))
+        elif tag.name == 'a':
+            href = tag.get('href')
+            if href is not None and href.startswith('#chapter'):
+                references.append({
+                    'chapter_ref': href.replace('#', ''),
+                    'text': clean_text(tag.get_text(strip=True))
+                })
+        elif heading is None:
+            heading = tag
 
-    Parameters:
-    soup (BeautifulSoup): The BeautifulSoup object of the HTML content.
+    # The title of the last images may follow the section
+    for image, tag in untitled_images:
+        title = tag.find_next('div', class_='title')
+        image['description'] = clean_text(title.get_text(strip=True)) if title else ''
 
-    Returns:
-    list: A list of dictionaries containing 'chapter_ref' and 'text' for each reference.
-    """
-    references = []
-    for a in soup.find_all('a', href=True):
-        href = a['href']
-        if href.startswith('#chapter'):
-            references.append({
-                'chapter_ref': href.replace('#', ''),
-                'text': clean_whitespace(remove_non_ascii(a.get_text(strip=True)))
-            })
-    return references
+    section_title = clean_text(heading.get_text(strip=True) if heading else 'Untitled Section')
+    text_content = clean_text(' '.join(paragraphs).replace('\n', ' ').strip())
+    return {
+        'title': section_title,
+        'text_content': f"{section_title}\n\n{text_content}",
+        'code_blocks': code_blocks,
+        'images': images,
+        'references': references,
+        'section_title': section_title
+    }
 
 def extract_sections(soup):
     """
@@ -166,19 +244,7 @@ def extract_sections(soup):
     Returns:
     list: A list of dictionaries containing 'title', 'text_content', 'code_blocks', 'images', 'references', and 'section_title' for each section.
     """
-    sections = []
-    for section in soup.find_all('div', class_='sect2'):
-        section_title = section.find('h3').get_text(strip=True) if section.find('h3') else 'Untitled Section'
-        section_content = {
-            'title': clean_whitespace(remove_non_ascii(section_title)),
-            'text_content': f"{clean_whitespace(remove_non_ascii(section_title))}\n\n{extract_text_content(section).strip()}",
-            'code_blocks': extract_code_blocks(section),
-            'images': extract_images(section),
-            'references': extract_references(section),
-            'section_title': clean_whitespace(remove_non_ascii(section_title))
-        }
-        sections.append(section_content)
-    return sections
+    return [extract_section(section) for section in soup.find_all('div', class_='sect2')]
 
 def parse_html_content_with_sections(soup):
     """
@@ -198,20 +264,59 @@ def parse_html_content_with_sections(soup):
         'sections': sections
     }
 
-def get_processed_data():
+def read_corpus_file(directory):
+    try:
+        with open(directory / CORPUS_FILENAME, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"The {CORPUS_FILENAME} file was not found in the PROCESSED_DIR directory.")
+    except json.JSONDecodeError as e:
+        raise json.JSONDecodeError(f"Error decoding the JSON file: {str(e)}", e.doc, e.pos)
+
+def get_chapters(directory=PROCESSED_DIR):
+    """
+    Get the chapter titles, summaries and keywords from the PROCESSED_DIR directory, without their sections.
+
+    Section bodies are read on demand from the section store (see data.section_store).
+
+    Parameters:
+    directory (Path): The directory containing the processed data.
+
+    Returns:
+    dict: A dictionary where keys are chapter numbers and values are the chapter metadata.
     """
-    Get the processed data from the PROCESSED_DIR directory.
+    return {
+        chapter_num: {key: value for key, value in chapter_data.items() if key != 'sections'}
+        for chapter_num, chapter_data in read_corpus_file(directory).items()
+    }
+
+def get_processed_data(directory=PROCESSED_DIR):
+    """
+    Get the processed chapter text and metadata from the PROCESSED_DIR directory.
+
+    Embeddings are not included; they are memory-mapped separately by data.store.load_vector_index.
+    All section bodies are read into memory, so retrieval uses get_chapters and the section store instead.
+
+    Parameters:
+    directory (Path): The directory containing the processed data.
 
     Returns:
     dict: A dictionary containing the processed data.
     """
+    processed_data = read_corpus_file(directory)
+    # Stores written before the section store keep the sections in the corpus file
+    if any('sections' in chapter_data for chapter_data in processed_data.values()):
+        return processed_data
+
+    for chapter_data in processed_data.values():
+        chapter_data['sections'] = []
+    section_store = SectionStore(directory / SECTIONS_FILENAME)
     try:
-        with open(PROCESSED_DIR / 'processed_data.json', 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        raise FileNotFoundError("The processed_data.json file was not found in the PROCESSED_DIR directory.")
-    except json.JSONDecodeError as e:
-        raise json.JSONDecodeError(f"Error decoding the JSON file: {str(e)}", e.doc, e.pos)
+        for chapter_num, _, section in section_store.iter_chapter_sections():
+            processed_data[chapter_num]['sections'].append(section)
+    finally:
+        section_store.close()
+    return processed_data
 
 if __name__ == "__main__":
     chapters = read_all_chapter_html_files()
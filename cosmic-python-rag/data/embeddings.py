@@ -1,42 +1,149 @@
 import numpy as np
-from openai import OpenAI
-from dotenv import load_dotenv
-from cosmic-python-rag_rag.config import OPENAI_MODEL_EMB
-from sklearn.metrics.pairwise import cosine_similarity
-import os
+from cosmic-python-rag_rag.clients import get_client
+from cosmic-python-rag_rag.config import EMBEDDING_BATCH_MAX_ITEMS, EMBEDDING_BATCH_MAX_TOKENS, OPENAI_MODEL_EMB
+from cosmic-python-rag_rag.data.cache import get_cache, make_key
+from cosmic-python-rag_rag.instrumentation import count, count_usage
 
-load_dotenv()
+def get_cached_embeddings(texts: list) -> list:
+    """
+    Look up embeddings for the given texts in the persistent cache.
+
+    Args:
+        texts (list): The input texts.
+
+    Returns:
+        list: The cached embedding for each text, or None where it is not cached.
+    """
+    cache = get_cache()
+    if cache is None:
+        return [None] * len(texts)
+    values = cache.get_many([make_key('embedding', OPENAI_MODEL_EMB, text) for text in texts])
+    embeddings = [np.frombuffer(value, dtype=np.float32).tolist() if value is not None else None for value in values]
+    hits = sum(embedding is not None for embedding in embeddings)
+    count('cache_lookups', hits, cache='embedding', result='hit')
+    count('cache_lookups', len(texts) - hits, cache='embedding', result='miss')
+    return embeddings
+
+def store_embeddings(texts: list, embeddings: list):
+    """
+    Store embeddings in the persistent cache.
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    Args:
+        texts (list): The input texts.
+        embeddings (list): The embedding vectors for the texts.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+    cache.set_many([
+        (make_key('embedding', OPENAI_MODEL_EMB, text), np.asarray(embedding, dtype=np.float32).tobytes())
+        for text, embedding in zip(texts, embeddings)
+    ])
 
 def get_embedding(text: str) -> list:
     """
     Generate an embedding for the given text using OpenAI's API.
 
+    Embeddings are served from the persistent cache when the same text was embedded before.
+
     Args:
         text (str): The input text to generate an embedding for.
 
     Returns:
         list: The embedding vector for the input text.
     """
+    cached = get_cached_embeddings([text])[0]
+    if cached is not None:
+        return cached
+
     try:
-        response = client.embeddings.create(
+        response = get_client().embeddings.create(
             input=[text],
             model=OPENAI_MODEL_EMB
         )
+        count_usage(response.usage, OPENAI_MODEL_EMB)
         embedding = response.data[0].embedding
+        store_embeddings([text], [embedding])
         return embedding
     except Exception as e:
         raise e
 
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimate the number of tokens in a text (about four characters per token for English).
+
+    Args:
+        text (str): The input text.
+
+    Returns:
+        int: The estimated token count.
+    """
+    return len(text) // 4 + 1
+
+def make_batches(texts: list, max_items: int, max_tokens: int) -> list:
+    """
+    Split texts into batches that respect a per-request item and token budget.
+
+    A single text that exceeds the token budget on its own is sent as a one-item batch.
+
+    Args:
+        texts (list): The input texts.
+        max_items (int): The maximum number of texts per batch.
+        max_tokens (int): The maximum estimated number of tokens per batch.
+
+    Returns:
+        list: A list of batches, each a list of indices into texts.
+    """
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def get_embeddings_batch(texts: list, max_items: int = EMBEDDING_BATCH_MAX_ITEMS, max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS) -> list:
+    """
+    Generate embeddings for many texts, packing several texts into each API request.
+
+    Texts found in the persistent cache are not sent to the API.
+
+    Args:
+        texts (list): The input texts to generate embeddings for.
+        max_items (int): The maximum number of texts per request.
+        max_tokens (int): The maximum estimated number of tokens per request.
+
+    Returns:
+        list: The embedding vectors, in the same order as texts.
+    """
+    embeddings = get_cached_embeddings(texts)
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    for batch in make_batches([texts[i] for i in missing], max_items, max_tokens):
+        batch = [missing[i] for i in batch]
+        response = get_client().embeddings.create(
+            input=[texts[i] for i in batch],
+            model=OPENAI_MODEL_EMB
+        )
+        count_usage(response.usage, OPENAI_MODEL_EMB)
+        for item in response.data:
+            embeddings[batch[item.index]] = item.embedding
+        store_embeddings([texts[i] for i in batch], [embeddings[i] for i in batch])
+    return embeddings
+
 def calculate_similarity(embedding1, embedding2):
-    # Reshape embeddings to 2D arrays
-    embedding1 = np.array(embedding1).reshape(1, -1)
-    embedding2 = np.array(embedding2).reshape(1, -1)
-    
-    # Calculate cosine similarity
-    similarity = cosine_similarity(embedding1, embedding2)[0][0]
-    return similarity
+    embedding1 = np.asarray(embedding1, dtype=np.float64).ravel()
+    embedding2 = np.asarray(embedding2, dtype=np.float64).ravel()
+
+    # Calculate cosine similarity; zero vectors are not similar to anything
+    norms = np.linalg.norm(embedding1) * np.linalg.norm(embedding2)
+    return float(embedding1 @ embedding2 / norms) if norms else 0.0
 
 if __name__ == "__main__":
     sample_text = "Your text here"
@@ -0,0 +1,94 @@
+import hashlib
+import json
+from cosmic-python-rag_rag.config import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, FINGERPRINTS_FILENAME, OPENAI_MODEL_EMB, OPENAI_MODEL_GPT, PROCESSED_DIR, SUMMARY_PROMPT
+from cosmic-python-rag_rag.vector_index import atomic_write
+
+
+def hash_text(text):
+    """
+    Hash a text with SHA-256.
+
+    Parameters:
+    text (str): The input text.
+
+    Returns:
+    str: The hex digest.
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def hash_file(path):
+    """
+    Hash the raw bytes of a file with SHA-256.
+
+    Parameters:
+    path (Path): The file to hash.
+
+    Returns:
+    str: The hex digest.
+    """
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def chapter_fingerprint(file_hash, sections):
+    """
+    Build the fingerprint of a parsed chapter.
+
+    Parameters:
+    file_hash (str): The hash of the chapter HTML file.
+    sections (list): The parsed sections of the chapter.
+
+    Returns:
+    dict: The file hash, deciding whether the chapter is parsed again, and the hash of the full chapter
+    text, deciding whether it is summarized again. Chunks are re-embedded by their own text, see indexing.
+    """
+    return {
+        'file_hash': file_hash,
+        'text_hash': hash_text(' '.join(section['text_content'] for section in sections)),
+    }
+
+
+def settings_hash():
+    """
+    Hash the settings that the stored chunks, embeddings and summaries depend on.
+
+    Returns:
+    str: The hex digest of the embedding and summary models, the chunking settings and the summary prompt.
+    """
+    return hash_text(json.dumps([OPENAI_MODEL_EMB, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, OPENAI_MODEL_GPT, SUMMARY_PROMPT]))
+
+
+def load_fingerprints(directory=PROCESSED_DIR):
+    """
+    Load the chapter fingerprints saved by the last indexing run.
+
+    Fingerprints saved with other settings (see settings_hash), or before the settings were
+    saved, are ignored, so every chapter is processed again.
+
+    Parameters:
+    directory (Path): The processed data directory.
+
+    Returns:
+    dict: Chapter numbers mapped to fingerprints, or an empty dict if there are none or they are stale.
+    """
+    try:
+        with open(directory / FINGERPRINTS_FILENAME, 'r') as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if saved.get('settings_hash') != settings_hash():
+        return {}
+    return saved['chapters']
+
+
+def save_fingerprints(fingerprints, directory=PROCESSED_DIR):
+    """
+    Save chapter fingerprints next to the processed data, together with the hash of the current settings.
+
+    Parameters:
+    fingerprints (dict): Chapter numbers mapped to fingerprints.
+    directory (Path): The processed data directory.
+    """
+    with atomic_write(directory / FINGERPRINTS_FILENAME, 'w') as f:
+        json.dump({'settings_hash': settings_hash(), 'chapters': fingerprints}, f, separators=(',', ':'))
@@ -1,28 +1,67 @@
-import openai
-from dotenv import load_dotenv
+from cosmic-python-rag_rag.clients import get_client
 from cosmic-python-rag_rag.config import OPENAI_MODEL_GPT, SUMMARY_PROMPT, TEMPERATURE
-import os
+from cosmic-python-rag_rag.data.cache import get_cache, make_key
+from cosmic-python-rag_rag.instrumentation import count, count_usage
 
-load_dotenv()
+def summary_cache_key(chapter_text: str) -> str:
+    """
+    Get the cache key of a chapter summary. The prompt is part of the key, so editing it invalidates old summaries.
+
+    Parameters:
+    chapter_text (str): The text content of the chapter.
+
+    Returns:
+    str: The cache key.
+    """
+    return make_key('summary', OPENAI_MODEL_GPT, f"{SUMMARY_PROMPT}\0{chapter_text}")
+
+def get_cached_summary(chapter_text: str):
+    """
+    Look up a chapter summary in the persistent cache.
+
+    Parameters:
+    chapter_text (str): The text content of the chapter.
+
+    Returns:
+    str: The cached summary, or None if it is not cached.
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+    value = cache.get(summary_cache_key(chapter_text))
+    count('cache_lookups', cache='summary', result='hit' if value is not None else 'miss')
+    return value.decode('utf-8') if value is not None else None
+
+def store_summary(chapter_text: str, summary: str):
+    """
+    Store a chapter summary in the persistent cache.
+
+    Parameters:
+    chapter_text (str): The text content of the chapter.
+    summary (str): The generated summary.
+    """
+    cache = get_cache()
+    if cache is not None:
+        cache.set(summary_cache_key(chapter_text), summary.encode('utf-8'))
 
 def generate_chapter_summary(chapter_text: str) -> str:
     """
     Generate a summary for a given chapter using OpenAI's API.
 
+    Summaries are served from the persistent cache when the chapter text has not changed.
+
     Parameters:
     chapter_text (str): The text content of the chapter to be summarized.
 
     Returns:
     str: The generated summary of the chapter.
     """
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY environment variable is not set")
-    
-    client = openai.OpenAI(api_key=api_key)
+    cached = get_cached_summary(chapter_text)
+    if cached is not None:
+        return cached
 
     try:
-        response = client.chat.completions.create(
+        response = get_client().chat.completions.create(
             model=OPENAI_MODEL_GPT,
             messages=[
                 {"role": "system", "content": SUMMARY_PROMPT},
@@ -32,7 +71,9 @@ def generate_chapter_summary(chapter_text: str) -> str:
             temperature=TEMPERATURE,
         )
 
+        count_usage(response.usage, OPENAI_MODEL_GPT)
         summary = response.choices[0].message.content.strip()
+        store_summary(chapter_text, summary)
         return summary
     except Exception as e:
         raise e
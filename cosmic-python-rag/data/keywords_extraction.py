@@ -1,23 +1,55 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
 import numpy as np
-from scipy.sparse import csr_matrix
-from nltk.corpus import stopwords
-import nltk
+from scipy.sparse import diags
+from ..config import TOP_N_KEYWORDS
+from ..keyword_index import ENGLISH_STOP_WORDS
 
-nltk.download('stopwords', quiet=True)
+def get_stop_words():
+    """
+    Get the English stopwords, bundled with the package so indexing never downloads them.
+
+    Returns:
+    frozenset: The stopwords.
+    """
+    return ENGLISH_STOP_WORDS
+
+def top_k_per_row(matrix, k):
+    """
+    Get the column indices of the k largest stored values of every row of a sparse matrix.
+
+    Only the non-zero entries of each row are partitioned, so rows are never densified.
+
+    Parameters:
+    matrix (scipy.sparse.csr_matrix): The input matrix.
+    k (int): The number of columns per row.
+
+    Returns:
+    list: For every row, an array of column indices sorted by descending value.
+    """
+    top_columns = []
+    for start, end in zip(matrix.indptr[:-1], matrix.indptr[1:]):
+        values = matrix.data[start:end]
+        columns = matrix.indices[start:end]
+        if len(values) > k:
+            candidates = np.argpartition(-values, k - 1)[:k]
+            values, columns = values[candidates], columns[candidates]
+        top_columns.append(columns[np.argsort(-values, kind='stable')])
+    return top_columns
 
 def ct_idf_keyword_extraction(chapters):
     """
     Extract keywords using c-TF-IDF scores from chapters of a single document.
 
+    All chapters should be passed at once: each chapter is a class of the c-TF-IDF, so its
+    keywords are the terms that distinguish it from the rest of the document.
+
     Parameters:
     chapters (dict): A dictionary where keys are chapter identifiers and values are dictionaries
                      containing chapter content. Each chapter content dictionary should have a 
                      'sections' key with a list of text sections.
 
     Returns:
-    dict: A dictionary where keys are chapter identifiers and values are lists of top 10 keywords 
-          for each chapter based on c-TF-IDF scores.
+    dict: A dictionary where keys are chapter identifiers and values are lists of the top TOP_N_KEYWORDS
+          keywords for each chapter based on c-TF-IDF scores.
     """
     chapter_texts = []
     chapter_keys = []
@@ -27,28 +59,23 @@ def ct_idf_keyword_extraction(chapters):
         combined_text = ' '.join([section['text_content'] for section in chapter_content['sections']])
         chapter_texts.append(combined_text)
 
-    # Calculate TF-IDF scores with stopwords removed
-    stop_words = stopwords.words('english')
-    vectorizer = TfidfVectorizer(stop_words=stop_words)
+    # scikit-learn is only needed for indexing, so it is not imported by the query path
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    # Calculate TF-IDF scores with stopwords removed, fitted once over all chapters
+    vectorizer = TfidfVectorizer(stop_words=list(get_stop_words()))
     tfidf_matrix = vectorizer.fit_transform(chapter_texts)
     feature_names = vectorizer.get_feature_names_out()
 
-    # Calculate c-TF-IDF scores
+    # Calculate c-TF-IDF scores: scale every term column by num_docs / its total TF-IDF mass
     num_docs = len(chapter_texts)
-    tfidf_matrix_sum = tfidf_matrix.sum(axis=0)
-    c_tfidf_matrix = tfidf_matrix.multiply(num_docs).multiply(1 / tfidf_matrix_sum)
-
-    # Convert to CSR matrix for efficient row slicing
-    c_tfidf_matrix = csr_matrix(c_tfidf_matrix)
+    tfidf_matrix_sum = np.asarray(tfidf_matrix.sum(axis=0)).ravel()
+    c_tfidf_matrix = (tfidf_matrix @ diags(num_docs / tfidf_matrix_sum)).tocsr()
 
-    keywords = {}
-    for i, chapter_key in enumerate(chapter_keys):
-        c_tfidf_scores = c_tfidf_matrix[i].toarray().flatten()
-        sorted_indices = np.argsort(c_tfidf_scores)[::-1]
-        top_keywords = [feature_names[idx] for idx in sorted_indices[:10]]
-        keywords[chapter_key] = top_keywords
-
-    return keywords
+    return {
+        chapter_key: [feature_names[idx] for idx in top_columns]
+        for chapter_key, top_columns in zip(chapter_keys, top_k_per_row(c_tfidf_matrix, TOP_N_KEYWORDS))
+    }
 
 def keywords_from_description(chapters):
     """
@@ -90,10 +117,10 @@ def extract_keywords(chapters):
                      containing chapter content.
 
     Returns:
-    dict: A dictionary where keys are chapter identifiers and values are lists of top 10 keywords 
+    dict: A dictionary where keys are chapter identifiers and values are lists of keywords 
           for each chapter, combining results from c-TF-IDF and description-based extraction.
     """
-    stop_words = set(stopwords.words('english'))
+    stop_words = get_stop_words()
 
     ct_idf_keywords = ct_idf_keyword_extraction(chapters)
     description_keywords = keywords_from_description(chapters)
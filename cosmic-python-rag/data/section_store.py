@@ -0,0 +1,134 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from cosmic-python-rag_rag.config import SECTION_CACHE_ITEMS
+
+
+def section_body(section):
+    return {key: value for key, value in section.items() if key not in ('embedding', 'chunk_embeddings')}
+
+
+def write_section_store(processed_data, path):
+    """
+    Write the section bodies to an SQLite file, one row per section of the vector index.
+
+    The file is written under a temporary name and moved into place, so processes that
+    have the previous file open keep reading it.
+
+    Parameters:
+    processed_data (dict): The processed data containing chapter information.
+    path (Path): The SQLite database file.
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    if tmp_path.exists():
+        tmp_path.unlink()
+    try:
+        connection = sqlite3.connect(str(tmp_path))
+        connection.execute(
+            "CREATE TABLE sections (row INTEGER PRIMARY KEY, chapter_num TEXT NOT NULL, section_index INTEGER NOT NULL, body TEXT NOT NULL)"
+        )
+        rows = (
+            (chapter_num, section_index, json.dumps(section_body(section), separators=(',', ':')))
+            for chapter_num, chapter_data in processed_data.items()
+            for section_index, section in enumerate(chapter_data['sections'])
+        )
+        connection.executemany(
+            "INSERT INTO sections (row, chapter_num, section_index, body) VALUES (?, ?, ?, ?)",
+            ((row, *values) for row, values in enumerate(rows))
+        )
+        connection.commit()
+        connection.close()
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+class SectionStore:
+    """
+    Read-only SQLite store of section bodies, fetched on demand with an in-memory LRU front.
+
+    Retrieval only needs the embeddings and ids to score sections; the text, code blocks,
+    images and references are read for the few sections that are returned. Safe to share
+    between threads, and any number of processes can open the same file.
+    """
+
+    def __init__(self, path, cache_items=SECTION_CACHE_ITEMS):
+        """
+        Parameters:
+        path (Path): The SQLite database file written by write_section_store.
+        cache_items (int): The maximum number of sections kept in the in-memory LRU.
+        """
+        if not path.exists():
+            raise FileNotFoundError(f"Section store {path} not found")
+        self.cache_items = cache_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+
+    def _remember(self, row, section):
+        self.memory[row] = section
+        self.memory.move_to_end(row)
+        while len(self.memory) > self.cache_items:
+            self.memory.popitem(last=False)
+
+    def get_many(self, rows):
+        """
+        Get the bodies of the given sections.
+
+        Parameters:
+        rows (list): Section rows of the vector index.
+
+        Returns:
+        list: The section dicts, in the order of rows.
+        """
+        rows = [int(row) for row in rows]
+        with self.lock:
+            sections = {}
+            for row in rows:
+                if row in self.memory:
+                    self.memory.move_to_end(row)
+                    sections[row] = self.memory[row]
+            missing = [row for row in rows if row not in sections]
+            if missing:
+                placeholders = ','.join('?' * len(missing))
+                for row, body in self.connection.execute(
+                    f"SELECT row, body FROM sections WHERE row IN ({placeholders})", missing
+                ):
+                    sections[row] = json.loads(body)
+                    self._remember(row, sections[row])
+            return [sections[row] for row in rows]
+
+    def iter_chapter_sections(self):
+        """
+        Iterate over all sections in row order.
+
+        Yields:
+        tuple: The chapter number, section index and section dict.
+        """
+        with self.lock:
+            records = self.connection.execute("SELECT chapter_num, section_index, body FROM sections ORDER BY row").fetchall()
+        for chapter_num, section_index, body in records:
+            yield chapter_num, section_index, json.loads(body)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class InMemorySectionStore:
+    """
+    Section store over processed data that is already in memory, with the same interface as SectionStore.
+    """
+
+    def __init__(self, processed_data):
+        self.sections = [
+            section
+            for chapter_data in processed_data.values()
+            for section in chapter_data['sections']
+        ]
+
+    def get_many(self, rows):
+        return [self.sections[row] for row in rows]
@@ -0,0 +1,232 @@
+import json
+import numpy as np
+from cosmic-python-rag_rag.ann import FAISS_FILENAME, HNSWLIB_FILENAME, IVF_FILENAME, build_ann_index
+from cosmic-python-rag_rag.bm25 import BM25_VOCABULARY_FILENAME, BM25_WEIGHTS_FILENAME, BM25Index
+from cosmic-python-rag_rag.config import CORPUS_FILENAME, LEGACY_PROCESSED_DATA_FILENAME, MANIFEST_FILENAME, PROCESSED_DIR, SECTION_SEARCH, SECTIONS_FILENAME
+from cosmic-python-rag_rag.data.data_cleaning import get_processed_data
+from cosmic-python-rag_rag.data.section_store import SectionStore, write_section_store
+from cosmic-python-rag_rag.quantization import COMPACT_FILENAME, build_compact_matrix
+from cosmic-python-rag_rag.vector_index import (
+    CHAPTER_EMBEDDINGS_FILENAME, CHUNK_EMBEDDINGS_FILENAME, CHUNK_SECTIONS_FILENAME, INDEX_IDS_FILENAME,
+    SECTION_EMBEDDINGS_FILENAME, VectorIndex, atomic_write
+)
+
+# The files read when a store is loaded, covered by its manifest
+STORE_FILENAMES = (
+    CORPUS_FILENAME, SECTIONS_FILENAME, INDEX_IDS_FILENAME, CHAPTER_EMBEDDINGS_FILENAME, SECTION_EMBEDDINGS_FILENAME,
+    CHUNK_EMBEDDINGS_FILENAME, CHUNK_SECTIONS_FILENAME, BM25_WEIGHTS_FILENAME, BM25_VOCABULARY_FILENAME,
+    IVF_FILENAME, FAISS_FILENAME, HNSWLIB_FILENAME, COMPACT_FILENAME,
+)
+
+
+def get_chapter_metadata(processed_data):
+    """
+    Get the chapter titles, summaries and keywords of the processed data, without embeddings or sections.
+
+    Parameters:
+    processed_data (dict): The processed data containing chapter information and embeddings.
+
+    Returns:
+    dict: The chapter metadata only.
+    """
+    return {
+        chapter_num: {key: value for key, value in chapter_data.items() if key not in ('chapter_summary_embedding', 'sections')}
+        for chapter_num, chapter_data in processed_data.items()
+    }
+
+
+def save_processed_data(processed_data, directory=PROCESSED_DIR):
+    """
+    Save processed data in the binary store format.
+
+    Embeddings are written as normalized float32 .npy matrices that can be memory-mapped,
+    the BM25 weights as a sparse .npz matrix, the ANN index when sections are searched directly,
+    the compact chunk matrix when EMBEDDING_PRECISION or EMBEDDING_DIMENSIONS is set,
+    the section bodies to an SQLite section store, and the chapter metadata to a compact JSON file.
+    Every file is replaced atomically, and the manifest is written last (see store_unchanged).
+
+    Parameters:
+    processed_data (dict): The processed data containing chapter information and embeddings.
+    directory (Path): The directory to write the store to.
+
+    Returns:
+    VectorIndex: The index that was written.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    index = VectorIndex.from_processed_data(processed_data)
+    index.save(directory)
+    BM25Index.from_processed_data(processed_data).save(directory)
+    if SECTION_SEARCH == 'direct':
+        build_ann_index(index.chunk_matrix).save(directory)
+    compact = build_compact_matrix(index.chunk_matrix)
+    if compact is not None:
+        compact.save(directory)
+    else:
+        # A compact matrix of the previous embeddings could have the same number of rows
+        (directory / COMPACT_FILENAME).unlink(missing_ok=True)
+    write_section_store(processed_data, directory / SECTIONS_FILENAME)
+    with atomic_write(directory / CORPUS_FILENAME, 'w') as corpus_file:
+        json.dump(get_chapter_metadata(processed_data), corpus_file, separators=(',', ':'))
+    write_manifest(directory)
+    return index
+
+
+def file_signature(path):
+    """
+    Get the inode, size and modification time of a file; atomic_write replaces a file with a new inode.
+
+    Returns:
+    list: The signature, or None if the file does not exist.
+    """
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def write_manifest(directory=PROCESSED_DIR):
+    """
+    Record the signature of every store file, once all of them have been written.
+    """
+    with atomic_write(directory / MANIFEST_FILENAME, 'w') as manifest_file:
+        json.dump({filename: file_signature(directory / filename) for filename in STORE_FILENAMES}, manifest_file)
+
+
+def read_manifest(directory=PROCESSED_DIR):
+    """
+    Read the manifest of the store.
+
+    Returns:
+    dict: File names mapped to their signatures, or None for stores written before manifests.
+    """
+    try:
+        with open(directory / MANIFEST_FILENAME, 'r') as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+
+
+def store_unchanged(directory, manifest):
+    """
+    Check that the store files still match a manifest read before they were loaded.
+
+    While indexing updates a store, the files already replaced do not match the previous manifest,
+    and once it is done the manifest itself differs, so a load that read files of two versions fails
+    this check. Stores without a manifest are not checked.
+
+    Parameters:
+    directory (Path): The directory containing the store.
+    manifest (dict): The manifest read before loading, see read_manifest.
+
+    Returns:
+    bool: Whether the loaded files are all from the version of the manifest.
+    """
+    if manifest is None:
+        return True
+    return read_manifest(directory) == manifest and all(
+        file_signature(directory / filename) == signature for filename, signature in manifest.items()
+    )
+
+
+def load_vector_index(directory=PROCESSED_DIR):
+    """
+    Load the memory-mapped vector index from the store.
+
+    Parameters:
+    directory (Path): The directory containing the store.
+
+    Returns:
+    VectorIndex: The loaded index.
+    """
+    try:
+        return VectorIndex.load(directory)
+    except FileNotFoundError:
+        if (directory / LEGACY_PROCESSED_DATA_FILENAME).exists():
+            raise FileNotFoundError(
+                f"Found legacy {LEGACY_PROCESSED_DATA_FILENAME} but no embedding store. Run 'main.py convert' first."
+            )
+        raise
+
+
+def load_bm25_index(num_sections, directory=PROCESSED_DIR):
+    """
+    Load the BM25 index from the store, building it from the processed data if it is missing or stale.
+
+    Parameters:
+    num_sections (int): The number of sections in the vector index.
+    directory (Path): The directory containing the store.
+
+    Returns:
+    BM25Index: The index, with one row per section.
+    """
+    try:
+        bm25_index = BM25Index.load(directory)
+        if bm25_index.weights.shape[0] == num_sections:
+            return bm25_index
+    except FileNotFoundError:
+        pass
+    return BM25Index.from_processed_data(get_processed_data(directory))
+
+
+def load_section_store(directory=PROCESSED_DIR):
+    """
+    Open the section store, creating it first for stores that keep the sections in the corpus file.
+
+    Parameters:
+    directory (Path): The directory containing the store.
+
+    Returns:
+    SectionStore: The section store.
+    """
+    path = directory / SECTIONS_FILENAME
+    if not path.exists():
+        write_section_store(get_processed_data(directory), path)
+    return SectionStore(path)
+
+
+def load_processed_data_with_embeddings(directory=PROCESSED_DIR):
+    """
+    Load the stored processed data with its embeddings copied back into each chapter and section.
+
+    Used to update an existing store; the copies make it safe to overwrite the store afterwards.
+
+    Parameters:
+    directory (Path): The directory containing the store.
+
+    Returns:
+    dict: The processed data in the format produced by indexing, or an empty dict if there is no store.
+    """
+    try:
+        processed_data = get_processed_data(directory)
+        index = VectorIndex.load(directory)
+    except FileNotFoundError:
+        return {}
+
+    for chapter_num, chapter_data in processed_data.items():
+        chapter_data['chapter_summary_embedding'] = np.array(index.chapter_matrix[index.chapter_rows[chapter_num]])
+        start, _ = index.chapter_section_rows.get(chapter_num, (0, 0))
+        for section_index, section in enumerate(chapter_data['sections']):
+            chunk_start, chunk_end = index.chunk_offsets[start + section_index], index.chunk_offsets[start + section_index + 1]
+            section['chunk_embeddings'] = list(np.array(index.chunk_matrix[chunk_start:chunk_end]))
+    return processed_data
+
+
+def convert_json_store(directory=PROCESSED_DIR):
+    """
+    Convert a legacy processed_data.json file into the binary store format.
+
+    Parameters:
+    directory (Path): The directory containing processed_data.json, where the store is written.
+
+    Returns:
+    int: The number of converted chapters.
+    """
+    with open(directory / LEGACY_PROCESSED_DATA_FILENAME, 'r') as legacy_file:
+        processed_data = json.load(legacy_file)
+    save_processed_data(processed_data, directory)
+    return len(processed_data)
+
+
+if __name__ == "__main__":
+    print(f"Converted {convert_json_store()} chapters")
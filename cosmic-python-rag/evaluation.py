@@ -0,0 +1,256 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from cosmic-python-rag_rag.benchmark import fake_embedding, get_git_commit, summarize_latencies
+from cosmic-python-rag_rag.config import EVALUATION_DATASET, EVALUATION_K, EVALUATION_OUTPUT, EVALUATION_WORKERS, PROCESSED_DIR
+from cosmic-python-rag_rag.corpus import load_corpus
+from cosmic-python-rag_rag.data.embeddings import get_cached_embeddings, get_embeddings_batch
+from cosmic-python-rag_rag.data.store import load_vector_index
+from cosmic-python-rag_rag.retreival import get_final_retrieval, get_initial_retrieval, get_lexical_retrieval, section_id
+
+# Settings a configuration may override; they are read when a query is retrieved or the corpus is loaded
+EVALUATION_SETTINGS = (
+    'TOP_N_SECTIONS', 'TOP_N_CHAPTERS', 'SCORE_BOOST_FOR_MATCH', 'RETRIEVAL_MODE', 'FUSION_METHOD', 'RRF_K',
+    'HYBRID_DENSE_WEIGHT', 'BM25_CANDIDATES', 'LEXICAL_SHORTCUT_MARGIN', 'SECTION_SEARCH', 'ANN_CANDIDATES',
+)
+STAGES = ('lexical', 'initial', 'final', 'total')
+
+
+def load_dataset(path):
+    """
+    Load an evaluation dataset.
+
+    Each line of the JSONL file is {"query": "...", "sections": ["<chapter_num>:<section_title>", ...]},
+    listing the sections that answer the query.
+
+    Parameters:
+    path (Path): The dataset file.
+
+    Returns:
+    list: The dataset entries.
+    """
+    with open(path, 'r') as dataset_file:
+        dataset = [json.loads(line) for line in dataset_file if line.strip()]
+    for line_number, entry in enumerate(dataset, 1):
+        if not entry.get('query') or not entry.get('sections'):
+            raise ValueError(f"{path} entry {line_number} needs a 'query' and a non-empty 'sections' list")
+    return dataset
+
+
+def load_configurations(path):
+    """
+    Load the retrieval configurations to compare.
+
+    The JSON file maps a configuration name to the settings it overrides, e.g.
+    {"baseline": {}, "more_chapters": {"TOP_N_CHAPTERS": 5}}.
+
+    Parameters:
+    path (Path): The configurations file, or None for the current settings only.
+
+    Returns:
+    dict: Configuration names mapped to their overrides.
+    """
+    if path is None:
+        return {'baseline': {}}
+    with open(path, 'r') as configurations_file:
+        configurations = json.load(configurations_file)
+    for name, overrides in configurations.items():
+        unknown = set(overrides) - set(EVALUATION_SETTINGS)
+        if unknown:
+            raise ValueError(f"Configuration {name} overrides unsupported settings: {', '.join(sorted(unknown))}")
+    return configurations
+
+
+def embed_queries(queries, embeddings, dim):
+    """
+    Get the query embeddings for the evaluation.
+
+    Parameters:
+    queries (list): The queries.
+    embeddings (str): 'cached' (persistent cache only), 'fake' (deterministic, no API calls) or 'api'.
+    dim (int): The embedding dimension of the index, used by the fake embedder.
+
+    Returns:
+    list: The query embeddings.
+    """
+    if embeddings == 'fake':
+        return [fake_embedding(query, dim) for query in queries]
+    if embeddings == 'cached':
+        cached = get_cached_embeddings(queries)
+        missing = sum(embedding is None for embedding in cached)
+        if missing:
+            raise ValueError(f"{missing} of {len(queries)} queries are not in the embedding cache. Run once with 'api' embeddings to cache them.")
+        return cached
+    if embeddings == 'api':
+        return get_embeddings_batch(queries)
+    raise ValueError(f"Unknown embeddings source: {embeddings}")
+
+
+def apply_overrides(overrides):
+    """
+    Override settings in the config module and in every module of the package that imported them.
+
+    Parameters:
+    overrides (dict): Setting names mapped to their values.
+
+    Returns:
+    list: (module, name, value) tuples to restore the previous values with restore_overrides.
+    """
+    package = __name__.rsplit('.', 1)[0]
+    previous = []
+    for name, value in overrides.items():
+        for module_name, module in list(sys.modules.items()):
+            if (module_name == package or module_name.startswith(package + '.')) and hasattr(module, name):
+                previous.append((module, name, getattr(module, name)))
+                setattr(module, name, value)
+    return previous
+
+
+def restore_overrides(previous):
+    for module, name, value in reversed(previous):
+        setattr(module, name, value)
+
+
+def ranking_metrics(retrieved, relevant, ks):
+    """
+    Calculate the ranking metrics of one query with binary relevance.
+
+    Parameters:
+    retrieved (list): The retrieved section ids, best first.
+    relevant (set): The section ids that answer the query.
+    ks (list): The cutoffs for recall and nDCG.
+
+    Returns:
+    dict: recall@k and nDCG@k for every k, and the reciprocal rank.
+    """
+    gains = np.array([section in relevant for section in retrieved], dtype=np.float64)
+    discounts = 1 / np.log2(np.arange(2, len(retrieved) + 2))
+    metrics = {}
+    for k in ks:
+        metrics[f'recall@{k}'] = gains[:k].sum() / len(relevant)
+        ideal = (1 / np.log2(np.arange(2, min(k, len(relevant)) + 2))).sum()
+        metrics[f'ndcg@{k}'] = (gains[:k] * discounts[:k]).sum() / ideal
+    hits = np.flatnonzero(gains)
+    metrics['mrr'] = 1 / (hits[0] + 1) if len(hits) else 0.0
+    return metrics
+
+
+def evaluate_configuration(name, overrides, directory, dataset, query_embeddings, ks):
+    """
+    Evaluate one retrieval configuration, with its overrides applied for the duration of the call.
+
+    Parameters:
+    name (str): The configuration name.
+    overrides (dict): The settings the configuration overrides.
+    directory (Path): The directory containing the store.
+    dataset (list): The dataset entries.
+    query_embeddings (list): The embedding of each query.
+    ks (list): The cutoffs for recall and nDCG.
+
+    Returns:
+    dict: The mean metrics and per-stage latency statistics.
+    """
+    previous = apply_overrides(overrides)
+    try:
+        return evaluate_queries(name, overrides, load_corpus(directory), dataset, query_embeddings, ks)
+    finally:
+        restore_overrides(previous)
+
+
+def evaluate_queries(name, overrides, corpus, dataset, query_embeddings, ks):
+    """
+    Retrieve the sections for every query of the dataset, as get_rag_response does, timing each stage.
+    """
+    metrics = []
+    latencies = {stage: [] for stage in STAGES}
+    lexical_answers = 0
+    for entry, query_embedding in zip(dataset, query_embeddings):
+        query = entry['query']
+        start = time.perf_counter()
+        lexical_response = get_lexical_retrieval(query, corpus)
+        lexical_done = time.perf_counter()
+        latencies['lexical'].append(lexical_done - start)
+        if lexical_response is not None:
+            top_sections = lexical_response[0]
+            lexical_answers += 1
+        else:
+            retrieved_chapters, _, _, chapter_scores = get_initial_retrieval(query, corpus, query_embedding)
+            initial_done = time.perf_counter()
+            top_sections = get_final_retrieval(query_embedding, retrieved_chapters, corpus, chapter_scores, query)
+            latencies['initial'].append(initial_done - lexical_done)
+            latencies['final'].append(time.perf_counter() - initial_done)
+        latencies['total'].append(time.perf_counter() - start)
+        metrics.append(ranking_metrics([section_id(section) for section in top_sections], set(entry['sections']), ks))
+
+    return {
+        'name': name,
+        'overrides': overrides,
+        'queries': len(dataset),
+        'lexical_answers': lexical_answers,
+        'metrics': {metric: float(np.mean([query_metrics[metric] for query_metrics in metrics])) for metric in metrics[0]},
+        'latency': {stage: summarize_latencies(samples) if samples else None for stage, samples in latencies.items()},
+    }
+
+
+def print_results(results, ks):
+    columns = [f'recall@{k}' for k in ks] + ['mrr'] + [f'ndcg@{k}' for k in ks]
+    width = max(len(result['name']) for result in results) + 2
+    print(f"{'config':<{width}}" + ''.join(f"{column:>11}" for column in columns) + f"{'p50 ms':>9}{'p95 ms':>9}")
+    for result in results:
+        total = result['latency']['total']
+        print(
+            f"{result['name']:<{width}}"
+            + ''.join(f"{result['metrics'][column]:>11.3f}" for column in columns)
+            + f"{total['p50_ms']:>9.2f}{total['p95_ms']:>9.2f}"
+        )
+
+
+def run_evaluation(dataset_path=EVALUATION_DATASET, configurations_path=None, embeddings='cached', directory=PROCESSED_DIR,
+                   ks=EVALUATION_K, output=EVALUATION_OUTPUT, workers=EVALUATION_WORKERS):
+    """
+    Compare the retrieval quality and latency of several configurations on a labelled dataset.
+
+    The queries are embedded once and every configuration runs in its own worker process
+    against the same store. Latencies of configurations that run at the same time compete
+    for the CPU; use workers=1 for latency numbers that are comparable with the benchmark.
+
+    Parameters:
+    dataset_path (Path): The JSONL dataset (see load_dataset).
+    configurations_path (Path): The JSON configurations file (see load_configurations), or None.
+    embeddings (str): 'cached', 'fake' or 'api' (see embed_queries).
+    directory (Path): The directory containing the store.
+    ks (list): The cutoffs for recall and nDCG.
+    output (Path): The JSON file to write the results to.
+    workers (int): The number of worker processes, or None for one per configuration up to the number of CPUs.
+
+    Returns:
+    dict: The evaluation results.
+    """
+    dataset = load_dataset(dataset_path)
+    configurations = load_configurations(configurations_path)
+    dim = load_vector_index(directory).chunk_matrix.shape[1]
+    query_embeddings = [np.asarray(embedding, dtype=np.float32) for embedding in embed_queries([entry['query'] for entry in dataset], embeddings, dim)]
+
+    workers = min(workers or os.cpu_count() or 1, len(configurations))
+    arguments = [(name, overrides, directory, dataset, query_embeddings, ks) for name, overrides in configurations.items()]
+    if workers <= 1:
+        config_results = [evaluate_configuration(*args) for args in arguments]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            config_results = list(executor.map(evaluate_configuration, *zip(*arguments)))
+
+    results = {
+        'commit': get_git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'dataset': str(dataset_path),
+        'embeddings': embeddings,
+        'configurations': config_results,
+    }
+    print_results(config_results, ks)
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=4)
+    print(f"Saved evaluation results to {output}")
+    return results
@@ -1,47 +1,164 @@
-import os
-import openai
-from dotenv import load_dotenv
-from cosmic-python-rag_rag.config import OPENAI_MODEL_GPT, RAG_PROMPT, TEMPERATURE
+import time
+from cosmic-python-rag_rag.clients import get_async_client, get_client
+from cosmic-python-rag_rag.config import GENERATION_MAX_TOKENS, OPENAI_MODEL_GPT, RAG_PROMPT, TEMPERATURE
+from cosmic-python-rag_rag.context import build_context
+from cosmic-python-rag_rag.instrumentation import count_usage, span
 
-load_dotenv()
+ERROR_ANSWER = "I'm sorry, but I encountered an error while trying to generate an answer. Please try again later."
 
-def generate_answer(query, top_sections):
+def build_messages(query, top_sections, report=None):
     """
-    Generate an answer based on the query and top sections using OpenAI's GPT model.
+    Build the chat messages for answering the query from the top sections, within the CONTEXT_MAX_TOKENS budget.
 
     Parameters:
     query (str): The input query.
     top_sections (list): A list of top sections that match the query.
+    report (dict): Optional dict that receives the context report of build_context, e.g. 'prompt_tokens'.
 
     Returns:
-    str: The generated answer from the GPT model.
+    list: The system and user messages.
     """
-    sections_context = "\n\n".join([
-        f"Section: {section['section_title']}\n{section['text_content']}"
-        for section in top_sections
-    ])
+    with span('context_assembly', sections=len(top_sections)) as context_span:
+        sections_context, context_report = build_context(query, top_sections)
+        context_span.set(prompt_tokens=context_report['prompt_tokens'], trimmed_sections=context_report['trimmed_sections'])
+    if report is not None:
+        report.update(context_report)
 
     full_prompt = RAG_PROMPT.format(
         sections=sections_context,
     )
 
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY environment variable is not set")
-    
-    client = openai.OpenAI(api_key=api_key)
+    return [
+        {"role": "system", "content": full_prompt},
+        {"role": "user", "content": query}
+    ]
 
+def generate_answer(query, top_sections, report=None):
+    """
+    Generate an answer based on the query and top sections using OpenAI's GPT model.
+
+    Parameters:
+    query (str): The input query.
+    top_sections (list): A list of top sections that match the query.
+    report (dict): Optional dict that receives the context report of build_context, e.g. 'prompt_tokens'.
+
+    Returns:
+    str: The generated answer from the GPT model.
+    """
     try:
-        response = client.chat.completions.create(
-            model=OPENAI_MODEL_GPT,
-            messages=[
-                {"role": "system", "content": full_prompt},
-                {"role": "user", "content": query}
-            ],
-            max_tokens=500,
-            temperature=TEMPERATURE,
-        )
+        messages = build_messages(query, top_sections, report)
+        with span('generation', model=OPENAI_MODEL_GPT):
+            response = get_client().chat.completions.create(
+                model=OPENAI_MODEL_GPT,
+                messages=messages,
+                max_tokens=GENERATION_MAX_TOKENS,
+                temperature=TEMPERATURE,
+            )
+        count_usage(response.usage, OPENAI_MODEL_GPT)
         return response.choices[0].message.content.strip()
     except Exception as e:
         print(f"Error generating answer: {str(e)}")
-        return "I'm sorry, but I encountered an error while trying to generate an answer. Please try again later."
+        return ERROR_ANSWER
+
+def stream_request(messages):
+    """
+    Get the arguments of a streamed chat completion request.
+
+    Streams report no usage unless it is requested, in a final chunk without choices.
+
+    Parameters:
+    messages (list): The chat messages.
+
+    Returns:
+    dict: Keyword arguments for chat.completions.create.
+    """
+    return {
+        'model': OPENAI_MODEL_GPT,
+        'messages': messages,
+        'max_tokens': GENERATION_MAX_TOKENS,
+        'temperature': TEMPERATURE,
+        'stream': True,
+        'stream_options': {'include_usage': True},
+    }
+
+def read_stream_chunk(chunk, timings, start, generation_span):
+    """
+    Count the usage of a streamed chunk and get its text, recording the time to the first token.
+
+    Parameters:
+    chunk: A chunk of a streamed chat completion.
+    timings (dict): The dict that receives 'time_to_first_token' in seconds.
+    start (float): The perf_counter time the request started at.
+    generation_span (Span): The span of the generation.
+
+    Returns:
+    str: The text of the chunk, or None if it has none.
+    """
+    count_usage(getattr(chunk, 'usage', None), OPENAI_MODEL_GPT)
+    if not chunk.choices:
+        return None
+    content = chunk.choices[0].delta.content
+    if content and 'time_to_first_token' not in timings:
+        timings['time_to_first_token'] = time.perf_counter() - start
+        generation_span.set(time_to_first_token_ms=round(timings['time_to_first_token'] * 1000, 1))
+    return content
+
+def generate_answer_stream(query, top_sections, timings=None):
+    """
+    Generate an answer like generate_answer, yielding the text as it is produced.
+
+    Parameters:
+    query (str): The input query.
+    top_sections (list): A list of top sections that match the query.
+    timings (dict): Optional dict that receives 'time_to_first_token' and 'total_latency' in seconds, and the
+    context report of build_context, e.g. 'prompt_tokens'.
+
+    Yields:
+    str: Chunks of the generated answer.
+    """
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+
+    try:
+        messages = build_messages(query, top_sections, timings)
+        with span('generation', model=OPENAI_MODEL_GPT, stream=True) as generation_span:
+            stream = get_client().chat.completions.create(**stream_request(messages))
+            for chunk in stream:
+                content = read_stream_chunk(chunk, timings, start, generation_span)
+                if content:
+                    yield content
+    except Exception as e:
+        print(f"Error generating answer: {str(e)}")
+        yield ERROR_ANSWER
+    finally:
+        timings['total_latency'] = time.perf_counter() - start
+
+async def generate_answer_stream_async(query, top_sections, timings=None):
+    """
+    Async variant of generate_answer_stream, using the shared async OpenAI client.
+
+    Parameters:
+    query (str): The input query.
+    top_sections (list): A list of top sections that match the query.
+    timings (dict): Optional dict that receives 'time_to_first_token' and 'total_latency' in seconds, and the
+    context report of build_context, e.g. 'prompt_tokens'.
+
+    Yields:
+    str: Chunks of the generated answer.
+    """
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+
+    try:
+        messages = build_messages(query, top_sections, timings)
+        with span('generation', model=OPENAI_MODEL_GPT, stream=True) as generation_span:
+            stream = await get_async_client().chat.completions.create(**stream_request(messages))
+            async for chunk in stream:
+                content = read_stream_chunk(chunk, timings, start, generation_span)
+                if content:
+                    yield content
+    except Exception as e:
+        print(f"Error generating answer: {str(e)}")
+        yield ERROR_ANSWER
+    finally:
+        timings['total_latency'] = time.perf_counter() - start
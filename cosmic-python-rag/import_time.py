@@ -0,0 +1,135 @@
+import os
+import statistics
+import subprocess
+import sys
+from cosmic-python-rag_rag.config import IMPORT_TIME_BUDGETS_MS, IMPORT_TIME_RUNS
+
+PACKAGE = __package__
+HEAVIEST_IMPORTS = 5
+
+
+def parse_import_times(stderr):
+    """
+    Parse the output of python -X importtime.
+
+    Parameters:
+    stderr (str): The standard error of the interpreter.
+
+    Returns:
+    list: (nesting level, module name, cumulative import time in microseconds) tuples, in the order printed.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            level = (len(name) - len(name.lstrip()) - 1) // 2
+            imports.append((level, name.strip(), int(cumulative)))
+    return imports
+
+
+def package_import_times(imports):
+    """
+    Sum the import times of the modules of each top-level package.
+
+    A module imported by another module of the same package is already included in the time of
+    its importer, so only the outermost modules of each package are counted.
+
+    Parameters:
+    imports (list): The parsed imports, see parse_import_times.
+
+    Returns:
+    dict: Top-level package names mapped to their import time in microseconds.
+    """
+    times = {}
+    importers = []
+    # Modules are printed after the modules they import, so importers are seen first in reverse
+    for level, name, cumulative in reversed(imports):
+        package = name.partition('.')[0]
+        while importers and importers[-1][0] >= level:
+            importers.pop()
+        if not importers or importers[-1][1] != package:
+            times[package] = times.get(package, 0) + cumulative
+        importers.append((level, package))
+    return times
+
+
+def measure_import(module):
+    """
+    Import a module in a fresh interpreter and read its import times.
+
+    Parameters:
+    module (str): The fully qualified module name.
+
+    Returns:
+    list: The parsed imports, see parse_import_times.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    return parse_import_times(result.stderr)
+
+
+def measure_module(name, runs=IMPORT_TIME_RUNS):
+    """
+    Measure the cold import time of a module of the package, as the median of several runs.
+
+    Parameters:
+    name (str): The module name within the package, e.g. 'main'.
+    runs (int): The number of fresh interpreters to import the module in.
+
+    Returns:
+    dict: The median import time in milliseconds and the heaviest packages it imports.
+    """
+    module = f"{PACKAGE}.{name}"
+    measurements = []
+    for _ in range(runs):
+        # Only the imports made by the module itself, not those of the interpreter start-up
+        imports = measure_import(module)
+        start = max((index + 1 for index, (level, imported, _) in enumerate(imports) if level == 0 and imported == 'site'), default=0)
+        measurements.append(imports[start:])
+    module_times = [next(cumulative for _, imported, cumulative in imports if imported == module) for imports in measurements]
+    package_times = [package_import_times(imports) for imports in measurements]
+    heaviest = {
+        package: statistics.median(times.get(package, 0) for times in package_times) / 1000
+        for package in package_times[0]
+        if package != PACKAGE
+    }
+    return {
+        'import_time_ms': statistics.median(module_times) / 1000,
+        'heaviest_imports_ms': dict(sorted(heaviest.items(), key=lambda item: item[1], reverse=True)[:HEAVIEST_IMPORTS]),
+    }
+
+
+def run_import_time(budgets=IMPORT_TIME_BUDGETS_MS, runs=IMPORT_TIME_RUNS):
+    """
+    Measure the import time of the entry point modules and check them against their budgets.
+
+    Each module is imported in fresh interpreters, so the numbers are cold start times
+    (without the interpreter start-up itself).
+
+    Parameters:
+    budgets (dict): Module names within the package mapped to their import time budget in milliseconds.
+    runs (int): The number of runs per module.
+
+    Returns:
+    bool: Whether every module was imported within its budget.
+    """
+    within_budget = True
+    for name, budget in budgets.items():
+        result = measure_module(name, runs)
+        over_budget = result['import_time_ms'] > budget
+        within_budget = within_budget and not over_budget
+        heaviest = ', '.join(f"{package} {time:.0f} ms" for package, time in result['heaviest_imports_ms'].items())
+        print(
+            f"{name}: {result['import_time_ms']:.0f} ms (budget {budget} ms)"
+            f"{' OVER BUDGET' if over_budget else ''}; heaviest imports: {heaviest or 'none'}"
+        )
+    return within_budget
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_import_time() else 1)
@@ -1,62 +1,146 @@
-import json
 from tqdm import tqdm
-from cosmic-python-rag_rag.config import PROCESSED_DIR
-from cosmic-python-rag_rag.data.embeddings import get_embedding
+from cosmic-python-rag_rag.config import PROCESSED_DIR, RAW_DIR
+from cosmic-python-rag_rag.data.chunking import chunk_section
+from cosmic-python-rag_rag.data.embeddings import get_embeddings_batch
 from cosmic-python-rag_rag.data.generate_summaries import generate_chapter_summary
 from cosmic-python-rag_rag.data.keywords_extraction import extract_keywords
-from cosmic-python-rag_rag.data.data_cleaning import parse_html_content_with_sections, read_all_chapter_html_files
-from dotenv import load_dotenv  
+from cosmic-python-rag_rag.data.fingerprints import chapter_fingerprint, hash_file, load_fingerprints, save_fingerprints
+from cosmic-python-rag_rag.data.store import load_processed_data_with_embeddings, save_processed_data
+from cosmic-python-rag_rag.data.data_cleaning import list_chapter_files, parse_chapter_files
+from cosmic-python-rag_rag.instrumentation import span
 
-load_dotenv()
+def get_chapter_text(chapter_content):
+    """
+    Join the text of all sections of a parsed chapter.
 
-# Ensure the processed directory exists
-PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
+    Parameters:
+    chapter_content (dict): The parsed chapter containing 'sections'.
 
-def process_and_index_chapters():
+    Returns:
+    str: The full chapter text.
+    """
+    return ' '.join([section['text_content'] for section in chapter_content['sections']])
+
+def process_and_index_chapters(incremental=False, raw_dir=RAW_DIR, processed_dir=PROCESSED_DIR):
+    """
+    Parse, summarize, embed and store all chapters of a book from its raw directory.
+
+    In incremental mode, the fingerprints of the previous run are compared with the current files:
+    unchanged chapters are copied from the existing store, only changed chunks are re-embedded,
+    a chapter is re-summarized only when its text changed, and deleted chapters are dropped.
+    If the store was indexed with other embedding, chunking or summary settings, nothing is reused.
+
+    Parameters:
+    incremental (bool): Whether to update the existing store instead of rebuilding it.
+    raw_dir (Path): The directory containing the chapter HTML files of the book.
+    processed_dir (Path): The directory to write the store of the book to.
+    """
     print("Starting indexing...")
+    processed_dir.mkdir(parents=True, exist_ok=True)
     # Step 1: Data Loading
-    chapters = read_all_chapter_html_files()
-    print(f"Read {len(chapters)} chapters")
+    chapter_files = list_chapter_files(raw_dir)
+    print(f"Found {len(chapter_files)} chapters")
 
-    # Step 2: Process Chapters
+    previous_data = load_processed_data_with_embeddings(processed_dir) if incremental else {}
+    previous_fingerprints = load_fingerprints(processed_dir) if previous_data else {}
+    if previous_data and not previous_fingerprints:
+        print("The store was indexed with other settings, processing every chapter again")
+
+    # Step 2: Parse new and changed chapters in parallel, one chapter per worker process
+    file_hashes = {chapter_num: hash_file(html_path) for chapter_num, html_path in chapter_files.items()}
+    changed_files = {
+        chapter_num: html_path
+        for chapter_num, html_path in chapter_files.items()
+        if chapter_num not in previous_data
+        or previous_fingerprints.get(chapter_num, {}).get('file_hash') != file_hashes[chapter_num]
+    }
+    with tqdm(total=1, desc=f"Parsing {len(changed_files)} chapters", leave=False) as pbar, span('indexing.parsing', chapters=len(changed_files)):
+        parsed_chapters = parse_chapter_files(changed_files)
+        pbar.update(1)
+
+    # Step 3: Process Chapters
     processed_data = {}
-    for chapter_num, chapter_soup in tqdm(chapters.items(), desc="Processing chapters"):
-        chapter_content = parse_html_content_with_sections(chapter_soup)
-        
-        # Generate summary
-        full_chapter_text = ' '.join([section['text_content'] for section in chapter_content['sections']])
-        with tqdm(total=1, desc=f"Generating summary for chapter {chapter_num}", leave=False) as pbar:
-            chapter_summary = generate_chapter_summary(full_chapter_text)
-            pbar.update(1)
-        
-        # Calculate summary embedding
-        with tqdm(total=1, desc=f"Calculating summary embedding for chapter {chapter_num}", leave=False) as pbar:
-            summary_embedding = get_embedding(chapter_summary)
-            pbar.update(1)
-        
-        # Extract keywords
-        with tqdm(total=1, desc=f"Extracting keywords for chapter {chapter_num}", leave=False) as pbar:
-            chapter_keywords = extract_keywords({chapter_num: {'sections': chapter_content['sections']}})
-            pbar.update(1)
+    fingerprints = {}
+    texts = []
+    targets = []
+    reused_chapters = 0
+    for chapter_num in tqdm(chapter_files, desc="Processing chapters"):
+        file_hash = file_hashes[chapter_num]
+        previous = previous_fingerprints.get(chapter_num) if chapter_num in previous_data else None
+        if chapter_num not in parsed_chapters:
+            processed_data[chapter_num] = previous_data[chapter_num]
+            fingerprints[chapter_num] = previous
+            reused_chapters += 1
+            continue
+
+        chapter_content = parsed_chapters[chapter_num]
+        fingerprint = chapter_fingerprint(file_hash, chapter_content['sections'])
+        fingerprints[chapter_num] = fingerprint
         
-        # Calculate embeddings for each section
-        for section in tqdm(chapter_content['sections'], desc=f"Calculating embeddings for chapter {chapter_num}", leave=False):
-            section['embedding'] = get_embedding(section['text_content'])
+        # Generate summary, unless the chapter text is unchanged
+        if previous and previous['text_hash'] == fingerprint['text_hash']:
+            chapter_summary = previous_data[chapter_num]['chapter_summary']
+            summary_embedding = previous_data[chapter_num]['chapter_summary_embedding']
+        else:
+            full_chapter_text = get_chapter_text(chapter_content)
+            with tqdm(total=1, desc=f"Generating summary for chapter {chapter_num}", leave=False) as pbar, span('indexing.summary', chapter=chapter_num):
+                chapter_summary = generate_chapter_summary(full_chapter_text)
+                pbar.update(1)
+            summary_embedding = None
         
         processed_data[chapter_num] = {
             'chapter_title': chapter_content['title'],
             'chapter_summary': chapter_summary,
-            'chapter_summary_embedding': summary_embedding,
-            'chapter_keywords': chapter_keywords[chapter_num],
+            'chapter_keywords': [],
             'sections': chapter_content['sections']
         }
 
-    # Step 3: Save Processed Data
-    with tqdm(total=1, desc="Saving processed data", leave=False) as pbar:
-        with open(PROCESSED_DIR / 'processed_data.json', 'w') as output_file:
-            json.dump(processed_data, output_file, indent=4)
+        # Queue the summary and changed chunks for embedding, reusing embeddings of unchanged chunks
+        if summary_embedding is None:
+            texts.append(chapter_summary)
+            targets.append((processed_data[chapter_num], 'chapter_summary_embedding'))
+        else:
+            processed_data[chapter_num]['chapter_summary_embedding'] = summary_embedding
+
+        previous_embeddings = {}
+        if previous:
+            for section in previous_data[chapter_num]['sections']:
+                chunks = chunk_section(section)
+                # Chunk boundaries differ if the chunk size changed since the last run
+                if len(chunks) == len(section['chunk_embeddings']):
+                    previous_embeddings.update(zip(chunks, section['chunk_embeddings']))
+        for section in chapter_content['sections']:
+            chunks = chunk_section(section)
+            section['chunk_embeddings'] = [previous_embeddings.get(chunk) for chunk in chunks]
+            for chunk_index, chunk in enumerate(chunks):
+                if section['chunk_embeddings'][chunk_index] is None:
+                    texts.append(chunk)
+                    targets.append((section['chunk_embeddings'], chunk_index))
+
+    removed_chapters = [chapter_num for chapter_num in previous_data if chapter_num not in chapter_files]
+    if incremental:
+        print(f"Unchanged chapters: {reused_chapters}, updated: {len(chapter_files) - reused_chapters}, removed: {len(removed_chapters)}")
+
+    # Step 4: Extract keywords once over the whole corpus, since c-TF-IDF scores each chapter against all others
+    with tqdm(total=1, desc="Extracting keywords", leave=False) as pbar, span('indexing.keywords'):
+        chapter_keywords = extract_keywords(processed_data)
+        pbar.update(1)
+    for chapter_num, keywords in chapter_keywords.items():
+        processed_data[chapter_num]['chapter_keywords'] = keywords
+
+    # Step 5: Calculate summary and chunk embeddings in bulk
+    with tqdm(total=1, desc=f"Calculating embeddings for {len(texts)} texts", leave=False) as pbar, span('indexing.embeddings', texts=len(texts)):
+        embeddings = get_embeddings_batch(texts)
+        pbar.update(1)
+    for (target, key), embedding in zip(targets, embeddings):
+        target[key] = embedding
+
+    # Step 6: Save Processed Data
+    with tqdm(total=1, desc="Saving processed data", leave=False) as pbar, span('indexing.save'):
+        save_processed_data(processed_data, processed_dir)
+        save_fingerprints(fingerprints, processed_dir)
         pbar.update(1)
-    print("Saved processed data to JSON file")
+    print("Saved processed data to the embedding store")
 
     print("Indexing completed.")
 
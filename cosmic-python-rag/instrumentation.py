@@ -0,0 +1,392 @@
+import atexit
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+from cosmic-python-rag_rag.config import INSTRUMENTATION_BUCKETS, INSTRUMENTATION_ENABLED, INSTRUMENTATION_EXPORTER, INSTRUMENTATION_METRICS_PATH
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class NoopSpan:
+    """
+    The span returned while instrumentation is disabled; entering and leaving it does nothing.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    """
+    A timed stage of the pipeline, used as a context manager.
+
+    Spans opened inside another span, in the same thread or task, are its children. An exception
+    leaving the span is recorded as its error and re-raised.
+    """
+    __slots__ = ('instrumentation', 'name', 'attributes', 'parent', 'start', 'duration', 'error', 'token', 'exported')
+
+    def __init__(self, instrumentation, name, attributes):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.attributes = attributes
+        self.parent = None
+        self.start = None
+        self.duration = None
+        self.error = None
+        self.token = None
+        # Exporter specific state, e.g. the OpenTelemetry span
+        self.exported = None
+
+    def set(self, **attributes):
+        """
+        Add attributes to the span, e.g. sizes that are only known once the stage ran.
+        """
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self.token = _current_span.set(self)
+        self.instrumentation.exporter.start_span(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        # GeneratorExit and cancellation end a span early but are not errors
+        if isinstance(exc, Exception):
+            self.error = f"{exc_type.__name__}: {exc}"
+        try:
+            _current_span.reset(self.token)
+        except ValueError:
+            # A generator closed from another context than the one it started in
+            pass
+        self.instrumentation.end_span(self)
+        return False
+
+
+def format_labels(labels):
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}' if labels else ''
+
+
+class Metrics:
+    """
+    Span duration histograms and counters, aggregated in memory and rendered in the Prometheus text format.
+    """
+
+    def __init__(self, buckets=INSTRUMENTATION_BUCKETS):
+        """
+        Parameters:
+        buckets (list): The upper bounds of the duration histogram buckets, in seconds.
+        """
+        self.buckets = sorted(buckets)
+        self.lock = threading.Lock()
+        # span name -> [count per bucket (the last one unbounded)..., sum of durations, errors]
+        self.spans = {}
+        # (counter name, sorted labels) -> value
+        self.counters = defaultdict(float)
+
+    def observe(self, span):
+        with self.lock:
+            stats = self.spans.get(span.name)
+            if stats is None:
+                stats = self.spans[span.name] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            stats[bisect.bisect_left(self.buckets, span.duration)] += 1
+            stats[-2] += span.duration
+            stats[-1] += span.error is not None
+
+    def add(self, name, value, labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def summary(self):
+        """
+        Get the count, errors and mean duration of every span and the value of every counter.
+
+        Returns:
+        dict: 'spans' (span name -> count, errors, mean_ms) and 'counters' (counter name -> labels and values).
+        """
+        with self.lock:
+            counters = defaultdict(list)
+            for (name, labels), value in sorted(self.counters.items()):
+                counters[name].append({'labels': dict(labels), 'value': value})
+            return {
+                'spans': {
+                    name: {'count': sum(stats[:-2]), 'errors': stats[-1], 'mean_ms': stats[-2] / sum(stats[:-2]) * 1000}
+                    for name, stats in sorted(self.spans.items())
+                },
+                'counters': dict(counters),
+            }
+
+    def render_prometheus(self):
+        """
+        Render the metrics in the Prometheus text exposition format.
+
+        Returns:
+        str: The metrics text.
+        """
+        lines = []
+        with self.lock:
+            lines.append('# TYPE rag_span_duration_seconds histogram')
+            for name, stats in sorted(self.spans.items()):
+                # Prometheus buckets are cumulative
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ['+Inf'], stats):
+                    cumulative += bucket_count
+                    lines.append(f"rag_span_duration_seconds_bucket{format_labels([('span', name), ('le', bound)])} {cumulative}")
+                lines.append(f"rag_span_duration_seconds_sum{format_labels([('span', name)])} {stats[-2]}")
+                lines.append(f"rag_span_duration_seconds_count{format_labels([('span', name)])} {cumulative}")
+            lines.append('# TYPE rag_span_errors_total counter')
+            for name, stats in sorted(self.spans.items()):
+                lines.append(f"rag_span_errors_total{format_labels([('span', name)])} {stats[-1]}")
+            previous_name = None
+            for (name, labels), value in sorted(self.counters.items()):
+                if name != previous_name:
+                    lines.append(f'# TYPE rag_{name}_total counter')
+                    previous_name = name
+                lines.append(f"rag_{name}_total{format_labels(labels)} {int(value) if value.is_integer() else value}")
+        return '\n'.join(lines) + '\n'
+
+
+class LogExporter:
+    """
+    Log one line per finished span, and a warning for spans that failed.
+    """
+
+    def __init__(self):
+        if not logging.getLogger().handlers and not logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+
+    def start_span(self, span):
+        pass
+
+    def end_span(self, span):
+        attributes = ''.join(f" {name}={value}" for name, value in span.attributes.items())
+        parent = f" parent={span.parent.name}" if span.parent is not None else ''
+        if span.error is not None:
+            logger.warning("span=%s duration_ms=%.2f%s%s error=%r", span.name, span.duration * 1000, parent, attributes, span.error)
+        else:
+            logger.info("span=%s duration_ms=%.2f%s%s", span.name, span.duration * 1000, parent, attributes)
+
+    def add(self, name, value, labels):
+        pass
+
+    def shutdown(self, metrics):
+        pass
+
+
+class PrometheusExporter:
+    """
+    Write the aggregated metrics in the Prometheus text format on shutdown, for the node exporter's
+    textfile collector. The HTTP API also serves them at /metrics while it runs.
+    """
+
+    def __init__(self, path=INSTRUMENTATION_METRICS_PATH):
+        """
+        Parameters:
+        path (Path): The metrics file.
+        """
+        self.path = path
+
+    def start_span(self, span):
+        pass
+
+    def end_span(self, span):
+        pass
+
+    def add(self, name, value, labels):
+        pass
+
+    def shutdown(self, metrics):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_name(self.path.name + '.tmp')
+        temporary_path.write_text(metrics.render_prometheus())
+        temporary_path.replace(self.path)
+
+
+class OpenTelemetryExporter:
+    """
+    Forward spans and counters to the OpenTelemetry API (optional opentelemetry-api package).
+
+    Where they are sent is configured by the application's OpenTelemetry SDK setup; without one
+    the API drops them.
+    """
+
+    def __init__(self):
+        # Imported here, so the query path does not load opentelemetry unless this exporter is configured
+        try:
+            from opentelemetry import metrics as otel_metrics
+            from opentelemetry import trace as otel_trace
+        except ImportError:
+            raise ImportError("The 'otel' exporter needs the opentelemetry-api package")
+        self.trace = otel_trace
+        self.tracer = otel_trace.get_tracer(__name__)
+        self.meter = otel_metrics.get_meter(__name__)
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def start_span(self, span):
+        parent = span.parent.exported if span.parent is not None else None
+        context = self.trace.set_span_in_context(parent) if parent is not None else None
+        span.exported = self.tracer.start_span(span.name, context=context)
+
+    def end_span(self, span):
+        span.exported.set_attributes({name: value for name, value in span.attributes.items() if isinstance(value, (str, bool, int, float))})
+        if span.error is not None:
+            span.exported.set_status(self.trace.Status(self.trace.StatusCode.ERROR, span.error))
+        span.exported.end()
+
+    def add(self, name, value, labels):
+        with self.lock:
+            counter = self.counters.get(name)
+            if counter is None:
+                counter = self.counters[name] = self.meter.create_counter(f"rag.{name}")
+        counter.add(value, labels)
+
+    def shutdown(self, metrics):
+        pass
+
+
+EXPORTERS = {
+    'log': LogExporter,
+    'prometheus': PrometheusExporter,
+    'otel': OpenTelemetryExporter,
+}
+
+
+class Instrumentation:
+    """
+    Records spans and counters into the in-memory metrics and passes them on to an exporter.
+    """
+
+    def __init__(self, exporter):
+        """
+        Parameters:
+        exporter: A LogExporter, PrometheusExporter or OpenTelemetryExporter.
+        """
+        self.exporter = exporter
+        self.metrics = Metrics()
+
+    def end_span(self, span):
+        self.metrics.observe(span)
+        self.exporter.end_span(span)
+
+    def add(self, name, value, labels):
+        self.metrics.add(name, value, labels)
+        self.exporter.add(name, value, labels)
+
+    def shutdown(self):
+        self.exporter.shutdown(self.metrics)
+
+
+_instrumentation = None
+
+
+def configure(enabled=INSTRUMENTATION_ENABLED, exporter=INSTRUMENTATION_EXPORTER):
+    """
+    Turn instrumentation on or off. While it is off, span and count return immediately.
+
+    Parameters:
+    enabled (bool): Whether to record spans and counters.
+    exporter (str): 'log', 'prometheus' or 'otel'.
+    """
+    global _instrumentation
+    if _instrumentation is not None:
+        _instrumentation.shutdown()
+        _instrumentation = None
+    if enabled:
+        if exporter not in EXPORTERS:
+            raise ValueError(f"Unknown instrumentation exporter: {exporter}")
+        _instrumentation = Instrumentation(EXPORTERS[exporter]())
+
+
+def shutdown():
+    """
+    Flush the exporter, e.g. write the Prometheus metrics file. Called at exit.
+    """
+    if _instrumentation is not None:
+        _instrumentation.shutdown()
+
+
+def enabled():
+    return _instrumentation is not None
+
+
+def span(name, **attributes):
+    """
+    Time a stage of the pipeline.
+
+    Usage: with span('chapter_scoring', chapters=10): ...
+
+    Parameters:
+    name (str): The stage name.
+    attributes: Attributes recorded with the span.
+
+    Returns:
+    Span: The span context manager, or a shared no-op span while instrumentation is disabled.
+    """
+    if _instrumentation is None:
+        return NOOP_SPAN
+    return Span(_instrumentation, name, attributes)
+
+
+def count(name, value=1, **labels):
+    """
+    Increment a counter, e.g. count('cache_lookups', cache='embedding', result='hit').
+
+    Parameters:
+    name (str): The counter name.
+    value (float): The increment.
+    labels: The labels of the counter.
+    """
+    if _instrumentation is not None and value:
+        _instrumentation.add(name, value, labels)
+
+
+def count_usage(usage, model):
+    """
+    Count the tokens reported in the usage of an OpenAI response.
+
+    Parameters:
+    usage: The usage of the response, or None if the response has none (e.g. most streams).
+    model (str): The model of the request.
+    """
+    if _instrumentation is None or usage is None:
+        return
+    count('openai_tokens', usage.prompt_tokens, model=model, type='prompt')
+    count('openai_tokens', getattr(usage, 'completion_tokens', None) or 0, model=model, type='completion')
+
+
+def get_metrics():
+    """
+    Get the aggregated metrics.
+
+    Returns:
+    Metrics: The metrics, or None while instrumentation is disabled.
+    """
+    return _instrumentation.metrics if _instrumentation is not None else None
+
+
+configure()
+atexit.register(shutdown)
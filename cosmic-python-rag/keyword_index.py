@@ -0,0 +1,116 @@
+import string
+from functools import lru_cache
+from cosmic-python-rag_rag.config import KEYWORD_STEMMING
+
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+# NLTK's English stopword list, bundled so that it is never downloaded
+ENGLISH_STOP_WORDS = frozenset("""
+i me my myself we our ours ourselves you you're you've you'll you'd your yours yourself yourselves he him his himself
+she she's her hers herself it it's its itself they them their theirs themselves what which who whom this that that'll
+these those am is are was were be been being have has had having do does did doing a an the and but if or because as
+until while of at by for with about against between into through during before after above below to from up down in out
+on off over under again further then once here there when where why how all any both each few more most other some such
+no nor not only own same so than too very s t can will just don don't should should've now d ll m o re ve y ain aren
+aren't couldn couldn't didn didn't doesn doesn't hadn hadn't hasn hasn't haven haven't isn isn't ma mightn mightn't
+mustn mustn't needn needn't shan shan't shouldn shouldn't wasn wasn't weren weren't won won't wouldn wouldn't
+""".split())
+
+
+@lru_cache(maxsize=1)
+def get_stemmer():
+    # nltk takes over a second to import, so it is imported when a token is first stemmed and not at all
+    # with KEYWORD_STEMMING disabled
+    from nltk.stem import PorterStemmer
+    return PorterStemmer()
+
+
+@lru_cache(maxsize=100_000)
+def stem(token):
+    return get_stemmer().stem(token)
+
+
+def normalize_tokens(text, use_stemming=KEYWORD_STEMMING):
+    """
+    Lowercase a text, strip punctuation and split it into (optionally stemmed) tokens.
+
+    Parameters:
+    text (str): The input text.
+    use_stemming (bool): Whether to reduce tokens to their Porter stem.
+
+    Returns:
+    tuple: The normalized tokens.
+    """
+    tokens = text.lower().translate(PUNCTUATION_TABLE).split()
+    return tuple(stem(token) for token in tokens) if use_stemming else tuple(tokens)
+
+
+class KeywordIndex:
+    """
+    Inverted index from normalized chapter keywords to the chapters that contain them.
+
+    Keywords are cleaned once at load time. Multi-word keywords are stored as phrases keyed
+    by their first token, so matching a query costs time proportional to the number of query
+    tokens rather than to the number of chapters and keywords.
+    """
+
+    def __init__(self, use_stemming=KEYWORD_STEMMING):
+        """
+        Parameters:
+        use_stemming (bool): Whether keywords and queries are matched on their Porter stems.
+        """
+        self.use_stemming = use_stemming
+        self.postings = {}
+
+    @classmethod
+    def from_processed_data(cls, processed_data, use_stemming=KEYWORD_STEMMING):
+        """
+        Build the index from the chapter keywords of the processed data.
+
+        Parameters:
+        processed_data (dict): The processed data or chapter metadata containing 'chapter_keywords'.
+        use_stemming (bool): Whether keywords and queries are matched on their Porter stems.
+
+        Returns:
+        KeywordIndex: The built index.
+        """
+        keyword_index = cls(use_stemming)
+        for chapter_num, chapter_data in processed_data.items():
+            for keyword in chapter_data['chapter_keywords']:
+                keyword_index.add(chapter_num, keyword)
+        return keyword_index
+
+    def add(self, chapter_num, keyword):
+        """
+        Add a chapter keyword to the index.
+
+        Parameters:
+        chapter_num (str): The chapter the keyword belongs to.
+        keyword (str): The keyword, possibly a multi-word phrase.
+        """
+        phrase = normalize_tokens(keyword, self.use_stemming)
+        if phrase:
+            self.postings.setdefault(phrase[0], []).append((phrase, chapter_num, keyword))
+
+    def match(self, query):
+        """
+        Find the chapter keywords that occur in the query.
+
+        Each chapter keyword is matched at most once, however many times it occurs in the query.
+
+        Parameters:
+        query (str): The input query.
+
+        Returns:
+        dict: Chapter numbers mapped to the list of their matched keywords.
+        """
+        tokens = normalize_tokens(query, self.use_stemming)
+        matched_keywords = {}
+        seen = set()
+        for position, token in enumerate(tokens):
+            for phrase, chapter_num, keyword in self.postings.get(token, ()):
+                if (chapter_num, keyword) in seen or tokens[position:position + len(phrase)] != phrase:
+                    continue
+                seen.add((chapter_num, keyword))
+                matched_keywords.setdefault(chapter_num, []).append(keyword)
+        return matched_keywords
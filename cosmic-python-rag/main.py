@@ -1,61 +1,135 @@
 import argparse
-import os
-from cosmic-python-rag_rag.data.data_cleaning import get_processed_data
-from cosmic-python-rag_rag.generation import generate_answer
-from cosmic-python-rag_rag.indexing import process_and_index_chapters
-from cosmic-python-rag_rag.config import ENTER_QUESTION_PHRASE, GOODBYE_PHRASE, PROCESSED_DIR, WELCOME_PHRASE, loading_animation
+import asyncio
+from pathlib import Path
+from cosmic-python-rag_rag import instrumentation
+from cosmic-python-rag_rag.config import ANN_BACKEND, BATCH_CONCURRENCY, BATCH_OUTPUT, BENCHMARK_OUTPUT, BENCHMARK_QUERIES, BENCHMARK_SCALES, CORPORA_DIR, DEFAULT_CORPUS, ENTER_QUESTION_PHRASE, EVALUATION_DATASET, EVALUATION_OUTPUT, GOODBYE_PHRASE, INDEXING_CONCURRENCY, INSTRUMENTATION_EXPORTER, SERVER_HOST, SERVER_PORT, WELCOME_PHRASE, loading_animation
 import threading
 import sys
 
-def run_chatbot():
-    from cosmic-python-rag_rag.retreival import get_rag_response
+# Labels of the section scores by score type, see retreival.build_section_results
+SCORE_LABELS = {
+    'similarity': "Similarity Score",
+    'rrf': "Fused Rank Score (RRF)",
+    'weighted': "Fused Score",
+    'bm25': "BM25 Score",
+}
+
+def print_sources(top_sections, matched_keywords, chapters):
+    print("\n")
+    print("Relevant sections found:")
+    for i, section in enumerate(top_sections, 1):
+        chapter_num = section['chapter_num']
+        chapter_title = section['chapter_title']
+        section_title = section['section_title']
+        similarity_score = section['similarity_score']
+        score_type = section.get('score_type', 'similarity')
+        print(f"{i}. Chapter {chapter_num}: {chapter_title}")
+        print(f"   Section: {section_title}")
+        print(f"   {SCORE_LABELS.get(score_type, 'Score')}: {similarity_score:.4f}")
+        if score_type != 'similarity' and section.get('dense_similarity') is not None:
+            # Fused scores only rank the sections, so the cosine similarity is shown as well
+            print(f"   Similarity Score: {section['dense_similarity']:.4f}")
+    
+    if matched_keywords:
+        print("\nMatched keywords:")
+        for chapter_num, keywords in matched_keywords.items():
+            if keywords:
+                chapter_title = chapters[chapter_num]['chapter_title']
+                print(f"Chapter {chapter_num} - {chapter_title}: {', '.join(keywords)}")
+
+
+def stream_answer(query, top_sections):
+    from cosmic-python-rag_rag.generation import generate_answer_stream
+
+    print("\nAnswer:")
+    timings = {}
+    chunks = []
+    for chunk in generate_answer_stream(query, top_sections, timings):
+        chunks.append(chunk)
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+    print()
+    if 'time_to_first_token' in timings:
+        print(f"\n(time to first token: {timings['time_to_first_token']:.2f}s, total: {timings['total_latency']:.2f}s, prompt tokens: {timings.get('prompt_tokens')})")
+    return ''.join(chunks)
+
+
+def print_answer_cache_stats(answer_cache):
+    stats = answer_cache.stats()
+    if stats['hits'] + stats['misses']:
+        print(f"Answer cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+
+
+def run_chatbot(stream=False, corpora=None):
+    # Each mode imports only the modules it needs, so e.g. the indexing dependencies are not loaded
+    # before the chatbot prompt
+    from cosmic-python-rag_rag.answer_cache import get_answer_cache
+    from cosmic-python-rag_rag.data.embeddings import get_embedding
+    from cosmic-python-rag_rag.generation import generate_answer
+    from cosmic-python-rag_rag.registry import load_registry
     
     print(WELCOME_PHRASE)
-    processed_data = get_processed_data()
+    registry = load_registry(corpora)
+    answer_cache = get_answer_cache()
     
     while True:
         query = input(ENTER_QUESTION_PHRASE).strip()
             
         if query.lower() == 'exit':
+            if answer_cache is not None:
+                print_answer_cache_stats(answer_cache)
             print(GOODBYE_PHRASE)
             break
         
         if query:
             try:
-                top_sections, matched_keywords = get_rag_response(query, processed_data)
-                    
-                loading = [True]
-                thread = threading.Thread(target=loading_animation, args=(loading,))
-                thread.start()
-
-                answer = generate_answer(query, top_sections)
-
-                loading[0] = False
-                thread.join()
-                # Clear the animation line
-                sys.stdout.write('\r' + ' ' * 30 + '\r')  
-                sys.stdout.flush()
-
-                print("\nAnswer:")
-                print(answer)
-                
-                print("\n")
-                print("Relevant sections found:")
-                for i, section in enumerate(top_sections, 1):
-                    chapter_num = section['chapter_num']
-                    chapter_title = section['chapter_title']
-                    section_title = section['section_title']
-                    similarity_score = section['similarity_score']
-                    print(f"{i}. Chapter {chapter_num}: {chapter_title}")
-                    print(f"   Section: {section_title}")
-                    print(f"   Similarity Score: {similarity_score:.4f}")
-                
-                if matched_keywords:
-                    print("\nMatched keywords:")
-                    for chapter_num, keywords in matched_keywords.items():
-                        if keywords:
-                            chapter_title = processed_data[chapter_num]['chapter_title']
-                            print(f"Chapter {chapter_num} - {chapter_title}: {', '.join(keywords)}")
+                query_embedding = None
+                response = None
+                if answer_cache is not None:
+                    # The answer cache is looked up by query embedding, so the query is embedded unless
+                    # BM25 alone answers it; such answers are cached by query text
+                    response = registry.get_lexical_retrieval(query)
+                    if response is None:
+                        with instrumentation.span('query_embedding'):
+                            query_embedding = get_embedding(query)
+                if response is None:
+                    response = registry.get_rag_response(query, query_embedding)
+                top_sections, matched_keywords = response
+
+                cached_answer = answer_cache.get(query_embedding, top_sections, query) if answer_cache is not None else None
+                if cached_answer is not None:
+                    print("\nAnswer (cached):")
+                    print(cached_answer)
+                    print_sources(top_sections, matched_keywords, registry.chapters)
+                    continue
+
+                if stream:
+                    answer = stream_answer(query, top_sections)
+                    print_sources(top_sections, matched_keywords, registry.chapters)
+                else:
+                    loading = [True]
+                    thread = threading.Thread(target=loading_animation, args=(loading,))
+                    thread.start()
+
+                    report = {}
+                    try:
+                        answer = generate_answer(query, top_sections, report)
+                    finally:
+                        # Stopped even if generation raises, otherwise the animation thread keeps the process alive
+                        loading[0] = False
+                        thread.join()
+                        # Clear the animation line
+                        sys.stdout.write('\r' + ' ' * 30 + '\r')  
+                        sys.stdout.flush()
+
+                    print("\nAnswer:")
+                    print(answer)
+                    if report.get('prompt_tokens') is not None:
+                        print(f"\n(prompt tokens: {report['prompt_tokens']})")
+                    print_sources(top_sections, matched_keywords, registry.chapters)
+
+                if answer_cache is not None:
+                    answer_cache.put(query_embedding, top_sections, answer, query)
             except Exception as e:
                 print(f"An error occurred while processing the response: {str(e)}")
                 print("Please try again or rephrase your question.")
@@ -66,16 +140,115 @@ def run_chatbot():
 
 def main():
     parser = argparse.ArgumentParser(description="Run indexing or chatbot on the data.")
-    parser.add_argument("mode", choices=["indexing", "chatbot"], 
-                        help="Mode to run the script in: 'indexing' or 'chatbot'")
+    parser.add_argument("mode", choices=["indexing", "chatbot", "serve", "convert", "benchmark", "ann-eval", "evaluate", "batch", "import-time", "quantization-eval"], 
+                        help="Mode to run the script in: 'indexing', 'chatbot', 'serve' (HTTP API), 'convert' (legacy processed_data.json to the embedding store), 'benchmark' (retrieval on synthetic corpora), 'ann-eval' (ANN recall vs exact search), 'evaluate' (retrieval quality on a labelled dataset), 'batch' (answer questions from a JSONL file), 'import-time' (cold import times against their budgets) or 'quantization-eval' (recall and memory of compact embeddings)")
+    parser.add_argument("--host", default=SERVER_HOST, help="Interface for the HTTP API to bind to")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="Port for the HTTP API")
+    parser.add_argument("--scales", nargs="+", metavar="CHAPTERSxSECTIONSxDIM",
+                        help="Synthetic corpus sizes to benchmark, e.g. 150x20x1536")
+    parser.add_argument("--queries", type=int, default=BENCHMARK_QUERIES, help="Number of benchmark queries per scale (or ANN or quantization evaluation queries)")
+    parser.add_argument("--output", type=Path, help=f"Output file for the benchmark or evaluation results or batch answers (default {BENCHMARK_OUTPUT}, {EVALUATION_OUTPUT} or {BATCH_OUTPUT})")
+    parser.add_argument("--input", type=Path, help="JSONL file of questions for batch mode")
+    parser.add_argument("--dataset", type=Path, default=EVALUATION_DATASET, help="JSONL file of queries and the sections that answer them")
+    parser.add_argument("--configs", type=Path, help="JSON file of retrieval configurations to evaluate side by side")
+    parser.add_argument("--embeddings", choices=["cached", "fake", "api"], default="cached",
+                        help="Query embeddings for the evaluation: from the cache, a deterministic fake embedder, or the API")
+    parser.add_argument("--backend", default=ANN_BACKEND, help="ANN backend to evaluate: 'ivf', 'faiss' or 'hnswlib'")
+    parser.add_argument("--budgets", type=int, nargs="+",
+                        help="ANN search budgets to evaluate (nprobe for IVF, ef for HNSW)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Print the chatbot answer as it is generated")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-process chapters and sections that changed since the last indexing run")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Index chapters concurrently with the async OpenAI client")
+    parser.add_argument("--concurrency", type=int,
+                        help=f"Maximum number of OpenAI requests in flight during async indexing (default {INDEXING_CONCURRENCY}) or batch answering (default {BATCH_CONCURRENCY})")
+    parser.add_argument("--corpus", dest="corpora", nargs="+", metavar="NAME",
+                        help=f"Book to index or evaluate (default {DEFAULT_CORPUS}, others in {CORPORA_DIR}/NAME), or books to answer from (default all indexed books)")
+    parser.add_argument("--instrument", nargs="?", const=INSTRUMENTATION_EXPORTER, choices=sorted(instrumentation.EXPORTERS),
+                        help=f"Record span timings and counters with the given exporter (default {INSTRUMENTATION_EXPORTER})")
     args = parser.parse_args()
 
-    if args.mode == "chatbot" and not os.listdir(PROCESSED_DIR):
-        print("No data in processed directory. Cannot run chatbot.")
+    if args.instrument:
+        instrumentation.configure(enabled=True, exporter=args.instrument)
+
+    if args.use_async and args.incremental:
+        parser.error("--incremental is not supported together with --async")
+
+    if args.mode == "benchmark":
+        from cosmic-python-rag_rag.benchmark import parse_scale, run_benchmark
+        scales = [parse_scale(scale) for scale in args.scales] if args.scales else BENCHMARK_SCALES
+        run_benchmark(scales, args.queries, args.output or BENCHMARK_OUTPUT)
+        return
+
+    if args.mode == "import-time":
+        from cosmic-python-rag_rag.import_time import run_import_time
+        if not run_import_time():
+            sys.exit(1)
+        return
+
+    if args.mode not in ("chatbot", "serve", "batch") and args.corpora and len(args.corpora) > 1:
+        parser.error(f"{args.mode} mode takes a single --corpus")
+    from cosmic-python-rag_rag.registry import corpus_directories, discover_corpora
+    corpus_name = args.corpora[0] if args.corpora else DEFAULT_CORPUS
+    try:
+        raw_dir, processed_dir = corpus_directories(corpus_name)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.mode == "ann-eval":
+        from cosmic-python-rag_rag.ann import run_ann_evaluation
+        run_ann_evaluation(processed_dir, args.backend, args.budgets, args.queries)
+        return
+
+    if args.mode == "quantization-eval":
+        from cosmic-python-rag_rag.quantization import run_quantization_evaluation
+        run_quantization_evaluation(processed_dir, num_queries=args.queries)
+        return
+
+    if args.mode == "evaluate":
+        from cosmic-python-rag_rag.evaluation import run_evaluation
+        run_evaluation(args.dataset, args.configs, args.embeddings, directory=processed_dir, output=args.output or EVALUATION_OUTPUT)
+        return
+
+    if args.mode == "convert":
+        from cosmic-python-rag_rag.data.store import convert_json_store
+        print(f"Converted {convert_json_store(processed_dir)} chapters to the embedding store")
+        return
+
+    if args.mode == "batch" and args.input is None:
+        parser.error("batch mode needs --input")
+
+    if args.mode in ("chatbot", "serve", "batch"):
+        indexed = discover_corpora()
+        if not indexed:
+            print(f"No indexed corpus in the processed directories. Cannot run {args.mode}.")
+            return
+        unknown = [name for name in args.corpora or () if name not in indexed]
+        if unknown:
+            parser.error(f"not indexed: {', '.join(unknown)} (indexed: {', '.join(indexed)})")
+
+    if args.mode == "batch":
+        from cosmic-python-rag_rag.batch import run_batch
+        run_batch(args.input, args.output or BATCH_OUTPUT, args.concurrency or BATCH_CONCURRENCY, args.corpora)
+        return
+
+    if args.mode == "serve":
+        from cosmic-python-rag_rag.server import run_server
+        run_server(args.host, args.port, args.corpora)
+        return
+
+    if args.mode == "indexing" and args.use_async:
+        from cosmic-python-rag_rag.async_indexing import process_and_index_chapters_async
+        asyncio.run(process_and_index_chapters_async(args.concurrency or INDEXING_CONCURRENCY, raw_dir, processed_dir))
         return
 
-    run_function = process_and_index_chapters if args.mode == "indexing" else run_chatbot
-    run_function()
+    if args.mode == "indexing":
+        from cosmic-python-rag_rag.indexing import process_and_index_chapters
+        process_and_index_chapters(incremental=args.incremental, raw_dir=raw_dir, processed_dir=processed_dir)
+    else:
+        run_chatbot(stream=args.stream, corpora=args.corpora)
 
 if __name__ == "__main__":
     main()
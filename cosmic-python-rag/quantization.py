@@ -0,0 +1,263 @@
+import time
+import numpy as np
+from cosmic-python-rag_rag.ann import make_eval_queries
+from cosmic-python-rag_rag.config import ANN_EVAL_QUERIES, EMBEDDING_DIMENSIONS, EMBEDDING_PRECISION, PROCESSED_DIR, QUANTIZATION_EVAL_SETTINGS, RESCORE_CANDIDATES, TOP_N_SECTIONS
+from cosmic-python-rag_rag.vector_index import VectorIndex, atomic_write, normalize_rows, top_k
+
+COMPACT_FILENAME = 'chunk_embeddings_compact.npz'
+PRECISIONS = ('float32', 'float16', 'int8')
+# Rows converted to float32 at a time while encoding or scoring, to bound the temporary memory
+BLOCK_ROWS = 16384
+
+
+def is_compact(precision=EMBEDDING_PRECISION, dimensions=EMBEDDING_DIMENSIONS):
+    return precision != 'float32' or dimensions is not None
+
+
+class CompactMatrix:
+    """
+    Compact copy of the normalized chunk matrix, for scoring with less memory.
+
+    Rows are optionally truncated to their first dimensions and renormalized (the text-embedding-3
+    models are trained so that a prefix of an embedding is itself a usable embedding), then stored
+    as float16, or as int8 with one float32 scale per row (int8 value x scale is the embedding value).
+    Scores are approximate; VectorIndex rescores the best sections with the float32 matrix.
+    """
+
+    def __init__(self, data, scales=None):
+        """
+        Parameters:
+        data (np.ndarray): The compact rows, float32, float16 or int8.
+        scales (np.ndarray): The float32 scale of every int8 row, None for the other precisions.
+        """
+        self.data = data
+        self.scales = scales
+
+    @property
+    def precision(self):
+        return self.data.dtype.name
+
+    @property
+    def dimensions(self):
+        return self.data.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return len(self.data)
+
+    @classmethod
+    def encode(cls, matrix, precision=EMBEDDING_PRECISION, dimensions=EMBEDDING_DIMENSIONS):
+        """
+        Encode a matrix of embeddings.
+
+        Parameters:
+        matrix (np.ndarray): The normalized chunk matrix, possibly memory-mapped.
+        precision (str): 'float32', 'float16' or 'int8'.
+        dimensions (int): The number of leading dimensions kept, or None for all of them.
+
+        Returns:
+        CompactMatrix: The encoded matrix.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown embedding precision: {precision}")
+        dimensions = min(dimensions or matrix.shape[1], matrix.shape[1])
+        data = np.empty((len(matrix), dimensions), dtype=precision)
+        scales = np.empty(len(matrix), dtype=np.float32) if precision == 'int8' else None
+        for start in range(0, len(matrix), BLOCK_ROWS):
+            block = normalize_rows(np.asarray(matrix[start:start + BLOCK_ROWS, :dimensions], dtype=np.float32))
+            if precision == 'int8':
+                block_scales = np.abs(block).max(axis=1) / 127
+                block_scales[block_scales == 0] = 1.0
+                block = np.rint(block / block_scales[:, None])
+                scales[start:start + len(block)] = block_scales
+            data[start:start + len(block)] = block
+        return cls(data, scales)
+
+    def prepare_queries(self, query_embeddings):
+        """
+        Truncate and renormalize query embeddings to the dimensions of the matrix.
+
+        Parameters:
+        query_embeddings (np.ndarray): Query embeddings, one per row.
+
+        Returns:
+        np.ndarray: The float32 queries.
+        """
+        return normalize_rows(np.asarray(query_embeddings, dtype=np.float32)[:, :self.dimensions])
+
+    def score_batch(self, query_embeddings, rows=None):
+        """
+        Calculate the approximate cosine similarity between many queries and the given rows.
+
+        NumPy has no fast float16 or int8 matrix product, so the rows are converted to float32
+        a block at a time.
+
+        Parameters:
+        query_embeddings (np.ndarray): Query embeddings, one per row.
+        rows (np.ndarray): Row indices, or None for all rows.
+
+        Returns:
+        np.ndarray: A queries x rows matrix of similarity scores.
+        """
+        queries = self.prepare_queries(query_embeddings)
+        data = self.data if rows is None else self.data[rows]
+        scores = np.empty((len(queries), len(data)), dtype=np.float32)
+        for start in range(0, len(data), BLOCK_ROWS):
+            scores[:, start:start + BLOCK_ROWS] = queries @ np.asarray(data[start:start + BLOCK_ROWS], dtype=np.float32).T
+        if self.scales is not None:
+            scores *= self.scales if rows is None else self.scales[rows]
+        return scores
+
+    def score(self, query_embedding, rows=None):
+        """
+        Calculate the approximate cosine similarity between a query and the given rows.
+
+        Parameters:
+        query_embedding (np.ndarray): The embedding of the query.
+        rows (np.ndarray): Row indices, or None for all rows.
+
+        Returns:
+        np.ndarray: Similarity scores aligned with rows.
+        """
+        return self.score_batch(np.asarray(query_embedding)[None, :], rows)[0]
+
+    def save(self, directory):
+        arrays = {'data': self.data}
+        if self.scales is not None:
+            arrays['scales'] = self.scales
+        with atomic_write(directory / COMPACT_FILENAME) as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, directory, matrix, precision=EMBEDDING_PRECISION, dimensions=EMBEDDING_DIMENSIONS):
+        """
+        Load the compact matrix, checking that it matches the chunk matrix and the settings.
+
+        Raises:
+        ValueError: If the saved matrix is stale.
+        """
+        with np.load(directory / COMPACT_FILENAME) as compact:
+            compact_matrix = cls(compact['data'], compact['scales'] if 'scales' in compact else None)
+        expected_dimensions = min(dimensions or matrix.shape[1], matrix.shape[1])
+        if len(compact_matrix) != len(matrix) or compact_matrix.precision != precision or compact_matrix.dimensions != expected_dimensions:
+            raise ValueError(f"{COMPACT_FILENAME} does not match the chunk matrix or the quantization settings")
+        return compact_matrix
+
+
+def build_compact_matrix(matrix, precision=EMBEDDING_PRECISION, dimensions=EMBEDDING_DIMENSIONS):
+    """
+    Encode the chunk matrix with the configured settings.
+
+    Returns:
+    CompactMatrix: The compact matrix, or None when the float32 matrix is scored directly.
+    """
+    if not is_compact(precision, dimensions):
+        return None
+    return CompactMatrix.encode(matrix, precision, dimensions)
+
+
+def load_compact_matrix(directory, matrix, precision=EMBEDDING_PRECISION, dimensions=EMBEDDING_DIMENSIONS):
+    """
+    Load the compact matrix saved next to the chunk matrix, encoding it if it is missing or stale.
+
+    Parameters:
+    directory (Path): The directory containing the store.
+    matrix (np.ndarray): The normalized chunk matrix of the vector index.
+    precision (str): 'float32', 'float16' or 'int8'.
+    dimensions (int): The number of leading dimensions kept, or None for all of them.
+
+    Returns:
+    CompactMatrix: The compact matrix, or None when the float32 matrix is scored directly.
+    """
+    if not is_compact(precision, dimensions):
+        return None
+    try:
+        return CompactMatrix.load(directory, matrix, precision, dimensions)
+    except (FileNotFoundError, ValueError):
+        return CompactMatrix.encode(matrix, precision, dimensions)
+
+
+def evaluate_compact_matrix(index, compact, queries, reference, k=TOP_N_SECTIONS, rescore_candidates=RESCORE_CANDIDATES):
+    """
+    Compare section scoring on a compact matrix, with and without rescoring, against float32 scoring.
+
+    Parameters:
+    index (VectorIndex): The vector index; its compact matrix is restored afterwards.
+    compact (CompactMatrix): The compact matrix to evaluate.
+    queries (np.ndarray): Query embeddings, one per row.
+    reference (list): The top k section rows of every query scored on the float32 matrix.
+    k (int): The number of sections retrieved per query.
+    rescore_candidates (int): The number of sections rescored with full precision.
+
+    Returns:
+    dict: Memory use, mean recall@k without and with rescoring, and p50/p95 scoring latency in milliseconds.
+    """
+    previous = (index.compact, index.rescore_candidates)
+    rows = np.arange(len(index.section_ids))
+    result = {
+        'precision': compact.precision,
+        'dimensions': compact.dimensions,
+        'memory_mb': compact.nbytes / 2 ** 20,
+        'compression': np.asarray(index.chunk_matrix).nbytes / max(compact.nbytes, 1),
+    }
+    try:
+        for name, candidates in (('compact', 0), ('rescored', rescore_candidates)):
+            index.attach_compact(compact, candidates)
+            recalls = []
+            latencies = []
+            for query, reference_rows in zip(queries, reference):
+                start = time.perf_counter()
+                scores = index.rescore(query, rows, index.score_section_rows(query, rows))
+                latencies.append(time.perf_counter() - start)
+                recalls.append(len(np.intersect1d(top_k(scores, k), reference_rows)) / max(len(reference_rows), 1))
+            p50, p95 = np.percentile(np.array(latencies) * 1000, [50, 95])
+            result.update({f'{name}_recall_at_{k}': float(np.mean(recalls)), f'{name}_p50_ms': float(p50), f'{name}_p95_ms': float(p95)})
+    finally:
+        index.attach_compact(*previous)
+    return result
+
+
+def run_quantization_evaluation(directory=PROCESSED_DIR, settings=QUANTIZATION_EVAL_SETTINGS, num_queries=ANN_EVAL_QUERIES, k=TOP_N_SECTIONS):
+    """
+    Print the memory use, recall and scoring latency of compact chunk matrices against the float32 one.
+
+    Queries are made near random chunks (see ann.make_eval_queries), so no API calls are made.
+
+    Parameters:
+    directory (Path): The directory containing the store.
+    settings (list): (precision, dimensions) pairs to evaluate.
+    num_queries (int): The number of evaluation queries.
+    k (int): The number of sections retrieved per query.
+
+    Returns:
+    list: One result dict per setting.
+    """
+    index = VectorIndex.load(directory, mmap=False)
+    queries = make_eval_queries(index.chunk_matrix, num_queries)
+    rows = np.arange(len(index.section_ids))
+    index.attach_compact(None)
+    latencies = []
+    reference = []
+    for query in queries:
+        start = time.perf_counter()
+        scores = index.score_section_rows(query, rows)
+        latencies.append(time.perf_counter() - start)
+        reference.append(top_k(scores, k))
+    print(
+        f"float32 x {index.chunk_matrix.shape[1]}: {index.chunk_matrix.nbytes / 2 ** 20:.1f} MB, "
+        f"p50 {np.percentile(np.array(latencies) * 1000, 50):.2f} ms"
+    )
+
+    results = []
+    for precision, dimensions in settings:
+        result = evaluate_compact_matrix(index, CompactMatrix.encode(index.chunk_matrix, precision, dimensions), queries, reference, k)
+        results.append(result)
+        print(
+            f"{precision} x {result['dimensions']}: {result['memory_mb']:.1f} MB ({result['compression']:.1f}x smaller), "
+            f"recall@{k} {result[f'compact_recall_at_{k}']:.3f} (rescored {result[f'rescored_recall_at_{k}']:.3f}), "
+            f"p50 {result['compact_p50_ms']:.2f} ms (rescored {result['rescored_p50_ms']:.2f} ms)"
+        )
+    return results
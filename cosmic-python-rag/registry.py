@@ -0,0 +1,352 @@
+import contextvars
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from cosmic-python-rag_rag.config import CORPORA_DIR, CORPUS_FILENAME, DEFAULT_CORPUS, MAX_LOADED_SHARDS, PROCESSED_DIR, RAW_DIR, SHARD_SEARCH_WORKERS, TOP_N_SECTIONS
+from cosmic-python-rag_rag.corpus import load_corpus
+from cosmic-python-rag_rag.data.embeddings import get_embedding
+from cosmic-python-rag_rag.instrumentation import span
+from cosmic-python-rag_rag.retreival import get_lexical_retrieval, get_rag_response, get_rag_responses
+
+
+def corpus_directories(name=DEFAULT_CORPUS):
+    """
+    Get the directories of a book: the default book in RAW_DIR and PROCESSED_DIR, any other in CORPORA_DIR/<name>.
+
+    Parameters:
+    name (str): The name of the book.
+
+    Returns:
+    tuple: The raw HTML directory and the processed directory.
+    """
+    if name == DEFAULT_CORPUS:
+        return RAW_DIR, PROCESSED_DIR
+    if not name or name.startswith('.') or '/' in name or os.sep in name:
+        raise ValueError(f"Invalid corpus name: {name!r}")
+    return CORPORA_DIR / name / 'raw', CORPORA_DIR / name / 'processed'
+
+
+def is_indexed(name):
+    return (corpus_directories(name)[1] / CORPUS_FILENAME).exists()
+
+
+def discover_corpora():
+    """
+    Find the indexed books: the default book and every directory of CORPORA_DIR with a processed store.
+
+    Returns:
+    dict: Book names mapped to their processed directories, the default book first.
+    """
+    names = [DEFAULT_CORPUS]
+    if CORPORA_DIR.is_dir():
+        names += sorted(entry.name for entry in CORPORA_DIR.iterdir() if entry.is_dir() and entry.name != DEFAULT_CORPUS)
+    return {name: corpus_directories(name)[1] for name in names if is_indexed(name)}
+
+
+def namespace_id(corpus_name, chapter_num):
+    """
+    Get the id of a chapter that is unique across books, '<corpus_name>/<chapter_num>'.
+    """
+    return f"{corpus_name}/{chapter_num}"
+
+
+def namespace_response(corpus_name, top_sections, matched_keywords):
+    """
+    Namespace the chapter ids of a shard's response and tag its sections with the book they come from.
+
+    Parameters:
+    corpus_name (str): The name of the book.
+    top_sections (list): The top sections of the shard.
+    matched_keywords (dict): The matched keywords of the shard, by chapter number.
+
+    Returns:
+    tuple: The namespaced top sections and matched keywords.
+    """
+    return (
+        [dict(section, corpus=corpus_name, chapter_num=namespace_id(corpus_name, section['chapter_num'])) for section in top_sections],
+        {namespace_id(corpus_name, chapter_num): keywords for chapter_num, keywords in matched_keywords.items()},
+    )
+
+
+def merge_responses(responses, top_n=TOP_N_SECTIONS):
+    """
+    Merge the namespaced responses of several shards into the global top sections.
+
+    In hybrid mode the scores are fused within each shard, so the merge interleaves the shards by rank.
+
+    Parameters:
+    responses (list): The (top sections, matched keywords) of each shard.
+    top_n (int): The number of sections to keep.
+
+    Returns:
+    tuple: The top sections of all shards and the matched keywords of their chapters.
+    """
+    top_sections = sorted(
+        (section for sections, _ in responses for section in sections),
+        key=lambda section: section['similarity_score'], reverse=True,
+    )[:top_n]
+    chapter_nums = {section['chapter_num'] for section in top_sections}
+    matched_keywords = {
+        chapter_num: keywords
+        for _, shard_keywords in responses
+        for chapter_num, keywords in shard_keywords.items()
+        if chapter_num in chapter_nums
+    }
+    return top_sections, matched_keywords
+
+
+class CorpusRegistry:
+    """
+    The indexed books, each searched as its own index shard.
+
+    A query fans out to the shards in a thread pool (NumPy releases the GIL while scoring, and
+    threads share the memory-mapped indexes) and the top sections are merged globally. Chapter
+    ids in the results are namespaced by book, so chapters of different books never collide.
+    Shards are loaded on first use or with load, and unloaded with unload or, beyond max_loaded,
+    least recently searched first.
+    """
+
+    def __init__(self, directories, max_loaded=MAX_LOADED_SHARDS, workers=SHARD_SEARCH_WORKERS):
+        """
+        Parameters:
+        directories (dict): Book names mapped to their processed directories.
+        max_loaded (int): The maximum number of shards kept loaded, or None for no limit.
+        workers (int): The number of search threads, or None for one per book up to the CPU count.
+        """
+        self.directories = dict(directories)
+        self.max_loaded = max_loaded
+        self.shards = OrderedDict()
+        # Chapter metadata of every shard loaded so far, kept when a shard is unloaded
+        self.chapter_metadata = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or max(1, min(len(self.directories), os.cpu_count() or 1)),
+            thread_name_prefix='shard-search',
+        )
+        self._chapters = None
+
+    @property
+    def names(self):
+        return list(self.directories)
+
+    def loaded_names(self):
+        with self.lock:
+            return list(self.shards)
+
+    def register(self, name, directory=None):
+        """
+        Add a book to the registry, e.g. one indexed after the registry was created.
+
+        Parameters:
+        name (str): The name of the book.
+        directory (Path): Its processed directory, by default the one of corpus_directories.
+        """
+        with self.lock:
+            self.directories[name] = directory or corpus_directories(name)[1]
+
+    def load(self, name):
+        """
+        Load the shard of a book, unless it is already loaded.
+
+        A book indexed under CORPORA_DIR after the registry was created is registered first.
+
+        Parameters:
+        name (str): The name of the book.
+
+        Returns:
+        Corpus: The loaded shard.
+        """
+        with self.lock:
+            corpus = self.shards.get(name)
+            if corpus is not None:
+                self.shards.move_to_end(name)
+                return corpus
+            directory = self.directories.get(name)
+        if directory is None:
+            if not is_indexed(name):
+                raise KeyError(f"Unknown corpus: {name}")
+            self.register(name)
+            directory = self.directories[name]
+
+        # Loaded outside the lock, so searches of the loaded shards are not held up
+        with span('shard_load', corpus=name):
+            corpus = load_corpus(directory)
+        with self.lock:
+            corpus = self.shards.setdefault(name, corpus)
+            self.shards.move_to_end(name)
+            self.chapter_metadata[name] = corpus.chapters
+            while self.max_loaded is not None and len(self.shards) > self.max_loaded:
+                self.shards.popitem(last=False)
+            self._chapters = None
+        return corpus
+
+    def unload(self, name):
+        """
+        Unload the shard of a book. Searches already running on it finish first, since they hold
+        their own reference; its memory maps and section store are released after them.
+
+        Parameters:
+        name (str): The name of the book.
+
+        Returns:
+        bool: Whether the shard was loaded.
+        """
+        with self.lock:
+            return self.shards.pop(name, None) is not None
+
+    def load_all(self):
+        """
+        Load the shards of all books, up to max_loaded.
+        """
+        for name in self.names[:self.max_loaded]:
+            self.load(name)
+
+    @property
+    def chapters(self):
+        """
+        The chapter metadata of every shard loaded so far, by namespaced chapter id.
+
+        Shards unloaded since, e.g. evicted beyond max_loaded while a search fanned out, keep
+        their chapters, so the results of any search can be resolved.
+        """
+        with self.lock:
+            if self._chapters is None:
+                self._chapters = {
+                    namespace_id(name, chapter_num): chapter
+                    for name, chapters in self.chapter_metadata.items()
+                    for chapter_num, chapter in chapters.items()
+                }
+            return self._chapters
+
+    def select(self, corpora=None):
+        """
+        Get the names of the books to search, all of them by default.
+        """
+        if not corpora:
+            return self.names
+        unknown = [name for name in corpora if name not in self.directories and not is_indexed(name)]
+        if unknown:
+            raise KeyError(f"Unknown corpus: {', '.join(unknown)}")
+        return list(dict.fromkeys(corpora))
+
+    def map_shards(self, search, names):
+        """
+        Run a search on the shards of the given books, in parallel when there are several.
+
+        Parameters:
+        search (callable): Called with the name and the shard of each book.
+        names (list): The names of the books.
+
+        Returns:
+        list: The result of each search, in the order of names.
+        """
+        def run(name):
+            corpus = self.load(name)
+            with span('shard_search', corpus=name):
+                return search(name, corpus)
+
+        if len(names) == 1:
+            return [run(names[0])]
+        # Every search runs in a copy of the caller's context, so its spans are children of the caller's span
+        futures = [self.executor.submit(contextvars.copy_context().run, run, name) for name in names]
+        return [future.result() for future in futures]
+
+    def get_lexical_retrieval(self, query, corpora=None):
+        """
+        Answer a code identifier query from BM25 alone, see retreival.get_lexical_retrieval.
+
+        Only done when a single book is searched, since BM25 scores of different shards are
+        weighted by different document frequencies and cannot be compared.
+
+        Parameters:
+        query (str): The input query.
+        corpora (list): The names of the books to search, all of them by default.
+
+        Returns:
+        tuple: The top sections and matched keywords, or None if the dense retrieval is needed.
+        """
+        names = self.select(corpora)
+        if len(names) != 1:
+            return None
+        response = get_lexical_retrieval(query, self.load(names[0]))
+        return namespace_response(names[0], *response) if response is not None else None
+
+    def get_rag_response(self, query, query_embedding=None, corpora=None):
+        """
+        Get the top sections of all searched books for a query, see retreival.get_rag_response.
+
+        Parameters:
+        query (str): The input query.
+        query_embedding (list): The embedding of the query, if it was already computed.
+        corpora (list): The names of the books to search, all of them by default.
+
+        Returns:
+        tuple: A tuple containing the top sections and matched keywords.
+        """
+        names = self.select(corpora)
+        if query_embedding is None and len(names) > 1:
+            # Embedded once for all shards; with a single shard the lexical shortcut may skip it
+            with span('query_embedding'):
+                query_embedding = get_embedding(query)
+        responses = self.map_shards(
+            lambda name, corpus: namespace_response(name, *get_rag_response(query, corpus, query_embedding)),
+            names,
+        )
+        return merge_responses(responses) if len(responses) > 1 else responses[0]
+
+    def get_rag_responses(self, queries, query_embeddings, corpora=None):
+        """
+        Get the top sections of all searched books for many queries, see retreival.get_rag_responses.
+
+        Parameters:
+        queries (list): The input queries.
+        query_embeddings (np.ndarray): The query embeddings, one per row.
+        corpora (list): The names of the books to search, all of them by default.
+
+        Yields:
+        tuple: The top sections and matched keywords of each query, in order.
+        """
+        names = self.select(corpora)
+        if len(names) == 1:
+            corpus = self.load(names[0])
+            for top_sections, matched_keywords in get_rag_responses(queries, corpus, query_embeddings):
+                yield namespace_response(names[0], top_sections, matched_keywords)
+            return
+        responses = self.map_shards(
+            lambda name, corpus: [
+                namespace_response(name, top_sections, matched_keywords)
+                for top_sections, matched_keywords in get_rag_responses(queries, corpus, query_embeddings)
+            ],
+            names,
+        )
+        for query_responses in zip(*responses):
+            yield merge_responses(query_responses)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            self.shards.clear()
+            self.chapter_metadata.clear()
+            self._chapters = None
+
+
+def load_registry(corpora=None):
+    """
+    Discover the indexed books and load their shards.
+
+    Parameters:
+    corpora (list): The names of the books to serve, all indexed books by default.
+
+    Returns:
+    CorpusRegistry: The registry, with the shards loaded up to MAX_LOADED_SHARDS.
+    """
+    directories = discover_corpora()
+    if corpora:
+        unknown = [name for name in corpora if name not in directories]
+        if unknown:
+            raise KeyError(f"Unknown corpus: {', '.join(unknown)}")
+        directories = {name: directories[name] for name in corpora}
+    registry = CorpusRegistry(directories)
+    registry.load_all()
+    return registry
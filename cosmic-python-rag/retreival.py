@@ -1,109 +1,291 @@
-from cosmic-python-rag_rag.config import TOP_N_CHAPTERS, TOP_N_SECTIONS, SCORE_BOOST_FOR_MATCH
-from cosmic-python-rag_rag.data.embeddings import get_embedding, calculate_similarity
-import string
+import re
+from cosmic-python-rag_rag.config import ANN_CANDIDATES, BATCH_SCORING_SIZE, BM25_CANDIDATES, FUSION_METHOD, HYBRID_DENSE_WEIGHT, LEXICAL_SHORTCUT_MARGIN, RETRIEVAL_MODE, RRF_K, SECTION_SEARCH, TOP_N_CHAPTERS, TOP_N_SECTIONS, SCORE_BOOST_FOR_MATCH
+from cosmic-python-rag_rag.data.embeddings import get_embedding
+from cosmic-python-rag_rag.instrumentation import span
+from cosmic-python-rag_rag.vector_index import top_k
+import numpy as np
 
-def get_initial_retrieval(query, processed_data):
+# snake_case, dotted.access, call(), camelCase and PascalCase names
+IDENTIFIER_PATTERN = re.compile(r'\b\w+_\w+\b|\b\w+\.\w+|\w+\(\)|\b[a-z]+[A-Z]\w*|\b[A-Z][a-z0-9]+[A-Z]\w*')
+
+
+def get_initial_retrieval(query, corpus, query_embedding=None, chapter_similarities=None):
     """
     Retrieve the initial set of chapters based on the query.
 
     Parameters:
     query (str): The input query.
-    processed_data (dict): The processed data containing chapter information.
+    corpus (Corpus): The processed data and its retrieval indexes.
+    query_embedding (list): The embedding of the query, if it was already computed.
+    chapter_similarities (np.ndarray): The similarity of the query to every chapter summary, if it was already computed.
 
     Returns:
-    tuple: A tuple containing the retrieved chapters, query embedding, and filtered matched keywords.
+    tuple: A tuple containing the retrieved chapters, query embedding, filtered matched keywords and all chapter scores.
     """
-    # Get query embedding
-    query_embedding = get_embedding(query)
+    index = corpus.index
 
-    # Load processed data
-
-    # The loops could be combined into one loop, but I'm keeping them separate for now for clarity
-    # Calculate similarity scores for each chapter based on summary embeddings
-    chapter_scores = {}
-    for chapter_num, chapter_data in processed_data.items():
-        summary_embedding = chapter_data['chapter_summary_embedding']
-        similarity_score = calculate_similarity(query_embedding, summary_embedding)
-        chapter_scores[chapter_num] = similarity_score
+    # Get query embedding
+    if query_embedding is None:
+        with span('query_embedding'):
+            query_embedding = get_embedding(query)
 
-    # Adjust scores based on keyword matches
+    # Calculate similarity scores for all chapters at once based on summary embeddings
+    with span('chapter_scoring', chapters=len(index.chapter_ids)):
+        if chapter_similarities is None:
+            scores = index.score_chapters(query_embedding)
+        else:
+            scores = np.array(chapter_similarities, dtype=np.float32)
 
+    # Adjust scores based on keyword matches, looked up in the inverted keyword index
+    with span('keyword_boost') as keyword_span:
+        matched_keywords = corpus.keyword_index.match(query)
+        for chapter_num, keywords in matched_keywords.items():
+            scores[index.chapter_rows[chapter_num]] += SCORE_BOOST_FOR_MATCH * len(keywords)
+        keyword_span.set(matched_chapters=len(matched_keywords))
 
-    matched_keywords = {}
-    query_words = set(query.lower().translate(str.maketrans('', '', string.punctuation)).split())
-    for chapter_num, chapter_data in processed_data.items():
-        matched_keywords[chapter_num] = []
-        for keyword in chapter_data['chapter_keywords']:
-            cleaned_keyword = keyword.lower().translate(str.maketrans('', '', string.punctuation))
-            if cleaned_keyword in query_words:
-                chapter_scores[chapter_num] += SCORE_BOOST_FOR_MATCH
-                matched_keywords[chapter_num].append(keyword)
+    chapter_scores = {chapter_num: float(score) for chapter_num, score in zip(index.chapter_ids, scores)}
 
-    # Sort chapters after adjusting scores
-    retrieved_chapters = sorted(chapter_scores.items(), key=lambda x: x[1], reverse=True)[:TOP_N_CHAPTERS]
+    # Select top chapters after adjusting scores
+    retrieved_chapters = [(index.chapter_ids[row], float(scores[row])) for row in top_k(scores, TOP_N_CHAPTERS)]
 
-    # Filter matched_keywords to include only the retrieved chapters
+    # Filter matched_keywords to include only the retrieved chapters, in chapter order
+    retrieved_chapter_nums = sorted((chapter_num for chapter_num, _ in retrieved_chapters), key=index.chapter_rows.get)
     filtered_matched_keywords = {
-        chapter_num: keywords
-        for chapter_num, keywords in matched_keywords.items()
-        if chapter_num in dict(retrieved_chapters)
+        chapter_num: matched_keywords.get(chapter_num, [])
+        for chapter_num in retrieved_chapter_nums
     }
 
-    # Return filtered_matched_keywords instead of matched_keywords
     return retrieved_chapters, query_embedding, filtered_matched_keywords, chapter_scores
 
-    
-def get_final_retrieval(query_embedding, retrieved_chapters, processed_data, initial_chapter_scores):
+
+def section_id(section):
+    """
+    Get the id of a retrieved section, '<chapter_num>:<section_title>', which stays the same across re-indexing.
+    """
+    return f"{section['chapter_num']}:{section['section_title']}"
+
+
+def rank_positions(scores):
+    """
+    Get the 0-based rank of every score, highest first.
+    """
+    ranks = np.empty(len(scores), dtype=np.int64)
+    ranks[np.argsort(-scores, kind='stable')] = np.arange(len(scores))
+    return ranks
+
+
+def min_max_normalize(scores):
+    spread = scores.max() - scores.min() if len(scores) else 0
+    return (scores - scores.min()) / spread if spread else np.zeros_like(scores)
+
+
+def fuse_scores(dense_scores, lexical_scores, method=FUSION_METHOD):
+    """
+    Fuse dense and BM25 scores of the same candidate sections.
+
+    Parameters:
+    dense_scores (np.ndarray): Dense scores (section similarity plus chapter score).
+    lexical_scores (np.ndarray): BM25 scores; sections without any query term score 0.
+    method (str): 'rrf' for reciprocal-rank fusion or 'weighted' for a weighted sum of min-max normalized scores.
+
+    Returns:
+    np.ndarray: The fused scores.
+    """
+    if method == 'rrf':
+        lexical_contribution = np.where(lexical_scores > 0, 1 / (RRF_K + 1 + rank_positions(lexical_scores)), 0)
+        return 1 / (RRF_K + 1 + rank_positions(dense_scores)) + lexical_contribution
+    if method == 'weighted':
+        return HYBRID_DENSE_WEIGHT * min_max_normalize(dense_scores) + (1 - HYBRID_DENSE_WEIGHT) * min_max_normalize(lexical_scores)
+    raise ValueError(f"Unknown fusion method: {method}")
+
+
+def build_section_results(corpus, rows, scores, score_type='similarity', dense_scores=None):
+    """
+    Build the section results for the given rows, reading their bodies from the section store.
+
+    Parameters:
+    corpus (Corpus): The processed data and its retrieval indexes.
+    rows (list): Section rows of the vector index, best first.
+    scores (list): The score of each row.
+    score_type (str): What the scores are: 'similarity' (dense similarity plus chapter score), 'rrf' or
+    'weighted' (hybrid scores fused with FUSION_METHOD) or 'bm25'.
+    dense_scores (list): The dense similarity of each row to the query, if it was computed.
+
+    Returns:
+    list: The top sections.
+    """
+    top_sections = []
+    with span('section_fetch', sections=len(rows)):
+        sections = corpus.sections.get_many(rows)
+    if dense_scores is None:
+        dense_scores = [None] * len(rows)
+    for row, section, score, dense_score in zip(rows, sections, scores, dense_scores):
+        chapter_num, _ = corpus.index.section_ids[row]
+        top_sections.append({
+            'chapter_num': chapter_num,
+            'chapter_title': corpus.chapters[chapter_num]['chapter_title'],
+            'section_title': section['section_title'],
+            'text_content': section['text_content'],
+            'similarity_score': float(score),
+            'score_type': score_type,
+            'dense_similarity': float(dense_score) if dense_score is not None else None,
+            'code_snippets': section['code_blocks']
+        })
+    return top_sections
+
+
+def get_final_retrieval(query_embedding, retrieved_chapters, corpus, initial_chapter_scores, query=None, section_similarities=None):
     """
     Retrieve the final set of sections based on the query embedding and retrieved chapters.
 
+    With SECTION_SEARCH set to 'direct', the candidates come from an ANN search over all sections
+    instead of the sections of the retrieved chapters. In hybrid mode the best BM25 sections from
+    any chapter join the candidates, and the dense and BM25 scores of all candidates are fused.
+    With precomputed section_similarities, direct search takes the best sections from them
+    exactly instead of searching the ANN index.
+    With a compact chunk matrix, the best candidates are rescored with the float32 one.
+
     Parameters:
     query_embedding (list): The embedding of the query.
     retrieved_chapters (list): The list of retrieved chapters.
-    processed_data (dict): The processed data containing chapter information.
-    initial_chapter_scores (dict): The initial scores of the retrieved chapters.
+    corpus (Corpus): The processed data and its retrieval indexes.
+    initial_chapter_scores (dict): The initial scores of all chapters.
+    query (str): The input query, needed for hybrid retrieval; dense scores alone are used without it.
+    section_similarities (np.ndarray): The similarity of the query to every section, if it was already computed.
 
     Returns:
     list: A list of top sections that match the query.
     """
-    # Find top 5 sections that match the query
-    matching_sections = []
-    for chapter_num, _ in retrieved_chapters:
-        chapter_data = processed_data[chapter_num]
-        for section in chapter_data['sections']:
-            section_embedding = section['embedding']  # Assuming the key is 'embedding' based on the indexing.py file
-            similarity_score = calculate_similarity(query_embedding, section_embedding)
-
-            # Add initial chapter score to the section similarity score
-            total_similarity_score = similarity_score + initial_chapter_scores[chapter_num]
-
-            matching_sections.append({
-                'chapter_num': chapter_num,
-                'chapter_title': chapter_data['chapter_title'],
-                'section_title': section['section_title'],
-                'text_content': section['text_content'],
-                'similarity_score': total_similarity_score,
-                'code_snippets': section['code_blocks']
-            })
-    
-    # Sort sections by similarity score and get top n
-    top_sections = sorted(matching_sections, key=lambda x: x['similarity_score'], reverse=True)[:TOP_N_SECTIONS]
-    
-    return top_sections
-    
-def get_rag_response(query, processed_data):
+    index = corpus.index
+    with span('section_scoring', search=SECTION_SEARCH) as scoring_span:
+        if SECTION_SEARCH == 'direct' and section_similarities is not None:
+            rows = top_k(section_similarities, ANN_CANDIDATES)
+            similarity_scores = section_similarities[rows]
+        elif SECTION_SEARCH == 'direct':
+            # Search all chunks, so the best section is found even outside the top chapters
+            chunk_rows, chunk_scores = corpus.ann_index.search(query_embedding, ANN_CANDIDATES)
+            rows, similarity_scores = index.chunks_to_sections(chunk_rows, chunk_scores)
+        elif section_similarities is not None:
+            rows = np.concatenate([np.empty(0, dtype=np.int64)] + [
+                np.arange(*index.chapter_section_rows[chapter_num])
+                for chapter_num, _ in retrieved_chapters if chapter_num in index.chapter_section_rows
+            ])
+            similarity_scores = section_similarities[rows]
+        else:
+            rows, similarity_scores = index.score_sections(query_embedding, [chapter_num for chapter_num, _ in retrieved_chapters])
+        scoring_span.set(candidates=len(rows))
+
+    if RETRIEVAL_MODE == 'hybrid' and query is not None:
+        with span('bm25_scoring') as bm25_span:
+            lexical_scores = corpus.bm25_index.score(query)
+            lexical_rows = top_k(lexical_scores, BM25_CANDIDATES)
+            extra_rows = np.setdiff1d(lexical_rows[lexical_scores[lexical_rows] > 0], rows)
+            if len(extra_rows):
+                rows = np.concatenate([rows, extra_rows])
+                extra_scores = section_similarities[extra_rows] if section_similarities is not None else index.score_section_rows(query_embedding, extra_rows)
+                similarity_scores = np.concatenate([similarity_scores, extra_scores])
+            bm25_span.set(extra_candidates=len(extra_rows))
+
+    # Scores of a compact chunk matrix are approximate; the best candidates are rescored with full precision
+    similarity_scores = index.rescore(query_embedding, rows, similarity_scores)
+
+    # Add initial chapter score to the section similarity score
+    total_scores = similarity_scores + np.array([initial_chapter_scores[index.section_ids[row][0]] for row in rows], dtype=np.float32)
+
+    score_type = 'similarity'
+    if RETRIEVAL_MODE == 'hybrid' and query is not None:
+        total_scores = fuse_scores(total_scores, lexical_scores[rows], FUSION_METHOD)
+        score_type = FUSION_METHOD
+
+    positions = top_k(total_scores, TOP_N_SECTIONS)
+    return build_section_results(corpus, rows[positions], total_scores[positions], score_type, similarity_scores[positions])
+
+
+def get_lexical_retrieval(query, corpus):
+    """
+    Answer a code identifier query from BM25 alone, without embedding it.
+
+    Only used when the query contains an identifier (e.g. add_batch or SqlAlchemyRepository)
+    and the best BM25 section clearly outscores the runner-up.
+
+    Parameters:
+    query (str): The input query.
+    corpus (Corpus): The processed data and its retrieval indexes.
+
+    Returns:
+    tuple: The top sections and matched keywords, or None if the dense retrieval is needed.
+    """
+    if RETRIEVAL_MODE != 'hybrid' or not IDENTIFIER_PATTERN.search(query):
+        return None
+
+    scores = corpus.bm25_index.score(query)
+    best_rows = top_k(scores, 2)
+    if not len(best_rows) or scores[best_rows[0]] <= 0:
+        return None
+    if len(best_rows) > 1 and scores[best_rows[0]] < LEXICAL_SHORTCUT_MARGIN * scores[best_rows[1]]:
+        return None
+
+    rows = [row for row in top_k(scores, TOP_N_SECTIONS) if scores[row] > 0]
+    top_sections = build_section_results(corpus, rows, scores[rows], 'bm25')
+    matched_keywords = corpus.keyword_index.match(query)
+    chapter_nums = {section['chapter_num'] for section in top_sections}
+    return top_sections, {chapter_num: keywords for chapter_num, keywords in matched_keywords.items() if chapter_num in chapter_nums}
+
+
+def get_rag_response(query, corpus, query_embedding=None):
     """
     Get the RAG (Retrieval-Augmented Generation) response based on the query and processed data.
 
     Parameters:
     query (str): The input query.
-    processed_data (dict): The processed data containing chapter information.
+    corpus (Corpus): The processed data and its retrieval indexes.
+    query_embedding (list): The embedding of the query, if it was already computed.
 
     Returns:
     tuple: A tuple containing the top sections and matched keywords.
     """
-    retrieved_chapters, query_embedding, matched_keywords, initial_chapter_scores = get_initial_retrieval(query, processed_data)
-    
-    top_sections = get_final_retrieval(query_embedding, retrieved_chapters, processed_data, initial_chapter_scores)
-    
-    return top_sections, matched_keywords
+    with span('retrieval') as retrieval_span:
+        if query_embedding is None:
+            with span('lexical_shortcut'):
+                lexical_response = get_lexical_retrieval(query, corpus)
+            if lexical_response is not None:
+                retrieval_span.set(lexical=True)
+                return lexical_response
+
+        retrieved_chapters, query_embedding, matched_keywords, initial_chapter_scores = get_initial_retrieval(query, corpus, query_embedding)
+
+        top_sections = get_final_retrieval(query_embedding, retrieved_chapters, corpus, initial_chapter_scores, query)
+
+        return top_sections, matched_keywords
+
+
+def get_rag_responses(queries, corpus, query_embeddings, batch_size=BATCH_SCORING_SIZE):
+    """
+    Get the RAG responses of many queries, scoring them against all chapters and sections at once.
+
+    The queries are scored in blocks of batch_size as query matrix x corpus matrix products;
+    the rest of the retrieval is the same as get_rag_response with a query embedding.
+
+    Parameters:
+    queries (list): The input queries.
+    corpus (Corpus): The processed data and its retrieval indexes.
+    query_embeddings (np.ndarray): The query embeddings, one per row.
+    batch_size (int): The number of queries scored in one matrix product.
+
+    Yields:
+    tuple: The top sections and matched keywords of each query, in order.
+    """
+    query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+    for start in range(0, len(queries), batch_size):
+        block = query_embeddings[start:start + batch_size]
+        with span('batch_scoring', queries=len(block)):
+            chapter_similarities = corpus.index.score_chapters_batch(block)
+            section_similarities = corpus.index.score_all_sections_batch(block)
+        for offset, query in enumerate(queries[start:start + batch_size]):
+            retrieved_chapters, query_embedding, matched_keywords, initial_chapter_scores = get_initial_retrieval(
+                query, corpus, block[offset], chapter_similarities[offset]
+            )
+            top_sections = get_final_retrieval(
+                query_embedding, retrieved_chapters, corpus, initial_chapter_scores, query, section_similarities[offset]
+            )
+            yield top_sections, matched_keywords
@@ -0,0 +1,281 @@
+import asyncio
+import json
+import openai
+from aiohttp import web
+from cosmic-python-rag_rag.answer_cache import get_answer_cache
+from cosmic-python-rag_rag.clients import close_async_client, get_async_client
+from cosmic-python-rag_rag.config import OPENAI_MODEL_EMB, SERVER_HOST, SERVER_PORT
+from cosmic-python-rag_rag.data.embeddings import get_cached_embeddings, store_embeddings
+from cosmic-python-rag_rag.generation import generate_answer_stream_async
+from cosmic-python-rag_rag.instrumentation import count_usage, get_metrics, span
+from cosmic-python-rag_rag.registry import CorpusRegistry, load_registry
+
+REGISTRY_KEY = web.AppKey('registry', CorpusRegistry)
+CLIENT_KEY = web.AppKey('client', openai.AsyncOpenAI)
+
+
+async def embed_query(client, query):
+    """
+    Get the embedding of a query, using the persistent cache before calling the API.
+    The cache is read and written in a worker thread, so a slow disk does not block the event loop.
+
+    Parameters:
+    client (openai.AsyncOpenAI): The shared async OpenAI client.
+    query (str): The input query.
+
+    Returns:
+    list: The embedding of the query.
+    """
+    with span('query_embedding'):
+        cached = (await asyncio.to_thread(get_cached_embeddings, [query]))[0]
+        if cached is not None:
+            return cached
+        response = await client.embeddings.create(input=[query], model=OPENAI_MODEL_EMB)
+    count_usage(response.usage, OPENAI_MODEL_EMB)
+    embedding = response.data[0].embedding
+    await asyncio.to_thread(store_embeddings, [query], [embedding])
+    return embedding
+
+
+async def read_query(request):
+    """
+    Read the query and the books to search from a JSON request body, responding with 400 if the
+    query is missing and 404 for an unknown book.
+
+    Parameters:
+    request (web.Request): The incoming request.
+
+    Returns:
+    tuple: The query and the names of the books to search, or None for all of them.
+    """
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(text="Request body must be JSON")
+    query = str(body.get('query', '')).strip() if isinstance(body, dict) else ''
+    if not query:
+        raise web.HTTPBadRequest(text="Missing 'query'")
+    corpora = body.get('corpora') or None
+    if corpora is not None:
+        if not isinstance(corpora, list) or not all(isinstance(name, str) for name in corpora):
+            raise web.HTTPBadRequest(text="'corpora' must be a list of corpus names")
+        try:
+            request.app[REGISTRY_KEY].select(corpora)
+        except KeyError as e:
+            raise web.HTTPNotFound(text=str(e.args[0]))
+    return query, corpora
+
+
+async def retrieve_sections(app, query, corpora=None):
+    """
+    Retrieve the top sections for a query, embedding it only if BM25 alone cannot answer it.
+
+    The searches run in worker threads, so a slow query or a shard loaded on demand does not hold up
+    the other requests.
+
+    Parameters:
+    app (web.Application): The application holding the corpus registry and the OpenAI client.
+    query (str): The input query.
+    corpora (list): The names of the books to search, all of them by default.
+
+    Returns:
+    tuple: The top sections, the matched keywords and the query embedding, None if BM25 alone answered the query.
+    """
+    registry = app[REGISTRY_KEY]
+    with span('lexical_shortcut'):
+        lexical_response = await asyncio.to_thread(registry.get_lexical_retrieval, query, corpora)
+    if lexical_response is not None:
+        return (*lexical_response, None)
+    query_embedding = await embed_query(app[CLIENT_KEY], query)
+    top_sections, matched_keywords = await asyncio.to_thread(registry.get_rag_response, query, query_embedding, corpora)
+    return top_sections, matched_keywords, query_embedding
+
+
+async def retrieve(request):
+    """
+    Retrieve the top sections for a query.
+
+    Parameters:
+    request (web.Request): A POST request with a JSON body {"query": "...", "corpora": [...]}, corpora optional.
+
+    Returns:
+    web.Response: JSON with the top sections and matched keywords.
+    """
+    query, corpora = await read_query(request)
+    top_sections, matched_keywords, _ = await retrieve_sections(request.app, query, corpora)
+    return web.json_response({'sections': top_sections, 'matched_keywords': matched_keywords})
+
+
+async def answer(request):
+    """
+    Answer a query, streaming the result as newline-delimited JSON events.
+
+    The first event contains the retrieved sections, followed by one event per generated chunk
+    and a final event with the time to first token and total latency. A cached answer for a
+    similar query is sent as a single chunk.
+
+    Parameters:
+    request (web.Request): A POST request with a JSON body {"query": "...", "corpora": [...]}, corpora optional.
+
+    Returns:
+    web.StreamResponse: The streamed events.
+    """
+    query, corpora = await read_query(request)
+    top_sections, matched_keywords, query_embedding = await retrieve_sections(request.app, query, corpora)
+    answer_cache = get_answer_cache()
+    cached_answer = None
+    if answer_cache is not None:
+        # The answer cache reads and writes SQLite, so it is used from a worker thread; answers of queries
+        # answered by BM25 alone are looked up by query text, since they are not embedded
+        cached_answer = await asyncio.to_thread(answer_cache.get, query_embedding, top_sections, query)
+
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+
+    async def send(event):
+        await response.write((json.dumps(event) + '\n').encode('utf-8'))
+
+    await send({'type': 'sources', 'sections': top_sections, 'matched_keywords': matched_keywords})
+
+    if cached_answer is not None:
+        await send({'type': 'token', 'content': cached_answer})
+        await send({'type': 'done', 'timings': {}, 'cached': True})
+        await response.write_eof()
+        return response
+
+    timings = {}
+    chunks = []
+    async for content in generate_answer_stream_async(query, top_sections, timings):
+        chunks.append(content)
+        await send({'type': 'token', 'content': content})
+    if answer_cache is not None:
+        await asyncio.to_thread(answer_cache.put, query_embedding, top_sections, ''.join(chunks), query)
+
+    await send({'type': 'done', 'timings': timings, 'cached': False})
+    await response.write_eof()
+    return response
+
+
+async def health(request):
+    answer_cache = get_answer_cache()
+    return web.json_response({
+        'status': 'ok',
+        'corpora': request.app[REGISTRY_KEY].loaded_names(),
+        'chapters': len(request.app[REGISTRY_KEY].chapters),
+        'answer_cache': answer_cache.stats() if answer_cache is not None else None,
+    })
+
+
+async def list_corpora(request):
+    """
+    List the indexed books and the ones whose shards are loaded.
+    """
+    registry = request.app[REGISTRY_KEY]
+    return web.json_response({'corpora': registry.names, 'loaded': registry.loaded_names()})
+
+
+async def load_corpus_shard(request):
+    """
+    Load the shard of a book, e.g. one indexed while the server runs, responding with 404 for an unknown book.
+    """
+    name = request.match_info['name']
+    try:
+        # Loading can rebuild the indexes of the shard, so it runs in a worker thread
+        await asyncio.to_thread(request.app[REGISTRY_KEY].load, name)
+    except (KeyError, ValueError):
+        raise web.HTTPNotFound(text=f"Unknown corpus: {name}")
+    return web.json_response({'corpus': name, 'loaded': True})
+
+
+async def unload_corpus_shard(request):
+    """
+    Unload the shard of a book; it is loaded again by the next query that searches it.
+    """
+    name = request.match_info['name']
+    was_loaded = request.app[REGISTRY_KEY].unload(name)
+    return web.json_response({'corpus': name, 'loaded': False, 'was_loaded': was_loaded})
+
+
+async def metrics(request):
+    """
+    Serve the span durations and counters in the Prometheus text format.
+
+    Responds with 404 while instrumentation is disabled.
+    """
+    collected = get_metrics()
+    if collected is None:
+        raise web.HTTPNotFound(text="Instrumentation is disabled")
+    return web.Response(text=collected.render_prometheus(), content_type='text/plain', charset='utf-8')
+
+
+@web.middleware
+async def instrument_requests(request, handler):
+    """
+    Time every request in a span, the parent of the spans of its pipeline stages.
+    """
+    with span('http_request', path=request.path) as request_span:
+        try:
+            response = await handler(request)
+        except web.HTTPException as e:
+            # Responses raised as exceptions, e.g. 400 for a missing query, are not failures of the request span
+            request_span.set(status=e.status)
+            http_error = e
+        else:
+            request_span.set(status=response.status)
+            return response
+    raise http_error
+
+
+async def openai_client_context(app):
+    """
+    Attach the shared async OpenAI client while the application runs and close it on shutdown.
+    """
+    app[CLIENT_KEY] = get_async_client()
+    yield
+    await close_async_client()
+
+
+def create_app(registry):
+    """
+    Create the HTTP API application.
+
+    The index shards are loaded once and shared by all requests, and the shared async OpenAI client
+    keeps a pool of open connections for embedding and generation requests.
+
+    Parameters:
+    registry (CorpusRegistry): The indexed books and their retrieval indexes.
+
+    Returns:
+    web.Application: The application.
+    """
+    app = web.Application(middlewares=[instrument_requests])
+    app[REGISTRY_KEY] = registry
+    app.cleanup_ctx.append(openai_client_context)
+    app.router.add_post('/retrieve', retrieve)
+    app.router.add_post('/answer', answer)
+    app.router.add_get('/health', health)
+    app.router.add_get('/corpora', list_corpora)
+    app.router.add_post('/corpora/{name}/load', load_corpus_shard)
+    app.router.add_post('/corpora/{name}/unload', unload_corpus_shard)
+    app.router.add_get('/metrics', metrics)
+    return app
+
+
+def run_server(host=SERVER_HOST, port=SERVER_PORT, corpora=None):
+    """
+    Load the index shards and serve the HTTP API.
+
+    Parameters:
+    host (str): The interface to bind to.
+    port (int): The port to listen on.
+    corpora (list): The names of the books to serve, all indexed books by default.
+    """
+    registry = load_registry(corpora)
+    try:
+        web.run_app(create_app(registry), host=host, port=port)
+    finally:
+        registry.close()
+
+
+if __name__ == "__main__":
+    run_server()
@@ -0,0 +1,348 @@
+import json
+import os
+from contextlib import contextmanager
+import numpy as np
+from cosmic-python-rag_rag.config import RESCORE_CANDIDATES
+
+CHAPTER_EMBEDDINGS_FILENAME = 'chapter_embeddings.npy'
+SECTION_EMBEDDINGS_FILENAME = 'section_embeddings.npy'
+CHUNK_EMBEDDINGS_FILENAME = 'chunk_embeddings.npy'
+CHUNK_SECTIONS_FILENAME = 'chunk_sections.npy'
+INDEX_IDS_FILENAME = 'vector_index.json'
+
+
+@contextmanager
+def atomic_write(path, mode='wb'):
+    """
+    Open a temporary file that replaces path only once it has been written completely.
+
+    Processes that still have the old file open or memory-mapped keep reading the old contents.
+
+    Parameters:
+    path (Path): The destination file.
+    mode (str): The file mode, 'wb' or 'w'.
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def normalize_rows(matrix):
+    """
+    L2-normalize the rows of a matrix.
+
+    Parameters:
+    matrix (np.ndarray): A 2D array of embeddings.
+
+    Returns:
+    np.ndarray: A contiguous float32 array with unit-length rows (zero rows are left as zeros).
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k(scores, k):
+    """
+    Get the indices of the k highest scores, sorted by descending score.
+
+    Parameters:
+    scores (np.ndarray): A 1D array of scores.
+    k (int): The number of indices to return.
+
+    Returns:
+    np.ndarray: Indices of the top k scores.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class VectorIndex:
+    """
+    In-memory index of chapter summary and section chunk embeddings.
+
+    Embeddings are kept as contiguous, L2-normalized float32 matrices so scoring a query
+    is a single matrix-vector product instead of one similarity call per item. Sections are
+    embedded as one or more chunks (see data.chunking); a section scores as its best chunk.
+
+    With a compact copy of the chunk matrix attached (see quantization.CompactMatrix), sections
+    are scored on the compact embeddings, and rescore replaces the scores of the best candidates
+    with float32 ones, so only those rows of the float32 chunk matrix are read.
+    """
+
+    def __init__(self, chapter_ids, chapter_matrix, section_ids, chunk_matrix, chunk_sections=None):
+        """
+        Parameters:
+        chapter_ids (list): Chapter numbers, one per row of chapter_matrix.
+        chapter_matrix (np.ndarray): Normalized chapter summary embeddings.
+        section_ids (list): (chapter_num, section_index) tuples, one per section row.
+        chunk_matrix (np.ndarray): Normalized chunk embeddings, grouped by section and chapter.
+        chunk_sections (np.ndarray): The section row of every chunk (non-decreasing, every section
+        has at least one chunk), or None for one chunk per section.
+        """
+        self.chapter_ids = list(chapter_ids)
+        self.chapter_matrix = chapter_matrix
+        self.section_ids = [tuple(section_id) for section_id in section_ids]
+        self.chunk_matrix = chunk_matrix
+        if chunk_sections is None:
+            chunk_sections = np.arange(len(self.section_ids))
+        self.chunk_sections = np.asarray(chunk_sections, dtype=np.int64)
+        self.single_chunk = len(self.chunk_sections) == len(self.section_ids)
+        # Chunks of section row r are chunk_offsets[r]:chunk_offsets[r + 1]
+        self.chunk_offsets = np.searchsorted(self.chunk_sections, np.arange(len(self.section_ids) + 1))
+        self.chapter_rows = {chapter_num: row for row, chapter_num in enumerate(self.chapter_ids)}
+        self.compact = None
+        self.rescore_candidates = RESCORE_CANDIDATES
+
+        # Sections are stored grouped by chapter, so each chapter maps to a contiguous row range
+        self.chapter_section_rows = {}
+        for row, (chapter_num, _) in enumerate(self.section_ids):
+            start, _ = self.chapter_section_rows.get(chapter_num, (row, row))
+            self.chapter_section_rows[chapter_num] = (start, row + 1)
+
+    @classmethod
+    def from_processed_data(cls, processed_data):
+        """
+        Build the index from processed data.
+
+        Parameters:
+        processed_data (dict): The processed data containing chapter information and embeddings.
+
+        Returns:
+        VectorIndex: The built index.
+        """
+        chapter_ids = []
+        chapter_embeddings = []
+        section_ids = []
+        chunk_embeddings = []
+        chunk_sections = []
+        for chapter_num, chapter_data in processed_data.items():
+            chapter_ids.append(chapter_num)
+            chapter_embeddings.append(chapter_data['chapter_summary_embedding'])
+            for section_index, section in enumerate(chapter_data['sections']):
+                # Data indexed before chunking has a single embedding per section
+                embeddings = section['chunk_embeddings'] if 'chunk_embeddings' in section else [section['embedding']]
+                chunk_sections.extend([len(section_ids)] * len(embeddings))
+                chunk_embeddings.extend(embeddings)
+                section_ids.append((chapter_num, section_index))
+
+        chapter_matrix = normalize_rows(np.array(chapter_embeddings, dtype=np.float32))
+        chunk_matrix = np.array(chunk_embeddings, dtype=np.float32)
+        if not chunk_embeddings:
+            chunk_matrix = chunk_matrix.reshape(0, chapter_matrix.shape[1] if chapter_matrix.ndim == 2 else 0)
+
+        return cls(chapter_ids, chapter_matrix, section_ids, normalize_rows(chunk_matrix), np.array(chunk_sections, dtype=np.int64))
+
+    def save(self, directory):
+        """
+        Save the index as raw float32 .npy matrices plus a small JSON file with the row ids.
+
+        Parameters:
+        directory (Path): The directory to write the index files to.
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        with atomic_write(directory / CHAPTER_EMBEDDINGS_FILENAME) as f:
+            np.save(f, np.ascontiguousarray(self.chapter_matrix, dtype=np.float32))
+        with atomic_write(directory / CHUNK_EMBEDDINGS_FILENAME) as f:
+            np.save(f, np.ascontiguousarray(self.chunk_matrix, dtype=np.float32))
+        with atomic_write(directory / CHUNK_SECTIONS_FILENAME) as f:
+            np.save(f, self.chunk_sections)
+        # Superseded by the chunk matrix
+        (directory / SECTION_EMBEDDINGS_FILENAME).unlink(missing_ok=True)
+        with atomic_write(directory / INDEX_IDS_FILENAME, 'w') as ids_file:
+            json.dump({'chapter_ids': self.chapter_ids, 'section_ids': self.section_ids}, ids_file, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Load an index saved with save().
+
+        The matrices are opened with np.memmap by default, so loading is nearly instant and
+        the pages are shared between processes that load the same files.
+
+        Parameters:
+        directory (Path): The directory containing the index files.
+        mmap (bool): Whether to memory-map the matrices instead of reading them into memory.
+
+        Returns:
+        VectorIndex: The loaded index.
+        """
+        mmap_mode = 'r' if mmap else None
+        with open(directory / INDEX_IDS_FILENAME, 'r') as ids_file:
+            ids = json.load(ids_file)
+        if (directory / CHUNK_EMBEDDINGS_FILENAME).exists():
+            chunk_matrix = np.load(directory / CHUNK_EMBEDDINGS_FILENAME, mmap_mode=mmap_mode)
+            chunk_sections = np.load(directory / CHUNK_SECTIONS_FILENAME)
+        else:
+            # Stores written before chunking have one embedding per section
+            chunk_matrix = np.load(directory / SECTION_EMBEDDINGS_FILENAME, mmap_mode=mmap_mode)
+            chunk_sections = None
+        return cls(
+            ids['chapter_ids'],
+            np.load(directory / CHAPTER_EMBEDDINGS_FILENAME, mmap_mode=mmap_mode),
+            ids['section_ids'],
+            chunk_matrix,
+            chunk_sections,
+        )
+
+    def attach_compact(self, compact, rescore_candidates=RESCORE_CANDIDATES):
+        """
+        Score sections on a compact copy of the chunk matrix.
+
+        Parameters:
+        compact (CompactMatrix): The compact chunk embeddings, or None to score on the float32 matrix.
+        rescore_candidates (int): The number of best sections per query rescored with full precision (0 for none).
+        """
+        if compact is not None and len(compact) != len(self.chunk_matrix):
+            raise ValueError("The compact matrix does not match the chunk matrix")
+        self.compact = compact
+        self.rescore_candidates = rescore_candidates
+
+    def _prepare_query(self, query_embedding):
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        return query / norm if norm else query
+
+    def score_chapters(self, query_embedding):
+        """
+        Calculate the cosine similarity between the query and every chapter summary.
+
+        Parameters:
+        query_embedding (list): The embedding of the query.
+
+        Returns:
+        np.ndarray: Similarity scores aligned with chapter_ids.
+        """
+        return np.asarray(self.chapter_matrix @ self._prepare_query(query_embedding))
+
+    def score_chapters_batch(self, query_embeddings):
+        """
+        Calculate the cosine similarity between many queries and every chapter summary in one matrix product.
+
+        Parameters:
+        query_embeddings (np.ndarray): Query embeddings, one per row.
+
+        Returns:
+        np.ndarray: A queries x chapters matrix of similarity scores.
+        """
+        return np.asarray(normalize_rows(query_embeddings) @ self.chapter_matrix.T)
+
+    def score_all_sections_batch(self, query_embeddings):
+        """
+        Calculate the cosine similarity between many queries and every section (its best chunk) in one matrix product.
+        The scores are approximate with a compact chunk matrix attached, see rescore.
+
+        Parameters:
+        query_embeddings (np.ndarray): Query embeddings, one per row.
+
+        Returns:
+        np.ndarray: A queries x sections matrix of similarity scores.
+        """
+        queries = normalize_rows(query_embeddings)
+        if self.compact is None:
+            chunk_scores = np.asarray(queries @ self.chunk_matrix.T)
+        else:
+            chunk_scores = self.compact.score_batch(queries)
+        if self.single_chunk or not len(self.section_ids):
+            section_scores = chunk_scores
+        else:
+            section_scores = np.maximum.reduceat(chunk_scores, self.chunk_offsets[:-1], axis=1)
+        return section_scores
+
+    def score_sections(self, query_embedding, chapter_nums):
+        """
+        Calculate the cosine similarity between the query and every section of the given chapters.
+
+        Parameters:
+        query_embedding (list): The embedding of the query.
+        chapter_nums (list): The chapters whose sections should be scored.
+
+        Returns:
+        tuple: Row indices into section_ids and their similarity scores.
+        """
+        ranges = [self.chapter_section_rows[num] for num in chapter_nums if num in self.chapter_section_rows]
+        if not ranges:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+        return rows, self.score_section_rows(query_embedding, rows)
+
+    def score_section_rows(self, query_embedding, rows):
+        """
+        Calculate the cosine similarity between the query and the best chunk of each given section row.
+        The scores are approximate with a compact chunk matrix attached, see rescore.
+
+        Parameters:
+        query_embedding (list): The embedding of the query.
+        rows (np.ndarray): Row indices into section_ids.
+
+        Returns:
+        np.ndarray: Similarity scores aligned with rows.
+        """
+        if not len(rows):
+            return np.empty(0, dtype=np.float32)
+        return self._score_section_rows(self._prepare_query(query_embedding), np.asarray(rows), exact=self.compact is None)
+
+    def _score_chunk_rows(self, query, chunk_rows, exact):
+        if exact:
+            return np.asarray(self.chunk_matrix[chunk_rows] @ query)
+        return self.compact.score(query, chunk_rows)
+
+    def _score_section_rows(self, query, rows, exact):
+        if self.single_chunk:
+            return self._score_chunk_rows(query, rows, exact)
+        starts = self.chunk_offsets[rows]
+        lengths = self.chunk_offsets[rows + 1] - starts
+        firsts = np.cumsum(lengths) - lengths
+        chunk_rows = np.repeat(starts - firsts, lengths) + np.arange(lengths.sum())
+        return np.maximum.reduceat(self._score_chunk_rows(query, chunk_rows, exact), firsts)
+
+    def rescore(self, query_embedding, rows, scores):
+        """
+        Rescore the best sections scored on the compact chunk matrix with the float32 one.
+
+        The other sections keep their compact scores, capped at the lowest rescored score so they
+        stay ranked below the rescored ones.
+
+        Parameters:
+        query_embedding (list): The embedding of the query.
+        rows (np.ndarray): Row indices into section_ids.
+        scores (np.ndarray): Their scores on the compact chunk matrix.
+
+        Returns:
+        np.ndarray: The scores, with full precision scores for the best rescore_candidates rows.
+        """
+        if self.compact is None or not self.rescore_candidates or not len(rows):
+            return scores
+        best = np.sort(top_k(scores, self.rescore_candidates))
+        rescored = np.array(scores, dtype=np.float32)
+        rescored[best] = self._score_section_rows(self._prepare_query(query_embedding), np.asarray(rows)[best], exact=True)
+        rest = np.ones(len(rescored), dtype=bool)
+        rest[best] = False
+        rescored[rest] = np.minimum(rescored[rest], rescored[best].min())
+        return rescored
+
+    def chunks_to_sections(self, chunk_rows, scores):
+        """
+        Aggregate chunk search results to sections, scoring each section by its best chunk.
+
+        Parameters:
+        chunk_rows (np.ndarray): Row indices into the chunk matrix.
+        scores (np.ndarray): The similarity score of each chunk.
+
+        Returns:
+        tuple: Section rows and their scores, best first.
+        """
+        order = np.argsort(-scores, kind='stable')
+        section_rows = self.chunk_sections[np.asarray(chunk_rows, dtype=np.int64)[order]]
+        _, first = np.unique(section_rows, return_index=True)
+        first = np.sort(first)
+        return section_rows[first], np.asarray(scores)[order][first]
@@ -0,0 +1,17 @@
+import pytest
+from cosmic-python-rag_rag.benchmark import generate_synthetic_corpus
+from cosmic-python-rag_rag.data.store import save_processed_data
+
+DIM = 32
+
+
+@pytest.fixture
+def processed_data():
+    return generate_synthetic_corpus(6, 4, DIM)
+
+
+@pytest.fixture
+def store_dir(tmp_path, processed_data):
+    directory = tmp_path / 'processed'
+    save_processed_data(processed_data, directory)
+    return directory
@@ -0,0 +1,52 @@
+import numpy as np
+from cosmic-python-rag_rag.ann import ExactSearch, IVFIndex, evaluate_recall, load_ann_index, make_eval_queries
+from cosmic-python-rag_rag.vector_index import normalize_rows
+
+NUM_CHUNKS = 2000
+DIM = 32
+
+
+def make_matrix():
+    # Clustered rows, like real embeddings, so a few probes find most neighbours
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((20, DIM))
+    return normalize_rows(centers[rng.integers(0, 20, NUM_CHUNKS)] + 0.3 * rng.standard_normal((NUM_CHUNKS, DIM)))
+
+
+def test_ivf_recall_against_exact_search():
+    matrix = make_matrix()
+    index = IVFIndex.build(matrix)
+    queries = make_eval_queries(matrix, 50)
+    assert evaluate_recall(index, matrix, queries, k=10)['recall_at_10'] >= 0.9
+
+    # Searching every cluster is exact search
+    index.search_budget = len(index.centroids)
+    for query in queries[:10]:
+        rows, scores = index.search(query, 10)
+        exact_rows, exact_scores = ExactSearch(matrix).search(query, 10)
+        assert list(rows) == list(exact_rows)
+        np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+
+
+def test_more_probes_do_not_lower_recall():
+    matrix = make_matrix()
+    index = IVFIndex.build(matrix)
+    queries = make_eval_queries(matrix, 50)
+    recalls = []
+    for nprobe in (1, 4, 16):
+        index.search_budget = nprobe
+        recalls.append(evaluate_recall(index, matrix, queries, k=10)['recall_at_10'])
+    assert recalls == sorted(recalls)
+
+
+def test_every_chunk_is_in_one_cluster():
+    index = IVFIndex.build(make_matrix())
+    assert sorted(index.order) == list(range(NUM_CHUNKS))
+    assert index.offsets[-1] == NUM_CHUNKS
+
+
+def test_stale_ivf_index_is_rebuilt(tmp_path):
+    matrix = make_matrix()
+    IVFIndex.build(matrix[:100]).save(tmp_path)
+    index = load_ann_index(tmp_path, matrix, backend='ivf')
+    assert len(index.order) == NUM_CHUNKS
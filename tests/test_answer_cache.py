@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+import pytest
+from cosmic-python-rag_rag import answer_cache
+from cosmic-python-rag_rag.answer_cache import AnswerCache
+from cosmic-python-rag_rag.benchmark import fake_embedding
+from cosmic-python-rag_rag.generation import ERROR_ANSWER
+
+DIM = 32
+SECTIONS = [{'chapter_num': '01', 'section_title': "1.1 Batches"}, {'chapter_num': '02', 'section_title': "2.1 Repository"}]
+OTHER_SECTIONS = [{'chapter_num': '01', 'section_title': "1.1 Batches"}, {'chapter_num': '03', 'section_title': "3.1 Unit of Work"}]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(answer_cache, 'time', SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def near(embedding, seed_text, noise):
+    return embedding + noise * fake_embedding(seed_text, DIM)
+
+
+def test_similar_query_with_the_same_sections_hits(clock):
+    cache = AnswerCache(threshold=0.95)
+    embedding = fake_embedding("how are batches allocated", DIM)
+    cache.put(embedding, SECTIONS, "Answer")
+    # Section order does not matter
+    assert cache.get(near(embedding, "noise", 0.1), list(reversed(SECTIONS))) == "Answer"
+    assert cache.get(fake_embedding("what is a repository", DIM), SECTIONS) is None
+    assert cache.get(embedding, OTHER_SECTIONS) is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+
+
+def test_answers_expire_after_the_ttl(clock):
+    cache = AnswerCache(ttl=60)
+    embedding = fake_embedding("how are batches allocated", DIM)
+    cache.put(embedding, SECTIONS, "Answer")
+    clock.now += 60
+    assert cache.get(embedding, SECTIONS) == "Answer"
+    clock.now += 1
+    assert cache.get(embedding, SECTIONS) is None
+    # Expired answers are dropped on the next put
+    cache.put(fake_embedding("another query", DIM), OTHER_SECTIONS, "Other")
+    assert cache.stats()['entries'] == 1
+
+
+def test_least_recently_used_answers_are_evicted(clock):
+    cache = AnswerCache(max_items=2)
+    embeddings = [fake_embedding(f"query {i}", DIM) for i in range(3)]
+    cache.put(embeddings[0], SECTIONS, "First")
+    cache.put(embeddings[1], SECTIONS, "Second")
+    assert cache.get(embeddings[0], SECTIONS) == "First"
+    cache.put(embeddings[2], SECTIONS, "Third")
+    assert cache.get(embeddings[1], SECTIONS) is None
+    assert cache.get(embeddings[0], SECTIONS) == "First"
+    assert cache.stats()['evictions'] == 1
+
+
+def test_queries_that_were_not_embedded_match_by_text(clock):
+    cache = AnswerCache()
+    cache.put(None, SECTIONS, "Answer", query="What is  add_batch?")
+    assert cache.get(None, SECTIONS, query="what is add_batch?") == "Answer"
+    assert cache.get(None, SECTIONS, query="what is allocate?") is None
+    assert cache.get(None, OTHER_SECTIONS, query="what is add_batch?") is None
+
+
+def test_error_answers_are_not_stored(clock):
+    cache = AnswerCache()
+    embedding = fake_embedding("query", DIM)
+    cache.put(embedding, SECTIONS, f"Partial answer {ERROR_ANSWER}")
+    cache.put(None, SECTIONS, "Answer")
+    assert cache.stats()['entries'] == 0
+
+
+def test_answers_persist_in_sqlite(tmp_path, clock):
+    path = tmp_path / 'answers.sqlite'
+    embedding = fake_embedding("how are batches allocated", DIM)
+    cache = AnswerCache(path=path)
+    cache.put(embedding, SECTIONS, "Answer")
+    cache.put(None, OTHER_SECTIONS, "Lexical answer", query="add_batch")
+    cache.close()
+
+    reopened = AnswerCache(path=path)
+    assert reopened.get(embedding, SECTIONS) == "Answer"
+    assert reopened.get(None, OTHER_SECTIONS, query="add_batch") == "Lexical answer"
+    reopened.close()
+
+    clock.now += reopened.ttl + 1
+    expired = AnswerCache(path=path)
+    assert expired.stats()['entries'] == 0
+    expired.close()
@@ -0,0 +1,130 @@
+import asyncio
+import openai
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from cosmic-python-rag_rag import async_indexing, clients
+from cosmic-python-rag_rag.async_indexing import AsyncIndexer, with_retries
+from cosmic-python-rag_rag.clients import close_async_client, get_async_client
+from cosmic-python-rag_rag.data import cache
+
+DIM = 8
+REQUEST_DELAY = 0.05
+
+
+class FakeOpenAI:
+    """
+    Local stand-in for the embeddings endpoint that answers the first rate_limited requests with 429.
+    """
+
+    def __init__(self, rate_limited=0, status=429):
+        self.rate_limited = rate_limited
+        self.status = status
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def embeddings(self, request):
+        body = await request.json()
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(REQUEST_DELAY)
+            if self.requests <= self.rate_limited:
+                return web.json_response({'error': {'message': "Rate limit reached", 'type': 'requests'}}, status=self.status)
+            return web.json_response({
+                'object': 'list',
+                'model': body['model'],
+                'data': [
+                    {'object': 'embedding', 'index': i, 'embedding': [float(len(text))] * DIM}
+                    for i, text in enumerate(body['input'])
+                ],
+                'usage': {'prompt_tokens': len(body['input']), 'total_tokens': len(body['input'])},
+            })
+        finally:
+            self.in_flight -= 1
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/v1/embeddings', self.embeddings)
+        return app
+
+
+@pytest.fixture
+def backoff_delays(monkeypatch):
+    """
+    Record the upper bound of every backoff delay and sleep for a fraction of it, so the tests stay fast.
+    """
+    delays = []
+
+    def uniform(low, high):
+        delays.append(high)
+        return high / 100
+
+    monkeypatch.setattr(async_indexing.random, 'uniform', uniform)
+    monkeypatch.setattr(cache, 'CACHE_ENABLED', False)
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    return delays
+
+
+def run_against(fake, monkeypatch, use_client):
+    async def run():
+        async with TestServer(fake.app()) as server:
+            monkeypatch.setattr(clients, 'OPENAI_BASE_URL', str(server.make_url('/v1')))
+            client = get_async_client().with_options(max_retries=0)
+            try:
+                return await use_client(client)
+            finally:
+                await close_async_client()
+
+    return asyncio.run(run())
+
+
+def test_rate_limited_requests_are_retried_with_exponential_backoff(monkeypatch, backoff_delays):
+    fake = FakeOpenAI(rate_limited=2)
+    response = run_against(fake, monkeypatch, lambda client: with_retries(
+        lambda: client.embeddings.create(input=['abc'], model='test'), base_delay=1.0, max_delay=30.0
+    ))
+    assert response.data[0].embedding == [3.0] * DIM
+    assert fake.requests == 3
+    assert backoff_delays == [1.0, 2.0]
+
+
+def test_backoff_is_capped(monkeypatch, backoff_delays):
+    fake = FakeOpenAI(rate_limited=3)
+    run_against(fake, monkeypatch, lambda client: with_retries(
+        lambda: client.embeddings.create(input=['abc'], model='test'), base_delay=1.0, max_delay=3.0
+    ))
+    assert backoff_delays == [1.0, 2.0, 3.0]
+
+
+def test_client_errors_are_not_retried(monkeypatch, backoff_delays):
+    fake = FakeOpenAI(rate_limited=1, status=400)
+    with pytest.raises(openai.BadRequestError):
+        run_against(fake, monkeypatch, lambda client: with_retries(
+            lambda: client.embeddings.create(input=['abc'], model='test')
+        ))
+    assert fake.requests == 1
+    assert backoff_delays == []
+
+
+def test_indexer_bounds_requests_in_flight(monkeypatch, backoff_delays):
+    # One text per batch, so every text is a request of its own
+    monkeypatch.setattr(async_indexing, 'EMBEDDING_BATCH_MAX_ITEMS', 1)
+    fake = FakeOpenAI(rate_limited=3)
+    texts = ['a' * length for length in range(1, 11)]
+
+    async def embed(client):
+        indexer = AsyncIndexer(client, concurrency=3)
+        indexer._start_stage('Embeddings', len(texts))
+        try:
+            return await indexer.embed(texts)
+        finally:
+            indexer._close_stages()
+
+    embeddings = run_against(fake, monkeypatch, embed)
+    assert embeddings == [[float(len(text))] * DIM for text in texts]
+    assert fake.requests == len(texts) + 3
+    assert len(backoff_delays) == 3
+    assert fake.max_in_flight == 3
@@ -0,0 +1,99 @@
+import json
+import pytest
+from cosmic-python-rag_rag import batch
+from cosmic-python-rag_rag.batch import read_answered_ids, read_questions, run_batch
+from cosmic-python-rag_rag.benchmark import fake_embedding
+
+DIM = 32
+
+
+class FakeRegistry:
+    def get_rag_responses(self, queries, query_embeddings):
+        for query in queries:
+            yield [{'chapter_num': '01', 'section_title': query, 'chapter_title': "Chapter 1", 'similarity_score': 0.5}], {}
+
+    def close(self):
+        pass
+
+
+class FakeClient:
+    def with_options(self, **options):
+        return self
+
+
+@pytest.fixture
+def answered(monkeypatch):
+    """
+    Run batches without the API, recording the questions that are answered; queries containing 'fail' fail.
+    """
+    answered = []
+
+    async def generate_batch_answer(client, query, top_sections):
+        answered.append(query)
+        if 'fail' in query:
+            raise RuntimeError("Rate limit reached")
+        return f"Answer to {query}", {'prompt_tokens': 10}
+
+    async def close_async_client():
+        pass
+
+    monkeypatch.setattr(batch, 'load_registry', lambda corpora=None: FakeRegistry())
+    monkeypatch.setattr(batch, 'get_embeddings_batch', lambda texts: [fake_embedding(text, DIM) for text in texts])
+    monkeypatch.setattr(batch, 'get_answer_cache', lambda: None)
+    monkeypatch.setattr(batch, 'get_async_client', FakeClient)
+    monkeypatch.setattr(batch, 'close_async_client', close_async_client)
+    monkeypatch.setattr(batch, 'generate_batch_answer', generate_batch_answer)
+    return answered
+
+
+def write_questions(path, queries):
+    path.write_text(''.join(json.dumps(query) + '\n' for query in queries))
+
+
+def test_read_questions(tmp_path):
+    path = tmp_path / 'questions.jsonl'
+    path.write_text('{"id": "a", "query": " What is a batch? "}\n\n{"query": "What is a repository?"}\n')
+    assert read_questions(path) == [('a', "What is a batch?"), ('3', "What is a repository?")]
+    path.write_text('{"id": "a"}\n')
+    with pytest.raises(ValueError):
+        read_questions(path)
+
+
+def test_failed_and_cut_off_answers_are_not_answered(tmp_path):
+    path = tmp_path / 'answers.jsonl'
+    assert read_answered_ids(path) == set()
+    path.write_text('{"id": "1", "answer": "A"}\n{"id": "2", "answer": null, "error": "Rate limit reached"}\n{"id": "3", "ans')
+    assert read_answered_ids(path) == {'1'}
+
+
+def test_interrupted_batch_is_resumed(tmp_path, answered):
+    questions = tmp_path / 'questions.jsonl'
+    output = tmp_path / 'answers.jsonl'
+    write_questions(questions, [{'id': str(i), 'query': f"question {i}"} for i in range(1, 5)])
+    output.write_text('{"id": "1", "answer": "Answer to question 1"}\n{"id": "2", "answer": null, "error": "Rate limit reached"}\n{"id": "3", "ans')
+
+    assert run_batch(questions, output, concurrency=2) == 3
+    assert sorted(answered) == ["question 2", "question 3", "question 4"]
+    lines = output.read_text().splitlines()
+    # The cut off line stays, and the answers continue on a new line after it
+    assert lines[2] == '{"id": "3", "ans'
+    assert sorted(json.loads(line)['answer'] for line in lines[3:]) == ["Answer to question 2", "Answer to question 3", "Answer to question 4"]
+    assert read_answered_ids(output) == {'1', '2', '3', '4'}
+
+    answered.clear()
+    assert run_batch(questions, output) == 0
+    assert answered == []
+
+
+def test_failed_questions_are_retried_on_the_next_run(tmp_path, answered):
+    questions = tmp_path / 'questions.jsonl'
+    output = tmp_path / 'answers.jsonl'
+    write_questions(questions, [{'id': 'ok', 'query': "question"}, {'id': 'bad', 'query': "fail once"}])
+    assert run_batch(questions, output) == 1
+    assert read_answered_ids(output) == {'ok'}
+
+    write_questions(questions, [{'id': 'ok', 'query': "question"}, {'id': 'bad', 'query': "works now"}])
+    answered.clear()
+    assert run_batch(questions, output) == 1
+    assert answered == ["works now"]
+    assert read_answered_ids(output) == {'ok', 'bad'}
@@ -0,0 +1,65 @@
+import sqlite3
+from types import SimpleNamespace
+import pytest
+from cosmic-python-rag_rag.data import cache as cache_module
+from cosmic-python-rag_rag.data.cache import PersistentCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(cache_module, 'time', SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def last_access(path):
+    connection = sqlite3.connect(str(path))
+    try:
+        return dict(connection.execute("SELECT key, last_access FROM cache"))
+    finally:
+        connection.close()
+
+
+def test_get_many_and_set_many(tmp_path, clock):
+    cache = PersistentCache(tmp_path / 'cache.sqlite')
+    cache.set_many([('a', b'1'), ('b', b'22')])
+    cache.set('c', b'333')
+    assert cache.get_many(['c', 'missing', 'a', 'a']) == [b'333', None, b'1', b'1']
+    assert cache.total_bytes == 6
+    cache.set_many([('a', b'4444')])
+    assert cache.total_bytes == 9
+    cache.close()
+
+    # Read back from disk, not from the in-memory LRU
+    reopened = PersistentCache(tmp_path / 'cache.sqlite')
+    assert reopened.get_many(['a', 'b', 'c']) == [b'4444', b'22', b'333']
+    assert reopened.connection.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    reopened.close()
+
+
+def test_reads_are_written_in_bulk(tmp_path, clock):
+    path = tmp_path / 'cache.sqlite'
+    cache = PersistentCache(path, touch_batch=3)
+    cache.set_many([('a', b'1'), ('b', b'1'), ('c', b'1')])
+    clock.now += 1
+    cache.get_many(['a', 'b'])
+    assert last_access(path) == {'a': 1000.0, 'b': 1000.0, 'c': 1000.0}
+    cache.get('c')
+    assert last_access(path) == {'a': 1001.0, 'b': 1001.0, 'c': 1001.0}
+    clock.now += 1
+    cache.get('a')
+    cache.close()
+    assert last_access(path)['a'] == 1002.0
+
+
+def test_memory_hits_keep_entries_from_eviction(tmp_path, clock):
+    cache = PersistentCache(tmp_path / 'cache.sqlite', max_bytes=3)
+    for key in ('a', 'b', 'c'):
+        cache.set(key, b'1')
+        clock.now += 1
+    # Served from memory, the oldest entry becomes the most recently used
+    assert cache.get('a') == b'1'
+    clock.now += 1
+    cache.set('d', b'1')
+    assert cache.get_many(['a', 'b', 'c', 'd']) == [b'1', None, b'1', b'1']
+    cache.close()
@@ -0,0 +1,58 @@
+from cosmic-python-rag_rag.context import count_tokens, split_section
+from cosmic-python-rag_rag.data.chunking import chunk_section, chunk_sentences
+
+
+def long_section(num_sentences=40):
+    sentences = [f"Sentence number {i} talks about batches and allocations." for i in range(num_sentences)]
+    return {
+        'section_title': "1.1 Batches",
+        'text_content': "1.1 Batches\n\n" + ' '.join(sentences),
+        'code_blocks': [{'code': "model.py\nclass Batch: pass"}],
+    }
+
+
+def test_short_section_is_one_text_chunk_plus_its_code_blocks():
+    section = {'section_title': "Intro", 'text_content': "Intro\n\nShort text.", 'code_blocks': [{'code': "a.py\nx = 1"}]}
+    assert chunk_section(section) == ["Intro\n\nShort text.", "Intro\n\na.py\nx = 1"]
+
+
+def test_long_section_is_split_into_overlapping_chunks():
+    section = long_section()
+    chunks = chunk_section(section, chunk_tokens=60, overlap_tokens=15)
+    text_chunks, code_chunks = chunks[:-1], chunks[-1:]
+    assert code_chunks == ["1.1 Batches\n\nmodel.py\nclass Batch: pass"]
+    assert len(text_chunks) > 1
+    assert all(chunk.startswith("1.1 Batches\n\n") for chunk in text_chunks)
+
+    _, sentences = split_section(section)
+    windows = [chunk.split("\n\n", 1)[1] for chunk in text_chunks]
+    for previous, window in zip(windows, windows[1:]):
+        # Every chunk starts with the last sentences of the previous one
+        first_sentence = window.split('. ')[0] + '.'
+        assert first_sentence in previous and not previous.startswith(first_sentence)
+    # Every sentence is in some chunk
+    assert all(any(sentence in window for window in windows) for sentence in sentences)
+
+
+def test_windows_respect_the_token_limits():
+    sentences = [f"Sentence {i} is about the repository pattern." for i in range(30)]
+    tokens = {sentence: count_tokens(sentence) + 1 for sentence in sentences}
+    windows = chunk_sentences(sentences, chunk_tokens=60, overlap_tokens=30)
+    assert windows[0][0] == sentences[0] and windows[-1][-1] == sentences[-1]
+    for window, next_window in zip(windows, windows[1:]):
+        assert sum(tokens[sentence] for sentence in window) <= 60
+        # The next window starts inside this one, with at most overlap_tokens of it
+        overlap = sentences[sentences.index(next_window[0]):sentences.index(window[-1]) + 1]
+        assert window[-len(overlap):] == next_window[:len(overlap)] == overlap
+        assert 0 < sum(tokens[sentence] for sentence in overlap) <= 30
+
+
+def test_no_overlap():
+    sentences = [f"Sentence {i} is about the repository pattern." for i in range(30)]
+    windows = chunk_sentences(sentences, chunk_tokens=40, overlap_tokens=0)
+    assert [sentence for window in windows for sentence in window] == sentences
+
+
+def test_sentence_longer_than_a_chunk_is_a_window_of_its_own():
+    sentences = ["Short one.", "word " * 100, "Another short one."]
+    assert chunk_sentences(sentences, chunk_tokens=10, overlap_tokens=5) == [[sentence] for sentence in sentences]
@@ -0,0 +1,54 @@
+from cosmic-python-rag_rag.config import RAG_PROMPT
+from cosmic-python-rag_rag.context import build_context, count_tokens
+
+
+def make_section(title, sentences, code=()):
+    return {
+        'section_title': title,
+        'text_content': f"{title}\n\n{' '.join(sentences)}",
+        'code_snippets': [{'code': block} for block in code],
+    }
+
+
+def filler(topic, count):
+    return [f"This is filler sentence {i} about {topic} and nothing else of note." for i in range(count)]
+
+
+SECTIONS = [
+    make_section("1.1 Batches", filler("stock", 20) + ["The allocate function assigns an order line to a batch."], code=["def allocate(line, batches): ..."]),
+    make_section("2.1 Repository", filler("storage", 20) + ["The repository adds a batch with add_batch."]),
+    make_section("3.1 Events", ["Events are short."]),
+]
+
+
+def test_everything_fits_in_a_large_budget():
+    context, report = build_context("How does allocate work?", SECTIONS, max_tokens=100_000)
+    assert report['trimmed_sections'] == 0 and report['sections'] == 3
+    assert "Section: 1.1 Batches" in context and "def allocate(line, batches): ..." in context
+    assert report['context_tokens'] == count_tokens(context)
+
+
+def test_sections_are_trimmed_to_the_budget():
+    query = "How does allocate assign a batch?"
+    max_tokens = count_tokens(RAG_PROMPT.format(sections='')) + count_tokens(query) + 150
+    context, report = build_context(query, SECTIONS, max_tokens=max_tokens)
+    assert report['prompt_tokens'] <= max_tokens
+    assert report['trimmed_sections'] == 2
+    # The short section is kept whole; trimmed sections keep the sentences that match the query
+    assert "Events are short." in context
+    assert "The allocate function assigns an order line to a batch." in context
+    assert "The repository adds a batch with add_batch." in context
+    assert "filler sentence 19 about stock" not in context
+
+
+def test_repeated_sentences_are_dropped():
+    duplicate = make_section("4.1 Again", ["Events are short.", "Something new."])
+    context, report = build_context("events", SECTIONS[2:] + [duplicate], max_tokens=100_000)
+    assert report['duplicates'] == 1
+    assert context.count("Events are short.") == 1 and "Something new." in context
+
+
+def test_zero_budget_leaves_the_sections_out():
+    context, report = build_context("allocate", SECTIONS, max_tokens=0)
+    assert context == ""
+    assert report['sections'] == 0 and report['trimmed_sections'] == 3
@@ -0,0 +1,82 @@
+from bs4 import BeautifulSoup
+from cosmic-python-rag_rag.data.data_cleaning import HTML_PARSER, clean_text, list_chapter_files, parse_chapter_files, parse_html_content_with_sections
+
+CHAPTER_HTML = """
+<html><head><title>Chapter 1:  Domain Modeling</title></head><body>
+<div class="title">Example 1. Model (model.py)</div>
+<div class="sect2">
+<h3>1.1 What Is a Domain Model?</h3>
+<p>The domain   model is
+the part of your code that is closest to the business — really.</p>
+<pre class="highlight"><code>class Batch:
+    pass</code></pre>
+<p>See <a href="#chapter_02_repository">Chapter 2</a> and <a href="https://example.com">a link</a>.</p>
+<div class="imageblock"><img src="images/model.png"></div>
+<div class="title">Figure 1. A domain model</div>
+<div class="title">Example 2. Tests (test_model.py)</div>
+<pre class="highlight"><code>def test_allocate():
+    ...</code></pre>
+<pre><code>not highlighted</code></pre>
+<div class="imageblock"><img src="images/last.png"></div>
+</div>
+<div class="title">Figure 2. After the section</div>
+<div class="sect2"><p>No heading</p></div>
+</body></html>
+"""
+
+
+def parse(html=CHAPTER_HTML):
+    return parse_html_content_with_sections(BeautifulSoup(html, HTML_PARSER))
+
+
+def test_clean_text_removes_non_ascii_and_repeated_whitespace():
+    assert clean_text("  café \n\t au   lait ") == "caf au lait"
+
+
+def test_chapter_and_section_titles():
+    chapter = parse()
+    assert chapter['title'] == "Chapter 1: Domain Modeling"
+    assert [section['section_title'] for section in chapter['sections']] == ["1.1 What Is a Domain Model?", "Untitled Section"]
+    assert parse("<html><body></body></html>") == {'title': 'Untitled Chapter', 'sections': []}
+
+
+def test_text_content_joins_cleaned_paragraphs_after_the_title():
+    section = parse()['sections'][0]
+    assert section['text_content'] == (
+        "1.1 What Is a Domain Model?\n\n"
+        "The domain model is the part of your code that is closest to the business really. See Chapter 2 and a link."
+    )
+
+
+def test_code_blocks_take_the_title_before_them():
+    code_blocks = parse()['sections'][0]['code_blocks']
+    # The title of the first code block precedes the section; unhighlighted blocks are skipped
+    assert code_blocks == [
+        {'title': "Example 1. Model (model.py)", 'code': "Example 1. Model (model.py)\nclass Batch:\n    pass"},
+        {'title': "Example 2. Tests (test_model.py)", 'code': "Example 2. Tests (test_model.py)\ndef test_allocate():\n    ..."},
+    ]
+
+
+def test_images_take_the_title_after_them():
+    images = parse()['sections'][0]['images']
+    # The title of the last image follows the section
+    assert images == [
+        {'src': "images/model.png", 'description': "Figure 1. A domain model"},
+        {'src': "images/last.png", 'description': "Figure 2. After the section"},
+    ]
+
+
+def test_references_are_links_to_chapters():
+    assert parse()['sections'][0]['references'] == [{'chapter_ref': "chapter_02_repository", 'text': "Chapter 2"}]
+
+
+def test_parse_chapter_files_in_parallel(tmp_path):
+    for number in (10, 2, 1):
+        (tmp_path / f"chapter_{number}.html").write_text(CHAPTER_HTML.replace("Chapter 1:", f"Chapter {number}:"))
+    (tmp_path / "preface.html").write_text(CHAPTER_HTML)
+
+    chapter_files = list_chapter_files(tmp_path)
+    assert sorted(chapter_files) == ['01', '02', '10']
+    chapters = parse_chapter_files(chapter_files, workers=2)
+    assert list(chapters) == list(chapter_files)
+    assert chapters['10'] == parse(CHAPTER_HTML.replace("Chapter 1:", "Chapter 10:"))
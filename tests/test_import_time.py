@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+from cosmic-python-rag_rag import context
+
+PACKAGE = context.__package__
+QUERY_PATH_MODULES = ['main', 'server', 'corpus', 'registry', 'retreival', 'generation', 'context']
+
+# Stand-ins for the optional packages, so the test does not depend on whether they are installed
+STUB_PACKAGES = {
+    'tiktoken/__init__.py': (
+        "class Encoding:\n"
+        "    def encode(self, text, disallowed_special=()):\n"
+        "        return text.split()\n"
+        "def encoding_for_model(model):\n"
+        "    return Encoding()\n"
+    ),
+    'opentelemetry/__init__.py': "",
+    'opentelemetry/trace.py': "def get_tracer(name):\n    return object()\n",
+    'opentelemetry/metrics.py': "def get_meter(name):\n    return object()\n",
+}
+
+
+def run_with_optional_packages(tmp_path, code):
+    for name, source in STUB_PACKAGES.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(source)
+    package_parent = Path(context.__file__).resolve().parent.parent
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(tmp_path), str(package_parent)]))
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env, cwd=tmp_path, check=True)
+    return result.stdout.split()
+
+
+def test_query_path_does_not_import_optional_packages(tmp_path):
+    imports = '; '.join(f"import {PACKAGE}.{module}" for module in QUERY_PATH_MODULES)
+    loaded = run_with_optional_packages(tmp_path, f"import sys; {imports}; print('tiktoken' in sys.modules, 'opentelemetry' in sys.modules)")
+    assert loaded == ['False', 'False']
+
+
+def test_optional_packages_are_imported_on_first_use(tmp_path):
+    loaded = run_with_optional_packages(tmp_path, (
+        f"import sys; from {PACKAGE}.context import count_tokens; from {PACKAGE}.instrumentation import OpenTelemetryExporter; "
+        "print(count_tokens('three token text')); OpenTelemetryExporter(); print('tiktoken' in sys.modules, 'opentelemetry' in sys.modules)"
+    ))
+    assert loaded == ['3', 'True', 'True']
@@ -0,0 +1,138 @@
+from functools import partial
+import numpy as np
+import pytest
+from cosmic-python-rag_rag import indexing
+from cosmic-python-rag_rag.benchmark import fake_embedding
+from cosmic-python-rag_rag.data import fingerprints
+from cosmic-python-rag_rag.data.chunking import chunk_section
+from cosmic-python-rag_rag.data.store import load_processed_data_with_embeddings
+
+DIM = 32
+
+
+def chapter_html(number, first_paragraph="Batches of stock are allocated to order lines."):
+    return f"""
+<html><head><title>Chapter {number}: Topic {number}</title></head><body>
+<div class="sect2"><h3>{number}.1 First</h3><p>{first_paragraph}</p>
+<pre class="highlight"><code>class Batch{number}: pass</code></pre></div>
+<div class="sect2"><h3>{number}.2 Second</h3><p>The repository of chapter {number} hides the storage of aggregates.</p></div>
+</body></html>
+"""
+
+
+class FakeAPI:
+    """
+    Records the texts sent for embedding and the chapters sent for summarizing.
+    """
+
+    def __init__(self, monkeypatch):
+        self.embedded = []
+        self.summarized = []
+        monkeypatch.setattr(indexing, 'get_embeddings_batch', self.get_embeddings_batch)
+        monkeypatch.setattr(indexing, 'generate_chapter_summary', self.generate_chapter_summary)
+
+    def get_embeddings_batch(self, texts):
+        self.embedded.extend(texts)
+        return [fake_embedding(text, DIM) for text in texts]
+
+    def generate_chapter_summary(self, chapter_text):
+        self.summarized.append(chapter_text)
+        return f"Summary of: {chapter_text}"
+
+    def reset(self):
+        self.embedded.clear()
+        self.summarized.clear()
+
+
+@pytest.fixture
+def book(tmp_path, monkeypatch):
+    raw_dir = tmp_path / 'raw'
+    raw_dir.mkdir()
+    for number in (1, 2, 3):
+        (raw_dir / f"chapter_{number}.html").write_text(chapter_html(number))
+    api = FakeAPI(monkeypatch)
+    indexing.process_and_index_chapters(raw_dir=raw_dir, processed_dir=tmp_path / 'processed')
+    api.reset()
+    return raw_dir, tmp_path / 'processed', api
+
+
+def test_full_index(book):
+    _, processed_dir, _ = book
+    processed_data = load_processed_data_with_embeddings(processed_dir)
+    assert list(processed_data) == ['01', '02', '03']
+    first = processed_data['01']['sections'][0]
+    # One text chunk and one code chunk
+    assert len(first['chunk_embeddings']) == 2
+
+
+def test_unchanged_book_is_not_reembedded(book):
+    raw_dir, processed_dir, api = book
+    before = load_processed_data_with_embeddings(processed_dir)
+    indexing.process_and_index_chapters(incremental=True, raw_dir=raw_dir, processed_dir=processed_dir)
+    assert api.embedded == [] and api.summarized == []
+
+    after = load_processed_data_with_embeddings(processed_dir)
+    assert after.keys() == before.keys()
+    for chapter_num in before:
+        assert after[chapter_num]['chapter_summary'] == before[chapter_num]['chapter_summary']
+        for old, new in zip(before[chapter_num]['sections'], after[chapter_num]['sections']):
+            assert [list(embedding) for embedding in new['chunk_embeddings']] == [list(embedding) for embedding in old['chunk_embeddings']]
+
+
+def test_only_changed_chunks_are_reembedded(book):
+    raw_dir, processed_dir, api = book
+    (raw_dir / "chapter_2.html").write_text(chapter_html(2, "Batches are now allocated by the domain service."))
+    indexing.process_and_index_chapters(incremental=True, raw_dir=raw_dir, processed_dir=processed_dir)
+
+    # The changed text chunk and the new summary of its chapter; the code block and the other section are reused
+    assert len(api.summarized) == 1
+    changed_chunk = "2.1 First\n\nBatches are now allocated by the domain service."
+    assert sorted(api.embedded) == sorted([changed_chunk, f"Summary of: {api.summarized[0]}"])
+    processed_data = load_processed_data_with_embeddings(processed_dir)
+    assert list(processed_data['02']['sections'][0]['chunk_embeddings'][0]) == list(fake_embedding(changed_chunk, DIM))
+
+
+def test_markup_change_keeps_the_summary(book):
+    raw_dir, processed_dir, api = book
+    (raw_dir / "chapter_3.html").write_text(chapter_html(3).replace("<body>", "<body>\n<!-- edited -->"))
+    indexing.process_and_index_chapters(incremental=True, raw_dir=raw_dir, processed_dir=processed_dir)
+    assert api.embedded == [] and api.summarized == []
+
+
+def test_deleted_chapters_are_dropped(book):
+    raw_dir, processed_dir, api = book
+    (raw_dir / "chapter_3.html").unlink()
+    indexing.process_and_index_chapters(incremental=True, raw_dir=raw_dir, processed_dir=processed_dir)
+    assert list(load_processed_data_with_embeddings(processed_dir)) == ['01', '02']
+    assert api.embedded == []
+
+
+def test_chunking_change_reindexes_every_chapter(book, monkeypatch):
+    raw_dir, processed_dir, api = book
+    (raw_dir / "chapter_1.html").write_text(chapter_html(1, "Batches hold stock. Order lines need stock. Allocation links them."))
+    indexing.process_and_index_chapters(incremental=True, raw_dir=raw_dir, processed_dir=processed_dir)
+    before = load_processed_data_with_embeddings(processed_dir)
+    api.reset()
+
+    # As if CHUNK_TOKENS was edited in config.py between the runs
+    monkeypatch.setattr(fingerprints, 'CHUNK_TOKENS', 8)
+    monkeypatch.setattr(indexing, 'chunk_section', partial(chunk_section, chunk_tokens=8))
+    indexing.process_and_index_chapters(incremental=True, raw_dir=raw_dir, processed_dir=processed_dir)
+
+    after = load_processed_data_with_embeddings(processed_dir)
+    assert len(after['01']['sections'][0]['chunk_embeddings']) > len(before['01']['sections'][0]['chunk_embeddings'])
+    # Unchanged chapters are chunked and embedded again too
+    expected = [
+        chunk for chapter_data in after.values() for section in chapter_data['sections']
+        for chunk in chunk_section(section, chunk_tokens=8)
+    ]
+    assert set(expected) <= set(api.embedded)
+    for chapter_data in after.values():
+        for section in chapter_data['sections']:
+            chunks = chunk_section(section, chunk_tokens=8)
+            np.testing.assert_allclose(section['chunk_embeddings'], [fake_embedding(chunk, DIM) for chunk in chunks], rtol=1e-5)
+
+    # The next run with the same settings reuses everything
+    api.reset()
+    indexing.process_and_index_chapters(incremental=True, raw_dir=raw_dir, processed_dir=processed_dir)
+    assert api.embedded == [] and api.summarized == []
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from cosmic-python-rag_rag.benchmark import fake_embedding
+from cosmic-python-rag_rag.quantization import CompactMatrix, build_compact_matrix, load_compact_matrix
+from cosmic-python-rag_rag.vector_index import VectorIndex, normalize_rows, top_k
+
+DIM = 64
+
+
+@pytest.fixture
+def matrix():
+    return normalize_rows(np.array([fake_embedding(f"chunk {i}", DIM) for i in range(500)]))
+
+
+def test_int8_round_trip(matrix):
+    compact = CompactMatrix.encode(matrix, 'int8')
+    assert compact.data.dtype == np.int8 and compact.scales.dtype == np.float32
+    assert compact.nbytes == matrix.size + 4 * len(matrix)
+    decoded = compact.data.astype(np.float32) * compact.scales[:, None]
+    # Rounding to the nearest of 255 levels per row
+    assert np.abs(decoded - matrix).max() <= compact.scales.max() / 2 + 1e-6
+
+
+@pytest.mark.parametrize('precision, tolerance', [('float32', 1e-6), ('float16', 1e-3), ('int8', 2e-2)])
+def test_compact_scores_approximate_float32(matrix, precision, tolerance):
+    compact = CompactMatrix.encode(matrix, precision)
+    queries = np.array([fake_embedding(f"query {i}", DIM) for i in range(5)])
+    np.testing.assert_allclose(compact.score_batch(queries), queries @ matrix.T, atol=tolerance)
+    rows = np.array([3, 1, 400])
+    np.testing.assert_allclose(compact.score(queries[0], rows), matrix[rows] @ queries[0], atol=tolerance)
+
+
+def test_truncated_dimensions_are_renormalized(matrix):
+    compact = CompactMatrix.encode(matrix, 'float16', dimensions=16)
+    assert compact.dimensions == 16
+    np.testing.assert_allclose(np.linalg.norm(compact.data.astype(np.float32), axis=1), 1.0, atol=1e-3)
+    query = fake_embedding("query", DIM)
+    np.testing.assert_allclose(compact.score(query), normalize_rows(matrix[:, :16]) @ (query[:16] / np.linalg.norm(query[:16])), atol=1e-3)
+
+
+def test_save_and_load(tmp_path, matrix):
+    compact = CompactMatrix.encode(matrix, 'int8')
+    compact.save(tmp_path)
+    loaded = CompactMatrix.load(tmp_path, matrix, 'int8')
+    np.testing.assert_array_equal(loaded.data, compact.data)
+    np.testing.assert_array_equal(loaded.scales, compact.scales)
+    # Stale compact matrices are encoded again
+    with pytest.raises(ValueError):
+        CompactMatrix.load(tmp_path, matrix, 'float16')
+    assert load_compact_matrix(tmp_path, matrix, 'float16').precision == 'float16'
+    assert build_compact_matrix(matrix, 'float32') is None
+
+
+def test_rescoring_restores_the_float32_ranking(processed_data):
+    index = VectorIndex.from_processed_data(processed_data)
+    query = fake_embedding("query", index.chunk_matrix.shape[1])
+    rows = np.arange(len(index.section_ids))
+    exact = index.score_section_rows(query, rows)
+
+    index.attach_compact(CompactMatrix.encode(index.chunk_matrix, 'int8'), rescore_candidates=5)
+    rescored = index.rescore(query, rows, index.score_section_rows(query, rows))
+    best = top_k(exact, 3)
+    np.testing.assert_allclose(rescored[best], exact[best], rtol=1e-6)
+    assert list(top_k(rescored, 3)) == list(best)
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from cosmic-python-rag_rag.bm25 import BM25Index, tokenize
+from cosmic-python-rag_rag.config import HYBRID_DENSE_WEIGHT, RRF_K
+from cosmic-python-rag_rag.retreival import fuse_scores, rank_positions
+
+
+def section(text, code=()):
+    return {'text_content': text, 'code_blocks': [{'code': block} for block in code]}
+
+
+CORPUS = {
+    '01': {'sections': [
+        section("Batches\n\nA batch of stock is allocated to an order line."),
+        section("Repository\n\nThe repository pattern hides storage.", code=["def add_batch(batch): ..."]),
+    ]},
+    '02': {'sections': [
+        section("Unit of work\n\nThe repository commits repository changes."),
+        section("Events\n\nDomain events are raised by the model."),
+    ]},
+}
+
+
+def test_tokenize_keeps_identifiers_whole():
+    assert tokenize("Call add_batch() NOW") == ['call', 'add_batch', 'now']
+
+
+def test_bm25_ranks_sections_by_query_terms(tmp_path):
+    index = BM25Index.from_processed_data(CORPUS)
+    scores = index.score("repository")
+    assert scores.shape == (4,)
+    assert scores[0] == scores[3] == 0
+    # Two occurrences outscore one in a section of about the same length
+    assert scores[2] > scores[1] > 0
+    # Terms in code blocks are indexed
+    assert index.score("add_batch")[1] > 0
+    assert not index.score("unknown words").any()
+
+    index.save(tmp_path)
+    np.testing.assert_array_equal(BM25Index.load(tmp_path).score("batch repository"), index.score("batch repository"))
+
+
+def test_bm25_rare_terms_weigh_more():
+    index = BM25Index.from_processed_data(CORPUS)
+    # 'the' occurs in three sections, 'events' in one
+    assert index.score("events")[3] > index.score("the")[3]
+
+
+def test_bm25_of_an_empty_corpus():
+    assert len(BM25Index.from_processed_data({}).score("batch")) == 0
+
+
+def test_rrf_sums_reciprocal_ranks():
+    dense = np.array([0.9, 0.5, 0.1])
+    lexical = np.array([0.0, 2.0, 1.0])
+    assert list(rank_positions(dense)) == [0, 1, 2]
+    fused = fuse_scores(dense, lexical, 'rrf')
+    # Sections without any query term get no lexical contribution
+    expected = [1 / (RRF_K + 1), 1 / (RRF_K + 2) + 1 / (RRF_K + 1), 1 / (RRF_K + 3) + 1 / (RRF_K + 2)]
+    np.testing.assert_allclose(fused, expected)
+    assert list(np.argsort(-fused)) == [1, 2, 0]
+
+
+def test_weighted_fusion_of_normalized_scores():
+    dense = np.array([0.9, 0.5, 0.1])
+    lexical = np.array([0.0, 4.0, 2.0])
+    fused = fuse_scores(dense, lexical, 'weighted')
+    expected = HYBRID_DENSE_WEIGHT * np.array([1.0, 0.5, 0.0]) + (1 - HYBRID_DENSE_WEIGHT) * np.array([0.0, 1.0, 0.5])
+    np.testing.assert_allclose(fused, expected)
+    # Constant scores normalize to zero instead of dividing by zero
+    np.testing.assert_allclose(fuse_scores(dense, np.zeros(3), 'weighted'), HYBRID_DENSE_WEIGHT * np.array([1.0, 0.5, 0.0]))
+
+
+def test_unknown_fusion_method():
+    with pytest.raises(ValueError):
+        fuse_scores(np.zeros(1), np.zeros(1), 'max')
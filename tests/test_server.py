@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+from aiohttp.test_utils import TestClient, TestServer
+from cosmic-python-rag_rag import server
+from cosmic-python-rag_rag.server import create_app
+
+SEARCH_DELAY = 0.5
+
+
+class SlowRegistry:
+    """
+    Registry whose searches block their thread for SEARCH_DELAY seconds, like a slow shard search or load.
+    """
+
+    names = ['book']
+
+    def __init__(self):
+        self.threads = set()
+
+    def select(self, corpora=None):
+        return self.names
+
+    def loaded_names(self):
+        return self.names
+
+    def get_lexical_retrieval(self, query, corpora=None):
+        self.threads.add(threading.get_ident())
+        time.sleep(SEARCH_DELAY)
+        return [{'chapter_num': 'book/01', 'section_title': query, 'similarity_score': 1.0}], {}
+
+    def load(self, name):
+        self.threads.add(threading.get_ident())
+        time.sleep(SEARCH_DELAY)
+
+
+def run_concurrently(monkeypatch, registry, requests):
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+
+    async def run():
+        async with TestClient(TestServer(create_app(registry))) as client:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*(client.post(path, json=body) for path, body in requests))
+            elapsed = time.perf_counter() - start
+            return [response.status for response in responses], elapsed, threading.get_ident()
+
+    return asyncio.run(run())
+
+
+def test_concurrent_searches_overlap(monkeypatch):
+    registry = SlowRegistry()
+    statuses, elapsed, loop_thread = run_concurrently(
+        monkeypatch, registry, [('/retrieve', {'query': 'add_batch'}), ('/retrieve', {'query': 'allocate'})]
+    )
+    assert statuses == [200, 200]
+    # Run one after the other on the event loop, the two searches would take 2 * SEARCH_DELAY
+    assert elapsed < 1.5 * SEARCH_DELAY
+    assert loop_thread not in registry.threads
+
+
+def test_shard_load_does_not_block_searches(monkeypatch):
+    registry = SlowRegistry()
+    statuses, elapsed, loop_thread = run_concurrently(
+        monkeypatch, registry, [('/corpora/book/load', None), ('/retrieve', {'query': 'add_batch'})]
+    )
+    assert statuses == [200, 200]
+    assert elapsed < 1.5 * SEARCH_DELAY
+    assert loop_thread not in registry.threads
+
+
+class DenseRegistry(SlowRegistry):
+    """
+    Registry whose queries all need an embedding and are searched instantly.
+    """
+
+    def get_lexical_retrieval(self, query, corpora=None):
+        return None
+
+    def get_rag_response(self, query, query_embedding, corpora=None):
+        return [{'chapter_num': 'book/01', 'section_title': query, 'similarity_score': 1.0}], {}
+
+
+def test_query_embedding_cache_does_not_block_searches(monkeypatch):
+    cache_threads = set()
+
+    def get_cached_embeddings(texts):
+        # A slow disk under the persistent cache
+        cache_threads.add(threading.get_ident())
+        time.sleep(SEARCH_DELAY)
+        return [[1.0, 0.0]] * len(texts)
+
+    monkeypatch.setattr(server, 'get_cached_embeddings', get_cached_embeddings)
+    statuses, elapsed, loop_thread = run_concurrently(
+        monkeypatch, DenseRegistry(), [('/retrieve', {'query': 'add_batch'}), ('/retrieve', {'query': 'allocate'})]
+    )
+    assert statuses == [200, 200]
+    assert elapsed < 1.5 * SEARCH_DELAY
+    assert cache_threads and loop_thread not in cache_threads
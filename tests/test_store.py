@@ -0,0 +1,44 @@
+import numpy as np
+from cosmic-python-rag_rag import corpus as corpus_module
+from cosmic-python-rag_rag.corpus import load_corpus
+from cosmic-python-rag_rag.data.store import load_processed_data_with_embeddings, read_manifest, store_unchanged, write_manifest
+from cosmic-python-rag_rag.vector_index import CHUNK_EMBEDDINGS_FILENAME, atomic_write
+
+
+def test_store_round_trip(store_dir, processed_data):
+    loaded = load_processed_data_with_embeddings(store_dir)
+    assert list(loaded) == list(processed_data)
+    for chapter_num, chapter in processed_data.items():
+        assert [section['section_title'] for section in loaded[chapter_num]['sections']] == [section['section_title'] for section in chapter['sections']]
+        for section, loaded_section in zip(chapter['sections'], loaded[chapter_num]['sections']):
+            expected = np.array(section.get('chunk_embeddings', [section.get('embedding')]), dtype=np.float32)
+            expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+            np.testing.assert_allclose(np.array(loaded_section['chunk_embeddings']), expected, atol=1e-6)
+
+
+def test_load_checks_the_manifest(store_dir, monkeypatch):
+    monkeypatch.setattr(corpus_module, 'STORE_LOAD_RETRY_DELAY', 0)
+    manifest = read_manifest(store_dir)
+    assert store_unchanged(store_dir, manifest)
+    load_corpus(store_dir).sections.close()
+
+    # A file replaced by an update that has not written its manifest yet
+    chunk_matrix = np.load(store_dir / CHUNK_EMBEDDINGS_FILENAME)
+    with atomic_write(store_dir / CHUNK_EMBEDDINGS_FILENAME) as f:
+        np.save(f, chunk_matrix)
+    assert not store_unchanged(store_dir, manifest)
+    try:
+        load_corpus(store_dir, attempts=2)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("A store loaded during an update was not detected")
+
+    write_manifest(store_dir)
+    load_corpus(store_dir).sections.close()
+
+
+def test_stores_without_manifest_load(store_dir):
+    (store_dir / 'manifest.json').unlink()
+    assert read_manifest(store_dir) is None
+    load_corpus(store_dir).sections.close()
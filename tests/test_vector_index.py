@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from cosmic-python-rag_rag.benchmark import fake_embedding
+from cosmic-python-rag_rag.vector_index import VectorIndex, top_k
+
+DIM = 32
+# Chunks per section of the chunked corpus; chapter '01' has sections 0 and 1, chapter '02' section 2
+CHUNKS = {('01', 0): 3, ('01', 1): 1, ('02', 0): 2}
+
+
+@pytest.fixture
+def chunked_data(processed_data):
+    chunked = {}
+    for chapter_num in ('01', '02'):
+        chapter_data = dict(processed_data[chapter_num])
+        chapter_data['sections'] = [
+            {**section, 'chunk_embeddings': [fake_embedding(f"{section['section_title']} chunk {chunk}", DIM) for chunk in range(CHUNKS[(chapter_num, section_index)])]}
+            for section_index, section in enumerate(processed_data[chapter_num]['sections'][:2 if chapter_num == '01' else 1])
+        ]
+        chunked[chapter_num] = chapter_data
+    return chunked
+
+
+def test_top_k_returns_the_best_scores_in_order():
+    scores = np.array([0.1, 0.9, 0.5, 0.9, -1.0])
+    assert list(top_k(scores, 3)) == [1, 3, 2]
+    assert list(top_k(scores, 10)) == [1, 3, 2, 0, 4]
+    assert len(top_k(scores, 0)) == 0
+
+
+def test_scores_match_brute_force_cosine_similarity(processed_data):
+    index = VectorIndex.from_processed_data(processed_data)
+    query = fake_embedding("query", DIM) * 3
+
+    chapter_embeddings = np.array([chapter['chapter_summary_embedding'] for chapter in processed_data.values()])
+    expected = chapter_embeddings @ query / np.linalg.norm(chapter_embeddings, axis=1) / np.linalg.norm(query)
+    np.testing.assert_allclose(index.score_chapters(query), expected, rtol=1e-5)
+
+    rows, scores = index.score_sections(query, ['02', 'missing'])
+    assert [index.section_ids[row] for row in rows] == [('02', section_index) for section_index in range(4)]
+    section_embeddings = np.array([section['embedding'] for section in processed_data['02']['sections']])
+    np.testing.assert_allclose(scores, section_embeddings @ query / np.linalg.norm(query), rtol=1e-5)
+
+
+def test_sections_score_as_their_best_chunk(chunked_data):
+    index = VectorIndex.from_processed_data(chunked_data)
+    assert index.section_ids == [('01', 0), ('01', 1), ('02', 0)]
+    assert list(index.chunk_offsets) == [0, 3, 4, 6]
+
+    query = fake_embedding("query", DIM)
+    chunk_scores = index.chunk_matrix @ query
+    best_chunks = np.array([chunk_scores[0:3].max(), chunk_scores[3], chunk_scores[4:6].max()])
+    np.testing.assert_allclose(index.score_all_sections_batch(query[None, :])[0], best_chunks, rtol=1e-5)
+    # Rows in any order, each reduced over its own chunks
+    np.testing.assert_allclose(index.score_section_rows(query, np.array([2, 0])), best_chunks[[2, 0]], rtol=1e-5)
+    _, scores = index.score_sections(query, ['01'])
+    np.testing.assert_allclose(scores, best_chunks[:2], rtol=1e-5)
+
+
+def test_chunk_results_are_aggregated_to_sections(chunked_data):
+    index = VectorIndex.from_processed_data(chunked_data)
+    rows, scores = index.chunks_to_sections(np.array([0, 1, 4, 3]), np.array([0.2, 0.7, 0.5, 0.6]))
+    assert list(rows) == [0, 1, 2]
+    np.testing.assert_allclose(scores, [0.7, 0.6, 0.5])
+
+
+def test_save_and_load_round_trip(tmp_path, chunked_data):
+    index = VectorIndex.from_processed_data(chunked_data)
+    index.save(tmp_path)
+    loaded = VectorIndex.load(tmp_path)
+    query = fake_embedding("query", DIM)
+    assert loaded.section_ids == index.section_ids
+    np.testing.assert_array_equal(loaded.score_section_rows(query, np.arange(3)), index.score_section_rows(query, np.arange(3)))